@@ -0,0 +1,69 @@
+"""Kodlar katalogi xotira benchmarki
+
+Oddiy keshni (normallashtirilgan kod -> to'liq Mongo hujjati) ixcham
+CodeCatalog bilan solishtiradi: egallangan xotira va qidiruv tezligi.
+
+Foydalanish: python bench_catalog_memory.py [KODLAR_SONI]
+"""
+import sys
+import time
+import random
+import tracemalloc
+from datetime import datetime
+
+from bson import ObjectId
+
+import main
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+def make_docs(count, seed=42):
+    """codes_collection dagi hujjatlarga o'xshash sun'iy ma'lumotlar"""
+    rng = random.Random(seed)
+    for i in range(count):
+        post_count = rng.choice((1, 1, 1, 2, 3, 5, 10))
+        first = rng.randint(1, 2_000_000)
+        post_ids = list(range(first, first + post_count))
+        yield {
+            "_id": ObjectId(),
+            "code": f"Kino{i}" if i % 3 else str(1000 + i),
+            "post_ids": post_ids,
+            "post_id": post_ids[0] if post_count == 1 else None,
+            "added_at": datetime.now(),
+            "added_by": 123456789
+        }
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, used
+
+def naive_cache():
+    return {main.normalize_code(doc['code']): doc for doc in make_docs(COUNT)}
+
+def compact_catalog():
+    return main.CodeCatalog.from_docs(make_docs(COUNT))
+
+naive, naive_bytes = measure(naive_cache)
+compact, compact_bytes = measure(compact_catalog)
+
+keys = list(naive)
+random.Random(1).shuffle(keys)
+keys = keys[:50_000]
+
+started = time.perf_counter()
+for key in keys:
+    list(naive[key]['post_ids'])
+naive_lookup = (time.perf_counter() - started) / len(keys) * 1e6
+
+started = time.perf_counter()
+for key in keys:
+    list(compact.post_ids(compact.get(key)))
+compact_lookup = (time.perf_counter() - started) / len(keys) * 1e6
+
+print(f"📦 Kodlar soni: {COUNT}")
+print(f"   Oddiy kesh (hujjatlar):  {naive_bytes / 1024 / 1024:8.1f} MB  ({naive_bytes / COUNT:6.0f} bayt/kod)  qidiruv {naive_lookup:.2f} µs")
+print(f"   Ixcham katalog:          {compact_bytes / 1024 / 1024:8.1f} MB  ({compact_bytes / COUNT:6.0f} bayt/kod)  qidiruv {compact_lookup:.2f} µs")
+print(f"   Tejash: {naive_bytes / compact_bytes:.1f}x")
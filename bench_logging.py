@@ -0,0 +1,52 @@
+"""Loglash xarajati benchmarki
+
+Hot path dagi bitta log chaqiruvi event loop ga qancha vaqt yuklashini o'lchaydi:
+o'chirilgan daraja, sampling bilan tashlangan hodisa, navbatga qo'yiladigan
+yozuv va avvalgi sinxron print() bilan solishtiriladi. Yozuvchi oqim chiqishi
+/dev/null ga yo'naltiriladi.
+
+Foydalanish: python bench_logging.py [CHAQIRUVLAR=200000]
+"""
+import os
+import sys
+import time
+import logging
+
+import main
+
+CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+def measure(name, call):
+    started = time.perf_counter()
+    for i in range(CALLS):
+        call(i)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<32} {elapsed / CALLS * 1e6:8.2f} µs/chaqiruv", file=sys.stderr)
+
+def wait_drained():
+    while not main.log_handler.queue.empty():
+        time.sleep(0.01)
+
+def run():
+    main.setup_logging()  # Import paytida ulanmaydi
+    devnull = open(os.devnull, 'w')
+    for handler in main.log_listener.handlers:
+        handler.setStream(devnull)
+    main.delivery_log.setLevel(logging.INFO)
+    main.log_context.set({"handler": "bench", "user": main.user_hash(123456789)})
+    main.log_sampler.rates['update'] = 0.05
+
+    measure("print() (sinxron, eski)", lambda i: print(f"Post {i} yuborishda xato: bench", file=devnull))
+    measure("debug (daraja o'chirilgan)", lambda i: main.delivery_log.debug("post yuborildi"))
+    measure("update (sampling 5%)", lambda i: main.log_event(
+        main.handler_log, logging.INFO, "update", "yangilanish qayta ishlandi", latency_ms=1.0))
+    measure("send_retry (sampling 20%, %s)", lambda i: main.log_event(
+        main.delivery_log, logging.WARNING, "send_retry", "Post %s yuborishda xato: %s", i, "bench"))
+    wait_drained()
+    measure("info (navbatga)", lambda i: main.delivery_log.info("Post %s yuborildi", i))
+    queued = main.log_handler.queue.qsize()
+    wait_drained()
+    print(f"Navbatda qolgan edi: {queued}, tashlangan: {main.log_handler.dropped}, "
+          f"sampling: {dict(main.log_sampler.sampled_out)}", file=sys.stderr)
+
+run()
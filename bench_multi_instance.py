@@ -0,0 +1,159 @@
+"""Ko'p nusxali rejim benchmarki
+
+main.py ning N ta nusxasini webhook rejimida (har biri o'z INSTANCE_ID va
+portlari bilan) bitta MongoDB ga ulab ishga tushiradi. Telegram Bot API
+o'rniga lokal soxta server ishlatiladi (TELEGRAM_API_URL). Soxta yangilanishlar
+nusxalarga navbat bilan yuboriladi va barcha javoblar kelguncha o'tgan vaqt
+o'lchanadi. Oxirida faqat bitta nusxa lider bo'lganini tekshiradi.
+
+Foydalanish: python bench_multi_instance.py [NUSXALAR=1,2,4] [YANGILANISHLAR=300]
+(.env fayldagi MONGODB_URI - masalan lokal mongod - kerak; TOKEN ixtiyoriy)
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+
+from aiohttp import web, ClientSession
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COUNTS = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '1,2,4').split(',')]
+UPDATES = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+TOKEN = os.getenv('TOKEN') or '123456:BENCH'
+API_PORT = 9900
+SECRET = 'bench-secret'
+
+class FakeBotApi:
+    """Bot API ning bot ishlatadigan metodlariga minimal javoblar"""
+    def __init__(self):
+        self.replies = 0
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        if method == 'getMe':
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method in ('sendMessage', 'copyMessage', 'sendDocument'):
+            self.replies += 1
+            if self.replies >= self.expected:
+                self.done.set()
+            result = {"message_id": self.replies, "date": int(time.time()),
+                      "chat": {"id": 1, "type": "private"}}
+        elif method == 'getChatMember':
+            result = {"status": "member", "user": {"id": 1, "is_bot": False, "first_name": "U"}}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+def make_update(update_id, user_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Bench{user_id}"},
+            "text": f"BENCH{update_id % 50}",
+        },
+    }
+
+def spawn(index, log_dir):
+    port = 18000 + index * 10
+    env = dict(
+        os.environ,
+        TOKEN=TOKEN,
+        INSTANCE_ID=f"bench-{index}",
+        WEBHOOK_URL=f"http://127.0.0.1:{port}",
+        WEBHOOK_PORT=str(port),
+        WEBHOOK_SECRET=SECRET,
+        FLASK_PORT=str(port + 1),
+        AIOHTTP_PORT=str(port + 2),
+        TELEGRAM_API_URL=f"http://127.0.0.1:{API_PORT}",
+        PYTHONUNBUFFERED='1',
+    )
+    log = open(os.path.join(log_dir, f"bench-{index}.log"), 'w')
+    process = subprocess.Popen([sys.executable, MAIN], env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, port, log.name
+
+async def wait_ready(session, port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"http://127.0.0.1:{port}/telegram"):
+                return  # Har qanday HTTP javob - server tinglayapti
+        except Exception:
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{port} portdagi nusxa ishga tushmadi")
+
+async def run(count, api):
+    log_dir = tempfile.mkdtemp(prefix='bench-multi-')
+    instances = [spawn(index, log_dir) for index in range(count)]
+    try:
+        async with ClientSession() as session:
+            for _, port, _ in instances:
+                await wait_ready(session, port)
+            await asyncio.sleep(2)  # Lease va keshlar o'rnashib olsin
+
+            api.replies = 0
+            api.expected = UPDATES
+            api.done.clear()
+            headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            started = time.perf_counter()
+            responses = await asyncio.gather(*[
+                session.post(
+                    f"http://127.0.0.1:{instances[update_id % count][1]}/telegram",
+                    json=make_update(update_id, 10_000 + update_id % 200),
+                    headers=headers,
+                )
+                for update_id in range(1, UPDATES + 1)
+            ])
+            for response in responses:
+                response.release()
+            await asyncio.wait_for(api.done.wait(), timeout=300)
+            elapsed = time.perf_counter() - started
+    finally:
+        for process, _, _ in instances:
+            process.terminate()
+        for process, _, _ in instances:
+            process.wait(timeout=30)
+
+    leaders = [
+        log_name for _, _, log_name in instances
+        if "lider bo'ldi" in open(log_name, encoding='utf-8', errors='replace').read()
+    ]
+    return UPDATES / elapsed, leaders
+
+async def main():
+    database = MongoClient(os.getenv('MONGODB_URI'))[os.getenv('MONGO_DB_NAME', 'kino_bot')]
+    api = FakeBotApi()
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', API_PORT).start()
+
+    baseline = None
+    failed = False
+    for count in COUNTS:
+        database['leases'].delete_many({})
+        throughput, leaders = await run(count, api)
+        baseline = baseline or throughput / count
+        print(f"🧪 {count} nusxa: {throughput:8.1f} yangilanish/s "
+              f"(chiziqli: {baseline * count:8.1f}), liderlar: {len(leaders)}")
+        if len(leaders) != 1:
+            print(f"❌ Aynan bitta lider kutilgan edi: {leaders}")
+            failed = True
+
+    await runner.cleanup()
+    if failed:
+        sys.exit(1)
+    print("✅ Har bir sinovda bitta lider")
+
+asyncio.run(main())
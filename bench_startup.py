@@ -0,0 +1,49 @@
+"""Ishga tushish vaqti benchmarki
+
+main.py ni STARTUP_BENCHMARK=1 bilan ishga tushiradi va birinchi polling
+boshlanguncha o'tgan vaqtni byudjet bilan solishtiradi. Byudjetdan oshsa
+yoki og'ir kutubxonalar (pandas, numpy, openpyxl) oldindan yuklangan bo'lsa,
+1 kodi bilan chiqadi.
+
+Foydalanish: python bench_startup.py [BYUDJET_MS] [TAKRORLASH]
+(.env fayldagi TOKEN va MONGODB_URI kerak)
+"""
+import os
+import sys
+import json
+import subprocess
+
+BUDGET_MS = float(sys.argv[1]) if len(sys.argv) > 1 else float(os.getenv('STARTUP_BUDGET_MS', 3000))
+RUNS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+def run_once():
+    env = dict(os.environ, STARTUP_BENCHMARK='1', PYTHONUNBUFFERED='1')
+    result = subprocess.run(
+        [sys.executable, MAIN], env=env, capture_output=True, text=True, timeout=120
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith('STARTUP_REPORT '):
+            return json.loads(line[len('STARTUP_REPORT '):])
+    print(result.stdout[-2000:])
+    print(result.stderr[-2000:])
+    raise RuntimeError("STARTUP_REPORT topilmadi - bot ishga tushmadi")
+
+reports = [run_once() for _ in range(RUNS)]
+best = min(reports, key=lambda report: report['total_ms'])
+
+print(f"⏱️ Birinchi pollinggacha (eng yaxshi {RUNS} tadan): {best['total_ms']:.1f} ms, byudjet: {BUDGET_MS:.0f} ms")
+for phase, ms in best['phases'].items():
+    print(f"   {phase:<20} {ms:8.1f} ms")
+
+failed = False
+if best['total_ms'] > BUDGET_MS:
+    print("❌ Byudjetdan oshib ketdi!")
+    failed = True
+if best['heavy_modules']:
+    print(f"❌ Og'ir kutubxonalar ishga tushishda yuklangan: {', '.join(best['heavy_modules'])}")
+    failed = True
+
+if failed:
+    sys.exit(1)
+print("✅ Byudjet ichida")
@@ -0,0 +1,2 @@
+# test_mongo.py - haqiqiy MongoDB ga ulanishni tekshiruvchi skript, pytest testi emas
+collect_ignore = ["test_mongo.py"]
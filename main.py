@@ -1,13 +1,46 @@
+import time
+STARTUP_T0 = time.perf_counter()  # ⏱️ Ishga tushish vaqtini o'lchash boshlanishi
 import os
+import io
+import atexit
+import base64
+import csv
+import html
+import heapq
+import hashlib
 import json
-import pandas as pd
+import logging
+import logging.handlers
+import queue
+import contextvars
+import math
+import random
+import re
+import sys
+import signal
+import traceback
+import socket
+import unicodedata
 from datetime import datetime, timedelta
-import time
+from bisect import bisect_left, insort
+from collections import Counter, deque
+from itertools import chain, islice
+from array import array
 import asyncio
+import functools
 import threading
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent
+)
+from telegram.error import BadRequest, ChatMigrated, Forbidden, InvalidToken, NetworkError, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -15,218 +48,2563 @@ from telegram.ext import (
     ContextTypes,
     filters,
     CallbackContext,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    ChatMemberHandler,
+    InlineQueryHandler,
+    BasePersistence,
+    PersistenceInput
 )
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne, ReturnDocument, UpdateOne, monitoring, timeout as mongo_timeout
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import certifi
 import aiohttp
 from aiohttp import web
 
-# 🔧 .env fayldan sozlamalarni yuklash
-load_dotenv()
+# ==================== ISHGA TUSHISH VAQTI ====================
+
+class StartupTimer:
+    """Ishga tushish bosqichlari vaqtini o'lchash (Render free rejimida cold start muhim)"""
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self._last = started_at
+        self.phases = []
+        self.parallel = []  # Fon oqimlarida parallel bajarilgan bosqichlar
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self._last) * 1000))
+        self._last = now
+
+    def record(self, phase, ms):
+        self.parallel.append((phase, ms))
+
+    @property
+    def total_ms(self):
+        return (self._last - self.started_at) * 1000
+
+    def report(self):
+        lines = [f"   {phase:<20} {ms:8.1f} ms" for phase, ms in self.phases]
+        lines += [f"   ∥ {phase:<18} {ms:8.1f} ms" for phase, ms in self.parallel]
+        lines.append(f"   {'JAMI':<20} {self.total_ms:8.1f} ms")
+        return "⏱️ Ishga tushish vaqti:\n" + "\n".join(lines)
+
+    def as_dict(self):
+        return {
+            "phases": {phase: round(ms, 1) for phase, ms in self.phases},
+            "parallel": {phase: round(ms, 1) for phase, ms in self.parallel},
+            "total_ms": round(self.total_ms, 1),
+            # Og'ir kutubxonalar faqat eksportda yuklanishi kerak
+            "heavy_modules": [name for name in ('pandas', 'numpy', 'openpyxl') if name in sys.modules]
+        }
+
+startup_timer = StartupTimer(STARTUP_T0)
+startup_timer.mark("importlar")
+
+# STARTUP_BENCHMARK=1 - birinchi pollingdan keyin hisobotni chiqarib to'xtash (bench_startup.py)
+STARTUP_BENCHMARK = os.getenv('STARTUP_BENCHMARK') == '1'
+
+async def report_startup(context: CallbackContext):
+    """Birinchi polling boshlangach ishga tushish hisobotini chiqarish (JobQueue, bir marta)"""
+    startup_timer.mark("birinchi polling")
+    startup_log.info(startup_timer.report())
+    if STARTUP_BENCHMARK:
+        # bench_startup.py shu qatorni stdout dan o'qiydi - log navbatisiz, darhol
+        print("STARTUP_REPORT " + json.dumps(startup_timer.as_dict()), flush=True)
+        os.kill(os.getpid(), signal.SIGTERM)  # Odatiy to'xtash tartibi orqali
+
+# 🔧 .env fayldan sozlamalarni yuklash
+load_dotenv()
+
+# Bot sozlamalari
+TOKEN = os.getenv('TOKEN', '')  # @BotFather dan oling
+ADMIN_ID = int(os.getenv('ADMIN_ID', 0))  # Sizning Telegram ID
+CHANNEL_ID = int(os.getenv('CHANNEL_ID', 0))  # Kanal ID (manfiy son)
+ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', '')  # Sizning username
+MAIN_CHANNEL = os.getenv('MAIN_CHANNEL', '')  # Asosiy kanal username
+MONGODB_URI = os.getenv('MONGODB_URI', '')  # MongoDB connection string
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'kino_bot')  # MongoDB database nomi
+FLASK_PORT = int(os.getenv('FLASK_PORT', 10000))  # Flask server porti
+AIOHTTP_PORT = int(os.getenv('AIOHTTP_PORT', 8080))  # aiohttp server porti
+
+# 🌐 Ko'p nusxali rejim (WEBHOOK_URL berilsa yoqiladi)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')  # Masalan: https://bot.example.com
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))  # Webhook qabul qiluvchi port
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # X-Telegram-Bot-Api-Secret-Token
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '').rstrip('/')  # Lokal Bot API server (ixtiyoriy)
+INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+MULTI_INSTANCE = bool(WEBHOOK_URL)
+
+# 🤖 Bitta jarayonda bir nechta ko'zgu bot: BOT_TOKENS=token1,token2,... (birinchisi - asosiy)
+BOT_TOKENS = [token.strip() for token in os.getenv('BOT_TOKENS', '').split(',') if token.strip()] or [TOKEN]
+TOKEN = BOT_TOKENS[0]
+MULTI_BOT = len(BOT_TOKENS) > 1
+
+def check_config():
+    """Majburiy sozlamalarni tekshirish"""
+    if not TOKEN:
+        raise ValueError("TOKEN .env faylda aniqlanmagan yoki noto'g'ri")
+    if len(set(BOT_TOKENS)) != len(BOT_TOKENS):
+        raise ValueError("BOT_TOKENS da bir xil token takrorlangan")
+    if MULTI_BOT and MULTI_INSTANCE:
+        raise ValueError("BOT_TOKENS bilan bir nechta bot faqat polling rejimida ishlaydi (WEBHOOK_URL ni olib tashlang)")
+    if not ADMIN_ID:
+        raise ValueError("ADMIN_ID .env faylda aniqlanmagan yoki noto'g'ri")
+    if not CHANNEL_ID:
+        raise ValueError("CHANNEL_ID .env faylda aniqlanmagan yoki noto'g'ri")
+    if not MONGODB_URI:
+        raise ValueError("MONGODB_URI .env faylda aniqlanmagan")
+
+# ==================== LOGLAR ====================
+# Har bir yozuv - bitta JSON qator. Handler faqat navbatga qo'yadi, formatlash va
+# stdout ga yozish alohida oqimda bajariladi (event loop bloklanmaydi).
+# LOG_LEVELS="kino.delivery=WARNING,telegram.ext=INFO" - modul bo'yicha darajalar
+# LOG_SAMPLE="update=0.05,ping=0.1" - ko'p takrorlanadigan hodisalarning yoziladigan ulushi
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_SAMPLE = os.getenv('LOG_SAMPLE', 'update=0.05,ping=0.1,send_retry=0.2,subscription_check=0.2')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json | text (lokal ishlab chiqish uchun)
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# Alohida maxfiy kalit; berilmasa har jarayon uchun tasodifiy (xeshlar qayta ishga tushishda o'zgaradi)
+LOG_USER_SALT = os.getenv('LOG_USER_SALT', '').encode('utf-8')[:64] or os.urandom(32)
+
+# Joriy handler va foydalanuvchi (asyncio task lari o'rtasida aralashmaydi)
+log_context = contextvars.ContextVar('log_context', default=None)
+
+@functools.lru_cache(maxsize=8192)
+def user_hash(user_id):
+    """Loglarda foydalanuvchi ID si o'rniga qisqa kalitli xesh"""
+    return hashlib.blake2b(str(user_id).encode('ascii'), key=LOG_USER_SALT, digest_size=6).hexdigest()
+
+def parse_log_pairs(value, convert):
+    """nom=qiymat,nom=qiymat ko'rinishidagi sozlamani lug'atga aylantirish"""
+    pairs = {}
+    for item in value.split(','):
+        name, sep, raw = item.partition('=')
+        if sep and name.strip():
+            try:
+                pairs[name.strip()] = convert(raw.strip())
+            except ValueError:
+                print(f"⚠️ Noto'g'ri log sozlamasi: {item}", file=sys.stderr)
+    return pairs
+
+class JsonLogFormatter(logging.Formatter):
+    """ts, level, logger, msg + kontekst (handler, user) va qo'shimcha maydonlar (latency_ms, ...)"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "instance": INSTANCE_ID,
+        }
+        context = getattr(record, 'context', None)
+        if context:
+            entry.update(context)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogSampler:
+    """Ko'p takrorlanadigan hodisalardan faqat berilgan ulushini qoldirish (ERROR va yuqorisi har doim)"""
+
+    def __init__(self, rates):
+        self.rates = rates
+        self.sampled_out = Counter()
+
+    def keep(self, event, level):
+        rate = self.rates.get(event)
+        if rate is None or level >= logging.ERROR or random.random() < rate:
+            return True
+        self.sampled_out[event] += 1
+        return False
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Yozuvni formatlamasdan navbatga qo'yish; navbat to'lsa - kutmasdan tashlab yuborish"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatlash QueueListener oqimida; bu yerda faqat kontekst olinadi
+        record.context = log_context.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+log_handler = None
+log_listener = None
+logging_started = False
+
+def setup_logging():
+    """Root loggerga navbatli handler ulash va yozuvchi oqimni ishga tushirish
+
+    Import paytida emas - main() va benchmark skriptlari chaqiradi.
+    """
+    global log_handler, log_listener, logging_started
+    if logging_started:
+        return log_handler, log_listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json'
+                        else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    handler = AsyncLogHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(logging.WARNING)  # Uchinchi tomon kutubxonalari - faqat ogohlantirishlar
+    logging.getLogger('kino').setLevel(LOG_LEVEL)
+    for name, level in parse_log_pairs(LOG_LEVELS, str.upper).items():
+        logging.getLogger(name).setLevel(level)
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    log_handler, log_listener, logging_started = handler, listener, True
+    atexit.register(stop_logging)
+    return handler, listener
+
+def stop_logging():
+    """Navbatdagi yozuvlarni stdout ga chiqarib, yozuvchi oqimni to'xtatish"""
+    global logging_started
+    if not logging_started:
+        return
+    logging_started = False
+    try:
+        log_listener.stop()
+    except queue.Full:
+        pass
+
+def log_event(logger, level, event, message, *args, **fields):
+    """Hot path uchun: daraja va sampling LogRecord yaratilishidan oldin tekshiriladi
+
+    Xabar %s argumentlari bilan - formatlash faqat yoziladigan yozuv uchun, yozuvchi oqimda.
+    """
+    if logger.isEnabledFor(level) and log_sampler.keep(event, level):
+        logger.log(level, message, *args, extra={"event": event, "fields": fields})
+
+def logged(handler):
+    """Handler nomi, foydalanuvchi xeshi va kechikishni log kontekstiga yozish"""
+    name = handler.__name__
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: CallbackContext):
+        user = update.effective_user
+        token = log_context.set({"handler": name, "user": user_hash(user.id) if user else None})
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        finally:
+            log_event(handler_log, logging.INFO, "update", "yangilanish qayta ishlandi",
+                      latency_ms=round((time.perf_counter() - started) * 1000, 2))
+            log_context.reset(token)
+    return wrapper
+
+log_sampler = LogSampler(parse_log_pairs(LOG_SAMPLE, float))
+
+log = logging.getLogger('kino')
+startup_log = logging.getLogger('kino.startup')
+mongo_log = logging.getLogger('kino.mongo')
+http_log = logging.getLogger('kino.http')
+catalog_log = logging.getLogger('kino.catalog')
+cluster_log = logging.getLogger('kino.cluster')
+subscription_log = logging.getLogger('kino.subscription')
+delivery_log = logging.getLogger('kino.delivery')
+admin_log = logging.getLogger('kino.admin')
+handler_log = logging.getLogger('kino.handlers')
+
+# ==================== MONGODB MONITORINGI ====================
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))  # Sekin so'rov chegarasi
+SLOW_QUERY_BUFFER = 50
+IGNORED_COMMANDS = {'ping', 'hello', 'ismaster', 'isMaster', 'buildInfo', 'endSessions', 'explain', 'saslStart', 'saslContinue'}
+
+def filter_shape(value):
+    """Filtr qiymatlarini olib tashlab faqat tuzilishini qoldirish: {"id": 5} -> {"id": 1}"""
+    if isinstance(value, dict):
+        return {key: filter_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if any(isinstance(item, dict) for item in value):
+            return [filter_shape(item) for item in value]  # $or / $and shartlari
+        return [1]  # $in ro'yxati uzunligi muhim emas
+    return 1
+
+def command_filter(command_name, command):
+    """Buyruqdagi so'rov filtri (bo'lmasa None)"""
+    if command_name in ('find', 'count', 'distinct'):
+        return command.get('filter', command.get('query'))
+    if command_name == 'findAndModify':
+        return command.get('query')
+    if command_name in ('update', 'delete'):
+        statements = command.get('updates' if command_name == 'update' else 'deletes') or []
+        return statements[0].get('q') if statements else None
+    if command_name == 'aggregate':
+        for stage in command.get('pipeline') or []:
+            if '$match' in stage:
+                return stage['$match']
+    return None
+
+def has_collscan(plan):
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(has_collscan(item) for item in plan.values())
+    if isinstance(plan, list):
+        return any(has_collscan(item) for item in plan)
+    return False
+
+class MongoCommandMonitor(monitoring.CommandListener):
+    """Har bir MongoDB buyrug'i vaqtini buyruq va kolleksiya bo'yicha yig'ish
+
+    Sekin so'rovlar filtr tuzilishi bilan halqa buferda saqlanadi. Har bir yangi
+    (kolleksiya, filtr tuzilishi) juftligi fonda bir marta explain qilinadi va
+    indekssiz (COLLSCAN) so'rovlar alohida belgilanadi.
+    """
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._pending = {}  # (connection, request_id) -> (buyruq, kolleksiya, filtr)
+        self.stats = {}  # (buyruq, kolleksiya) -> [soni, jami ms, eng ko'p ms, xatolar]
+        self.slow_queries = deque(maxlen=SLOW_QUERY_BUFFER)
+        self.collscans = {}  # (kolleksiya, tuzilish) -> birinchi aniqlangan vaqt
+        self._explained = set()
+        self._explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mongo-explain')
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection')
+        if not isinstance(collection, str):
+            collection = '-'
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                event.command_name, collection, command_filter(event.command_name, event.command))
+
+    def _finish(self, event, failed):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+            if pending is None:
+                return
+            command_name, collection, query = pending
+            elapsed = event.duration_micros / 1000
+            stat = self.stats.setdefault((command_name, collection), [0, 0.0, 0.0, 0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] = max(stat[2], elapsed)
+            stat[3] += failed
+            shape = None
+            if query:
+                shape = json.dumps(filter_shape(query), sort_keys=True, default=str)
+            if elapsed >= self.slow_ms:
+                self.slow_queries.append((datetime.now(), command_name, collection, elapsed, shape))
+            check_plan = shape is not None and (collection, shape) not in self._explained
+            if check_plan:
+                self._explained.add((collection, shape))
+        if check_plan:
+            self._explainer.submit(self._explain, collection, shape, query)
+
+    def succeeded(self, event):
+        self._finish(event, failed=0)
+
+    def failed(self, event):
+        self._finish(event, failed=1)
+
+    def _explain(self, collection, shape, query):
+        try:
+            result = db.command('explain', {'find': collection, 'filter': query}, verbosity='queryPlanner')
+            if has_collscan(result.get('queryPlanner', {}).get('winningPlan')):
+                self.collscans[(collection, shape)] = datetime.now()
+                mongo_log.warning("⚠️ Indekssiz so'rov (COLLSCAN): %s %s", collection, shape)
+        except Exception as e:
+            mongo_log.warning("So'rov rejasini tekshirishda xato (%s): %s", collection, e)
+
+    def report(self, limit=10):
+        with self._lock:
+            stats = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+            slow = list(self.slow_queries)[-limit:]
+        lines = ["🗄️ MongoDB buyruqlari (jami vaqt bo'yicha):"]
+        for (command_name, collection), (count, total, worst, failures) in stats:
+            line = f"• {command_name} {collection}: {count} ta, o'rtacha {total / count:.1f} ms, eng ko'p {worst:.1f} ms"
+            if failures:
+                line += f", xato {failures}"
+            lines.append(line)
+        lines.append(f"\n🐢 Sekin so'rovlar (≥{self.slow_ms:.0f} ms):")
+        for moment, command_name, collection, elapsed, shape in reversed(slow):
+            lines.append(f"• {moment:%H:%M:%S} {command_name} {collection} {elapsed:.0f} ms {shape or ''}")
+        if not slow:
+            lines.append("• yo'q")
+        lines.append("\n🔎 Indekssiz so'rovlar (COLLSCAN):")
+        for collection, shape in list(self.collscans):
+            lines.append(f"• {collection} {shape}")
+        if not self.collscans:
+            lines.append("• yo'q")
+        return "\n".join(lines)
+
+mongo_monitor = MongoCommandMonitor()
+
+# 📂 MongoDB - ulanish import paytida emas, ishga tushishda (connect_db)
+client = None
+db = None
+admins_collection = None
+codes_collection = None
+users_collection = None
+users_archive_collection = None
+channels_collection = None
+subscriptions_collection = None
+code_stats_collection = None
+posts_collection = None
+user_states_collection = None
+deliveries_collection = None
+
+def connect_db():
+    """MongoDB ga ulanish va kolleksiyalarni tayyorlash"""
+    global client, db, admins_collection, codes_collection, users_collection, channels_collection
+    global subscriptions_collection, code_stats_collection, posts_collection, user_states_collection
+    global deliveries_collection, users_archive_collection
+    try:
+        client = MongoClient(MONGODB_URI, tlsCAFile=certifi.where(), event_listeners=[mongo_monitor])
+        db = client[MONGO_DB_NAME]
+        
+        # Kolleksiyalar
+        admins_collection = db['admins']
+        codes_collection = db['codes']
+        users_collection = db['users']  # Faol (issiq) foydalanuvchilar
+        users_archive_collection = db['users_archive']  # Uzoq vaqt faol bo'lmaganlar
+        channels_collection = db['channels']
+        subscriptions_collection = db['subscriptions']
+        code_stats_collection = db['code_stats']
+        posts_collection = db['channel_posts']
+        user_states_collection = db['user_states']
+        deliveries_collection = db['pending_deliveries']
+        
+        client.admin.command('ping')
+        mongo_log.info("✅ MongoDB ga ulandi")
+    except Exception as e:
+        mongo_log.error(f"❌ MongoDB ga ulanishda xato: {e}")
+        raise
+
+def ensure_main_admin():
+    """Asosiy adminni qo'shish"""
+    if not admins_collection.find_one({"id": ADMIN_ID}):
+        admins_collection.insert_one({
+            "id": ADMIN_ID,
+            "username": ADMIN_USERNAME,
+            "added_at": datetime.now(),
+            "is_main": True
+        })
+
+def ensure_indexes():
+    """Kerakli indekslarni yaratish"""
+    code_stats_collection.create_index([("code", 1), ("day", 1)], unique=True)
+    code_stats_collection.create_index([("day", 1), ("deliveries", -1)])
+    posts_collection.create_index("message_id", unique=True)
+    user_states_collection.create_index("user_id", unique=True)
+    for token in BOT_TOKENS[1:]:
+        db[user_states_collection_name(token)].create_index("user_id", unique=True)
+    subscriptions_collection.create_index("user_id")
+    users_collection.create_index("last_activity")
+    users_archive_collection.create_index("id")
+    ensure_unique_user_index()
+
+def ensure_unique_user_index():
+    """users.id bo'yicha unique indeks (track_user upsert lari takror yozuv yaratmasligi uchun)"""
+    try:
+        users_collection.create_index("id", unique=True)
+    except DuplicateKeyError as e:
+        # Avvalgi insert_one poygalaridan qolgan takrorlar - qo'lda tozalash kerak
+        mongo_log.warning(f"⚠️ users.id da takroriy yozuvlar bor, unique indeks yaratilmadi: {e}")
+        users_collection.create_index("id")  # Hech bo'lmasa oddiy indeks - qidiruv COLLSCAN bo'lmasin
+    except OperationFailure as e:
+        if e.code not in (85, 86):  # IndexOptionsConflict / IndexKeySpecsConflict
+            raise
+        users_collection.drop_index("id_1")  # Eski unique bo'lmagan indeks
+        ensure_unique_user_index()
+
+# Bot ishga tushgan vaqt
+BOT_START_TIME = datetime.now()
+
+# ==================== aiohttp SERVER ====================
+routes = web.RouteTableDef()
+aiohttp_runner = None  # To'xtashda yopish uchun
+aiohttp_loop = None
+
+@routes.get("/", allow_head=True)
+async def root_route_handler(request):
+    return web.json_response({"status": "alive", "bot": "kino_bot"})
+
+@routes.get("/ping")
+async def ping_handler(request):
+    return web.json_response({"status": "pong", "message": "Bot is alive"})
+
+@routes.get("/health")
+async def health_handler(request):
+    # Liveness - jarayon ishlayotgan bo'lsa doim 200, bog'liqliklar /ready da
+    return web.json_response({"status": "healthy", "service": "telegram_bot"})
+
+@routes.get("/ready")
+async def ready_handler(request):
+    ready, report = await asyncio.to_thread(readiness_probe.report)
+    return web.json_response(report, status=200 if ready else 503)
+
+async def start_aiohttp_server():
+    """aiohttp serverni ishga tushirish"""
+    app = web.Application()
+    app.add_routes(routes)
+    
+    global aiohttp_runner
+    runner = web.AppRunner(app)
+    await runner.setup()
+    aiohttp_runner = runner
+    
+    site = web.TCPSite(runner, '0.0.0.0', AIOHTTP_PORT)
+    await site.start()
+    http_log.info(f"🌐 aiohttp server {AIOHTTP_PORT} portda ishga tushdi")
+    
+    # 🔄 Bot o'zini har 10 daqiqada ping qiladi
+    async def self_ping():
+        await asyncio.sleep(20)  # bot to'liq yuklanishini kutadi
+        render_url = os.environ.get('RENDER_EXTERNAL_HOSTNAME')
+        if not render_url:
+            http_log.warning("❌ RENDER_EXTERNAL_HOSTNAME topilmadi, ping o'chirilgan")
+            return
+            
+        url = f"https://{render_url}"
+        while True:
+            if not leader_lease.is_leader:
+                await asyncio.sleep(600)  # Ping faqat lider nusxadan yuboriladi
+                continue
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(f"{url}/ping") as resp:
+                        log_event(http_log, logging.INFO, "ping", "[PING] %s → %s", url, resp.status)
+            except Exception as e:
+                log_event(http_log, logging.WARNING, "ping", "[PING ERROR] %s", e)
+            await asyncio.sleep(600)  # har 10 daqiqada ping (600 sekund)
+
+    asyncio.create_task(self_ping())  # 🔄 fon jarayon sifatida ishlaydi
+    return app
+
+def run_aiohttp_server():
+    """aiohttp serverni threadda ishga tushirish"""
+    global aiohttp_loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    aiohttp_loop = loop
+    
+    try:
+        runner = loop.run_until_complete(start_aiohttp_server())
+        http_log.info("✅ aiohttp server ishga tushdi va ping jarayoni boshlandi")
+        loop.run_forever()
+    except Exception as e:
+        http_log.error(f"❌ aiohttp serverda xato: {e}")
+    finally:
+        loop.close()
+
+# ==================== FLASK SERVER ====================
+app = Flask(__name__)
+
+@app.route('/')
+def home():
+    return {
+        "status": "online",
+        "bot": "Kino Bot",
+        "start_time": BOT_START_TIME.strftime('%Y-%m-%d %H:%M:%S'),
+        "uptime": str(datetime.now() - BOT_START_TIME)
+    }
+
+@app.route('/health')
+def health():
+    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+
+@app.route('/ready')
+def readiness():
+    ready, report = readiness_probe.report()
+    return report, 200 if ready else 503
+
+@app.route('/ping')
+def ping():
+    return {"status": "pong", "time": datetime.now().isoformat()}
+
+flask_server = None  # To'xtashda yopish uchun (waitress)
+
+def run_flask():
+    """Flask serverni ishga tushirish"""
+    global flask_server
+    try:
+        from waitress import create_server
+        flask_server = create_server(app, host='0.0.0.0', port=FLASK_PORT)
+        flask_server.run()
+    except ImportError:
+        app.run(host='0.0.0.0', port=FLASK_PORT, debug=False)
+
+def close_http_servers():
+    """Flask va aiohttp serverlarini yopish"""
+    if flask_server is not None:
+        flask_server.close()
+    if aiohttp_runner is not None and aiohttp_loop is not None and aiohttp_loop.is_running():
+        asyncio.run_coroutine_threadsafe(aiohttp_runner.cleanup(), aiohttp_loop).result(timeout=5)
+        aiohttp_loop.call_soon_threadsafe(aiohttp_loop.stop)
+
+# ==================== KODLAR KESHI ====================
+
+def normalize_code(text):
+    """Kodni solishtirish uchun yagona ko'rinishga keltirish"""
+    return (text or '').strip().lower()
+
+def edit_distance(a, b, max_distance):
+    """Damerau-Levenshtein (OSA) masofasi, max_distance dan oshsa erta to'xtaydi"""
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            value = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, prev2[j - 2] + 1)
+            cur[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+class CodeSuggestIndex:
+    """Xato yozilgan kodlar uchun "Balki ...?" takliflari - trigram indeks
+
+    Qisqa kodlar (masalan, raqamli) uchun 1 ta xatolik variantlari to'g'ridan-to'g'ri
+    tekshiriladi, uzunroq kodlar uchun esa trigramlar bo'yicha nomzodlar tanlanib,
+    tahrirlash masofasi bilan saralanadi. 100k kodda ham so'rov < 1 ms.
+    """
+
+    MAX_POSTINGS = 4000  # Juda ko'p kodda uchraydigan trigramlar nomzod bermaydi
+
+    def __init__(self):
+        self._keys = set()
+        self._grams = {}
+        self._alphabet = Counter()
+
+    @staticmethod
+    def _trigrams(key):
+        padded = f"^{key}$"
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rebuild(self, keys):
+        self._keys.clear()
+        self._grams.clear()
+        self._alphabet.clear()
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        if not key or key in self._keys:
+            return
+        self._keys.add(key)
+        self._alphabet.update(set(key))
+        for gram in self._trigrams(key):
+            self._grams.setdefault(gram, []).append(key)
+
+    def remove(self, key):
+        if key not in self._keys:
+            return
+        self._keys.discard(key)
+        self._alphabet.subtract(set(key))
+        self._alphabet += Counter()  # nol bo'lgan harflarni tozalash
+        for gram in self._trigrams(key):
+            postings = self._grams.get(gram)
+            if postings and key in postings:
+                postings.remove(key)
+                if not postings:
+                    del self._grams[gram]
+
+    def _edits1(self, key):
+        variants = set()
+        for i in range(len(key) + 1):
+            head, tail = key[:i], key[i:]
+            if tail:
+                variants.add(head + tail[1:])
+                if len(tail) > 1:
+                    variants.add(head + tail[1] + tail[0] + tail[2:])
+                for char in self._alphabet:
+                    variants.add(head + char + tail[1:])
+            for char in self._alphabet:
+                variants.add(head + char + tail)
+        variants.discard(key)
+        return variants
+
+    def suggest(self, query, limit=3):
+        """Berilgan so'rovga eng yaqin kodlarni qaytarish"""
+        query = normalize_code(query)
+        if not query or not self._keys:
+            return []
+
+        found = {}
+        # Qisqa kodlar: barcha 1 ta xatolik variantlarini tekshirish arzonroq
+        if len(self._alphabet) * (len(query) + 1) <= 160:
+            for variant in self._edits1(query):
+                if variant in self._keys:
+                    found[variant] = 1
+
+        if len(found) < limit:
+            max_distance = 2 if len(query) > 4 else 1
+            postings = sorted((self._grams.get(gram, ()) for gram in self._trigrams(query)), key=len)
+            shared = Counter()
+            for keys in postings:
+                if len(keys) > self.MAX_POSTINGS:
+                    break
+                shared.update(keys)
+            # Har bir tahrir ko'pi bilan 3 ta trigramni buzadi
+            min_shared = len(query) - 3 * max_distance
+            for key, count in shared.most_common(limit * 4):
+                if count < min_shared:
+                    break
+                if key in found or key == query or abs(len(key) - len(query)) > max_distance:
+                    continue
+                distance = edit_distance(query, key, max_distance)
+                if distance <= max_distance:
+                    found[key] = distance
+
+        return [key for _, key in sorted((distance, key) for key, distance in found.items())[:limit]]
+
+class CodeRecord:
+    """Katalogdagi bitta kod: post ID lari umumiy massivdagi [offset, offset + length) bo'lagi"""
+
+    __slots__ = ('code', 'offset', 'length')
+
+    def __init__(self, code, offset, length):
+        self.code = code
+        self.offset = offset
+        self.length = length
+
+class CodeCatalog:
+    """Kodlar katalogining ixcham xotira ko'rinishi
+
+    To'liq Mongo hujjatlari (_id, added_at, added_by, post_id, post_ids) o'rniga:
+    - normallashtirilgan kalitlar sys.intern qilinadi
+    - barcha post ID lar bitta array('i') da, har bir kod unda offset/length bo'lagi
+    - kod ma'lumotlari __slots__ li CodeRecord da
+    - nom/yil/janr faqat ular bor kodlar uchun alohida lug'atda
+    Tahrirda eski bo'lak "axlat" bo'lib qoladi, u yarmidan oshsa massiv siqiladi.
+    """
+
+    META_FIELDS = ('title', 'year', 'genre')
+
+    def __init__(self):
+        self._records = {}
+        self._meta = {}  # kalit -> (nom, yil, janr)
+        self._post_ids = array('i')
+        self._garbage = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def keys(self):
+        return self._records.keys()
+
+    @staticmethod
+    def doc_post_ids(code_doc):
+        """Hujjatdagi post ID lar (eski yozuvlarda faqat post_id bo'ladi)"""
+        if isinstance(code_doc.get('post_ids'), list):
+            return code_doc['post_ids']
+        return [code_doc['post_id']] if code_doc.get('post_id') else []
+
+    def _append(self, code_doc):
+        code = sys.intern(code_doc['code'])
+        key = sys.intern(normalize_code(code))
+        post_ids = self.doc_post_ids(code_doc)
+        record = CodeRecord(code, len(self._post_ids), len(post_ids))
+        self._post_ids.extend(post_ids)
+        return key, record
+
+    def _set_meta(self, key, code_doc):
+        meta = tuple(code_doc.get(field) or None for field in self.META_FIELDS)
+        if any(meta):
+            self._meta[key] = meta
+        else:
+            self._meta.pop(key, None)
+
+    @classmethod
+    def from_docs(cls, code_docs):
+        catalog = cls()
+        for code_doc in code_docs:
+            key, record = catalog._append(code_doc)
+            old = catalog._records.get(key)
+            if old:
+                catalog._garbage += old.length
+            catalog._records[key] = record
+            catalog._set_meta(key, code_doc)
+        return catalog
+
+    def get(self, key):
+        return self._records.get(key)
+
+    def meta(self, key):
+        """(nom, yil, janr) yoki None"""
+        return self._meta.get(key)
+
+    def meta_items(self):
+        return self._meta.items()
+
+    def post_ids(self, record):
+        return self._post_ids[record.offset:record.offset + record.length]
+
+    def put(self, code_doc):
+        key, record = self._append(code_doc)
+        old = self._records.get(key)
+        if old:
+            self._garbage += old.length
+        self._records[key] = record
+        self._set_meta(key, code_doc)
+        self._maybe_compact()
+        return key
+
+    def remove(self, key):
+        self._meta.pop(key, None)
+        old = self._records.pop(key, None)
+        if old:
+            self._garbage += old.length
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._garbage * 2 <= len(self._post_ids):
+            return
+        post_ids = array('i')
+        for record in self._records.values():
+            offset = len(post_ids)
+            post_ids.extend(self._post_ids[record.offset:record.offset + record.length])
+            record.offset = offset
+        self._post_ids = post_ids
+        self._garbage = 0
+
+code_catalog = CodeCatalog()
+code_index = CodeSuggestIndex()
+
+class CodePrefixIndex:
+    """Inline qidiruv uchun prefiks indeksi - saralangan atamalar ro'yxati
+
+    Prefiks bo'yicha qidiruv bisect bilan boshlanadi va atamalar prefiksga mos
+    kelguncha davom etadi (trie bilan bir xil natija, lekin ancha ixcham).
+    Atama odatda kodning o'zi; boshqa kodlarga ishora qiluvchi atamalar
+    (masalan, nomlar) uchungina _targets lug'atida yozuv bo'ladi.
+    """
+
+    def __init__(self):
+        self._terms = []
+        self._targets = {}  # atama -> kod kalitlari (faqat atama == kod bo'lmasa)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def rebuild(self, keys):
+        self._terms = sorted(keys)
+        self._targets = {}
+
+    def targets(self, term):
+        return self._targets.get(term, (term,))
+
+    def add(self, term, key=None):
+        key = key or term
+        position = bisect_left(self._terms, term)
+        if position == len(self._terms) or self._terms[position] != term:
+            self._terms.insert(position, term)
+            if key != term:
+                self._targets[term] = (key,)
+        elif key not in self.targets(term):
+            self._targets[term] = self.targets(term) + (key,)
+
+    def remove(self, term, key=None):
+        key = key or term
+        position = bisect_left(self._terms, term)
+        if position == len(self._terms) or self._terms[position] != term:
+            return
+        remaining = tuple(target for target in self.targets(term) if target != key)
+        if not remaining:
+            del self._terms[position]
+            self._targets.pop(term, None)
+        elif remaining == (term,):
+            self._targets.pop(term, None)
+        else:
+            self._targets[term] = remaining
+
+    def search(self, prefix, offset=0, limit=20):
+        """(kod kalitlari, yana bormi) - prefiks bo'yicha alifbo tartibida"""
+        found, seen = [], set()
+        for position in range(bisect_left(self._terms, prefix), len(self._terms)):
+            term = self._terms[position]
+            if not term.startswith(prefix):
+                break
+            for key in self.targets(term):
+                if key in seen:
+                    continue
+                seen.add(key)
+                if len(seen) > offset:
+                    if len(found) == limit:
+                        return found, True
+                    found.append(key)
+        return found, False
+
+code_prefix_index = CodePrefixIndex()
+
+# Kirill -> lotin (o'zbek imlosi); apostroflar keyin olib tashlanadi: o'/oʻ/ў -> o
+CYRILLIC_TO_LATIN = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'j',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'x', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+})
+APOSTROPHES = dict.fromkeys(map(ord, "'`ʻʼ‘’´"), None)
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def normalize_text(text):
+    """Qidiruv uchun: kichik harf, kirill -> lotin, apostrof va diakritikasiz"""
+    text = (text or '').lower().translate(CYRILLIC_TO_LATIN).translate(APOSTROPHES)
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(normalize_text(text))
+
+class TitleIndex:
+    """Kino nomi, yili va janri bo'yicha inverted indeks
+
+    Har bir so'z uchun shu so'z uchraydigan kodlar to'plami saqlanadi. Natijalar
+    avval mos kelgan so'zlar soni, keyin so'zlarning kamyobligi (idf) bo'yicha
+    saralanadi. Oxirgi so'z to'liq yozilmagan bo'lsa prefiks bo'yicha qidiriladi.
+    So'zlar eng kamyobidan boshlab ko'riladi va nomzodlar soni chegaralangan -
+    keng tarqalgan so'z ("film", "2023") butun katalogni aylanib chiqmaydi.
+    Tahrirda faqat o'zgargan kodning so'zlari yangilanadi.
+    """
+
+    PREFIX_TERMS = 50  # Prefiks bo'yicha ko'rib chiqiladigan so'zlar chegarasi
+    MAX_CANDIDATES = 1000  # Baholanadigan kodlar chegarasi
+
+    def __init__(self):
+        self._postings = {}  # so'z -> kod kalitlari
+        self._terms = []  # saralangan so'zlar (prefiks qidiruvi uchun)
+        self._doc_terms = {}  # kalit -> so'zlar
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    @staticmethod
+    def meta_terms(meta):
+        title, year, genre = meta
+        return frozenset(tokenize(f"{title or ''} {genre or ''} {year or ''}"))
+
+    def rebuild(self, items):
+        self._postings.clear()
+        self._doc_terms.clear()
+        for key, meta in items:
+            terms = self.meta_terms(meta)
+            self._doc_terms[key] = terms
+            for term in terms:
+                self._postings.setdefault(term, set()).add(key)
+        self._terms = sorted(self._postings)
+
+    def add(self, key, meta):
+        self.remove(key)
+        if not meta:
+            return
+        terms = self.meta_terms(meta)
+        self._doc_terms[key] = terms
+        for term in terms:
+            keys = self._postings.get(term)
+            if keys is None:
+                keys = self._postings[term] = set()
+                insort(self._terms, term)
+            keys.add(key)
+
+    def remove(self, key):
+        for term in self._doc_terms.pop(key, ()):
+            keys = self._postings[term]
+            keys.discard(key)
+            if not keys:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+
+    def _prefix_postings(self, prefix):
+        postings = []
+        start = bisect_left(self._terms, prefix)
+        for term in self._terms[start:start + self.PREFIX_TERMS]:
+            if not term.startswith(prefix):
+                break
+            postings.append(self._postings[term])
+        return postings
+
+    def search(self, text, limit=5):
+        """Eng mos kod kalitlari"""
+        terms = tokenize(text)
+        if not terms or not self._doc_terms:
+            return []
+        matches = []  # (mos kalitlar soni, so'z bo'yicha postinglar)
+        for position, term in enumerate(terms):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings = [postings]
+            elif position == len(terms) - 1:
+                postings = self._prefix_postings(term)  # Hali yozilayotgan so'z
+            size = sum(map(len, postings or ()))
+            if size:
+                matches.append((size, postings))
+        matches.sort(key=lambda match: match[0])  # Eng kamyob so'z birinchi
+
+        hits = Counter()
+        weights = Counter()
+        total = len(self._doc_terms)
+        for size, postings in matches:
+            idf = math.log(1 + total / size)
+            if hits and len(hits) + size > self.MAX_CANDIDATES:
+                # Keng tarqalgan so'z - faqat mavjud nomzodlar tekshiriladi
+                keys = [key for key in hits if any(key in keys for keys in postings)]
+            else:
+                keys = set(islice(chain.from_iterable(postings), self.MAX_CANDIDATES))
+            for key in keys:
+                hits[key] += 1
+                weights[key] += idf
+        return heapq.nlargest(limit, hits, key=lambda key: (hits[key], weights[key]))
+
+title_index = TitleIndex()
+
+code_cache_changes = None  # Qayta yuklash paytidagi o'zgarishlar jurnali (yuklash bo'lmasa None)
+code_cache_reload_lock = asyncio.Lock()
+
+def build_code_cache():
+    """Kodlar katalogi va indekslarini MongoDB dan yangidan qurish (fon oqimida)"""
+    catalog = CodeCatalog.from_docs(codes_collection.find(
+        {}, {"_id": 0, "code": 1, "post_ids": 1, "post_id": 1, "title": 1, "year": 1, "genre": 1}))
+    index = CodeSuggestIndex()
+    index.rebuild(catalog.keys())
+    prefix_index = CodePrefixIndex()
+    prefix_index.rebuild(catalog.keys())
+    titles = TitleIndex()
+    titles.rebuild(catalog.meta_items())
+    return catalog, index, prefix_index, titles
+
+def install_code_cache(cache, changes=()):
+    """Tayyor katalogni bir qadamda almashtirish va yuklash paytidagi o'zgarishlarni qayta qo'llash"""
+    global code_catalog, code_index, code_prefix_index, title_index
+    code_catalog, code_index, code_prefix_index, title_index = cache
+    for change, value in changes:
+        if change == 'put':
+            _cache_put(value)
+        else:
+            _cache_remove(value)
+    return len(code_catalog)
+
+def load_code_cache():
+    """Barcha kodlarni MongoDB dan keshga yuklash (ishga tushishda, event loop dan oldin)"""
+    global catalog_version
+    # Versiya katalogdan oldin o'qiladi - oraliqdagi o'zgarish keyingi sinxronda olinadi
+    version = read_catalog_version()
+    total = install_code_cache(build_code_cache())
+    catalog_version = version
+    return total
+
+async def reload_code_cache():
+    """Katalogni fon oqimida qurib, event loop da almashtirish
+
+    Qurish paytida ham qidiruv eski katalog bilan ishlayveradi. Shu orada
+    qo'shilgan yoki o'chirilgan kodlar jurnalga yoziladi va almashtirilgach
+    yangi katalogga qayta qo'llanadi - aks holda ular yo'qolib qolardi.
+    """
+    global code_cache_changes
+    async with code_cache_reload_lock:  # Ketma-ket - har bir yuklashning o'z jurnali
+        code_cache_changes = []
+        try:
+            cache = await asyncio.to_thread(build_code_cache)
+            return install_code_cache(cache, code_cache_changes)
+        finally:
+            code_cache_changes = None
+
+def _cache_put(code_doc):
+    key = code_catalog.put(code_doc)
+    code_index.add(key)
+    code_prefix_index.add(key)
+    title_index.add(key, code_catalog.meta(key))
+
+def _cache_remove(key):
+    code_catalog.remove(key)
+    code_index.remove(key)
+    code_prefix_index.remove(key)
+    title_index.remove(key)
+
+def cache_code(code_doc):
+    """Qo'shilgan yoki tahrirlangan kodni keshga yozish"""
+    if not code_doc:
+        return
+    _cache_put(code_doc)
+    if code_cache_changes is not None:
+        code_cache_changes.append(('put', code_doc))
+
+def uncache_code(code_text):
+    """O'chirilgan kodni keshdan olib tashlash"""
+    key = normalize_code(code_text)
+    _cache_remove(key)
+    if code_cache_changes is not None:
+        code_cache_changes.append(('remove', key))
+
+def find_code(code_text):
+    return code_catalog.get(normalize_code(code_text))
+
+# /start deep-link: t.me/<bot>?start=<payload> (Telegram: faqat A-Z a-z 0-9 _ -, 64 belgigacha)
+START_PAYLOAD_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+START_PAYLOAD_B64 = 'b64-'
+
+def code_start_payload(code_text):
+    """Kod uchun /start payload (ruxsat etilmagan belgilar bo'lsa - base64url), sig'masa None"""
+    if START_PAYLOAD_PATTERN.match(code_text) and not code_text.startswith(START_PAYLOAD_B64):
+        return code_text
+    encoded = base64.urlsafe_b64encode(code_text.encode('utf-8')).decode('ascii').rstrip('=')
+    payload = START_PAYLOAD_B64 + encoded
+    return payload if len(payload) <= 64 else None
+
+def code_from_start_payload(payload):
+    """/start payload dan kod matnini tiklash (noto'g'ri payload bo'lsa None)"""
+    if not payload.startswith(START_PAYLOAD_B64):
+        return payload
+    encoded = payload[len(START_PAYLOAD_B64):]
+    try:
+        return base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def code_deep_link(bot_username, code_text):
+    """Kodni bitta bosishda yuboradigan havola (payload sig'masa None)"""
+    payload = code_start_payload(code_text)
+    return f"https://t.me/{bot_username}?start={payload}" if payload else None
+
+def code_suggestions_markup(code_text, limit=3):
+    """Topilmagan kod uchun o'xshash kodlar tugmalari (bo'lmasa None)"""
+    buttons = []
+    for key in code_index.suggest(code_text, limit):
+        code = code_catalog.get(key).code
+        callback_data = f"kod:{code}"
+        if len(callback_data.encode('utf-8')) <= 64:  # Telegram cheklovi
+            buttons.append([InlineKeyboardButton(f"🎬 {code}", callback_data=callback_data)])
+    return InlineKeyboardMarkup(buttons) if buttons else None
+
+def code_display_name(key, record):
+    """Tugma va natijalar uchun: "Nomi (yil)" yoki kodning o'zi"""
+    meta = code_catalog.meta(key)
+    if not meta or not meta[0]:
+        return record.code
+    return f"{meta[0]} ({meta[1]})" if meta[1] else meta[0]
+
+def title_matches_markup(text, limit=5):
+    """Matn bo'yicha (nom/yil/janr) topilgan kinolar tugmalari (bo'lmasa None)"""
+    buttons = []
+    for key in title_index.search(text, limit):
+        record = code_catalog.get(key)
+        callback_data = f"kod:{record.code}"
+        if len(callback_data.encode('utf-8')) <= 64:  # Telegram cheklovi
+            buttons.append([InlineKeyboardButton(f"🎬 {code_display_name(key, record)}", callback_data=callback_data)])
+    return InlineKeyboardMarkup(buttons) if buttons else None
+
+INLINE_PAGE_SIZE = 20  # Telegram bir javobda 50 tagacha natija qabul qiladi
+INLINE_CACHE_TIME = 300  # Telegram serverida bir xil so'rov natijasi keshlanadi (s)
+
+@logged
+async def inline_code_search(update: Update, context: CallbackContext):
+    """@bot <kod boshi> - kodlarni faqat xotiradagi indeks bo'yicha qidirish"""
+    query = update.inline_query
+    try:
+        try:
+            offset = int(query.offset or 0)
+        except ValueError:
+            offset = 0
+        keys, has_more = code_prefix_index.search(normalize_code(query.query), offset, INLINE_PAGE_SIZE)
+        if not keys and offset == 0 and query.query.strip():
+            keys = title_index.search(query.query, INLINE_PAGE_SIZE)  # Kod emas - nom bo'yicha
+        results = []
+        for key in keys:
+            record = code_catalog.get(key)
+            if record is None:
+                continue
+            meta = code_catalog.meta(key)
+            results.append(InlineQueryResultArticle(
+                id=hashlib.md5(key.encode('utf-8')).hexdigest(),
+                title=f"🎬 {code_display_name(key, record)}",
+                description=" · ".join(str(part) for part in (
+                    record.code if meta and meta[0] else None,
+                    meta[2] if meta else None,
+                    f"{record.length} ta qism") if part),
+                input_message_content=InputTextMessageContent(record.code)
+            ))
+        await query.answer(
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=False,
+            next_offset=str(offset + len(keys)) if has_more else ''
+        )
+    except Exception as e:
+        handler_log.error("Inline qidiruvda xato: %s", e)
+
+# ==================== KANAL POSTLARI KATALOGI ====================
+
+def detect_media(message):
+    """Post turi va fayl hajmini aniqlash"""
+    for media_type in ('video', 'animation', 'photo', 'document', 'audio', 'voice', 'video_note', 'sticker'):
+        media = getattr(message, media_type, None)
+        if media:
+            if media_type == 'photo':
+                media = media[-1]  # Eng katta o'lchamdagi rasm
+            return media_type, getattr(media, 'file_size', None) or 0
+    return 'text', len(message.text or '')
+
+class ChannelPostCatalog:
+    """CHANNEL_ID dagi postlar katalogi
+
+    channel_post / edited_channel_post yangilanishlaridan to'ldiriladi. Yuborishda
+    "topilmadi" xatosini bergan postlar o'chirilgan deb belgilanadi va ularga
+    qaytib copy_message so'rovi yuborilmaydi.
+    """
+
+    def __init__(self):
+        self._posts = {}   # message_id -> (media_type, size, media_group_id, deleted)
+        self._groups = {}  # media_group_id -> {message_id, ...}
+
+    def __len__(self):
+        return len(self._posts)
+
+    def _remember(self, message_id, media_type, size, media_group_id, deleted):
+        self._posts[message_id] = (media_type, size, media_group_id, deleted)
+        if media_group_id:
+            self._groups.setdefault(media_group_id, set()).add(message_id)
+
+    def load(self):
+        """Katalogni MongoDB dan yuklash"""
+        catalog = ChannelPostCatalog()
+        for post in posts_collection.find({}, {"_id": 0}):
+            catalog._remember(post['message_id'], post.get('media_type'), post.get('size', 0),
+                              post.get('media_group_id'), post.get('deleted', False))
+        # Fonda yuklanayotganda kelgan yangi postlar yo'qolmasligi uchun ustiga yoziladi
+        catalog._posts.update(self._posts)
+        for media_group_id, message_ids in self._groups.items():
+            catalog._groups.setdefault(media_group_id, set()).update(message_ids)
+        self._posts, self._groups = catalog._posts, catalog._groups
+        return len(self._posts)
+
+    def index_message(self, message):
+        """Kanal postini katalogga qo'shish va MongoDB ga yozish"""
+        media_type, size = detect_media(message)
+        self._remember(message.message_id, media_type, size, message.media_group_id, False)
+        posts_collection.update_one(
+            {"message_id": message.message_id},
+            {"$set": {
+                "media_type": media_type,
+                "size": size,
+                "media_group_id": message.media_group_id,
+                "deleted": False,
+                "updated_at": datetime.now()
+            }},
+            upsert=True
+        )
+
+    def mark_deleted(self, message_id):
+        post = self._posts.get(message_id)
+        if post and post[3]:
+            return
+        media_type, size, media_group_id, _ = post or (None, 0, None, True)
+        self._remember(message_id, media_type, size, media_group_id, True)
+        posts_collection.update_one(
+            {"message_id": message_id},
+            {"$set": {"deleted": True, "updated_at": datetime.now()}},
+            upsert=True
+        )
+
+    def is_deleted(self, message_id):
+        post = self._posts.get(message_id)
+        return bool(post and post[3])
+
+    def dead_post_ids(self, post_ids):
+        return [post_id for post_id in post_ids if self.is_deleted(post_id)]
+
+    def unknown_post_ids(self, post_ids):
+        return [post_id for post_id in post_ids if post_id not in self._posts]
+
+    def album(self, message_id):
+        """Post tegishli albomning barcha (o'chirilmagan) post ID lari"""
+        post = self._posts.get(message_id)
+        if not post or not post[2]:
+            return None
+        return sorted(post_id for post_id in self._groups.get(post[2], ()) if not self.is_deleted(post_id))
+
+post_catalog = ChannelPostCatalog()
+
+def is_missing_post_error(error):
+    """copy_message xatosi post kanalda yo'qligini bildiradimi"""
+    return isinstance(error, BadRequest) and 'not found' in str(error).lower()
+
+async def index_channel_post(update: Update, context: CallbackContext):
+    """Kanal postlarini katalogga yozish"""
+    try:
+        post_catalog.index_message(update.effective_message)
+    except Exception as e:
+        catalog_log.error("Kanal postini katalogga yozishda xato: %s", e)
+
+# ==================== KOD STATISTIKASI ====================
+
+CODE_STATS_FLUSH_INTERVAL = 60  # soniya
+
+def stats_day(moment=None):
+    """Statistika kuni (Toshkent vaqti bo'yicha) - 'YYYY-MM-DD'"""
+    moment = moment or datetime.utcnow()
+    return (moment + timedelta(hours=5)).strftime('%Y-%m-%d')
+
+class CodeStats:
+    """Kodlar bo'yicha so'rov va yuborishlar hisoblagichi
+
+    Hisoblagichlar xotirada yig'iladi va davriy ravishda bitta bulk_write ($inc)
+    bilan code_stats kolleksiyasiga yoziladi - foydalanuvchi yo'lida Mongo ga
+    qo'shimcha so'rov yo'q. Har bir kod uchun kunlik va umumiy ("all") hujjat bor.
+    """
+
+    FIELDS = ('requests', 'deliveries')
+
+    def __init__(self):
+        self._pending = Counter()  # (kod, kun, maydon) -> son
+        self._lock = threading.Lock()
+
+    def record_request(self, code):
+        with self._lock:
+            self._pending[(code, stats_day(), 'requests')] += 1
+
+    def record_delivery(self, code):
+        with self._lock:
+            self._pending[(code, stats_day(), 'deliveries')] += 1
+
+    def flush(self):
+        """Yig'ilgan hisoblagichlarni MongoDB ga yozish, yozilgan amallar sonini qaytaradi"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+
+        increments = {}
+        for (code, day, field), count in pending.items():
+            for bucket in (day, 'all'):
+                fields = increments.setdefault((code, bucket), {})
+                fields[field] = fields.get(field, 0) + count
+
+        operations = [
+            UpdateOne({"code": code, "day": day}, {"$inc": fields}, upsert=True)
+            for (code, day), fields in increments.items()
+        ]
+        try:
+            code_stats_collection.bulk_write(operations, ordered=False)
+        except Exception:
+            # Yozilmagan hisoblagichlar keyingi safar qayta yuboriladi
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        return len(operations)
+
+    def top(self, days=None, limit=5):
+        """Eng ko'p yuborilgan kodlar: days=None - umumiy, 1 - bugun, 7 - hafta"""
+        if days is None:
+            cursor = code_stats_collection.find({"day": "all"}).sort("deliveries", -1).limit(limit)
+            return [(doc['code'], doc.get('deliveries', 0), doc.get('requests', 0)) for doc in cursor]
+
+        now = datetime.utcnow()
+        day_keys = [stats_day(now - timedelta(days=i)) for i in range(days)]
+        pipeline = [
+            {"$match": {"day": {"$in": day_keys}}},
+            {"$group": {
+                "_id": "$code",
+                "deliveries": {"$sum": "$deliveries"},
+                "requests": {"$sum": "$requests"}
+            }},
+            {"$sort": {"deliveries": -1}},
+            {"$limit": limit}
+        ]
+        return [(doc['_id'], doc['deliveries'], doc['requests'])
+                for doc in code_stats_collection.aggregate(pipeline)]
+
+code_stats = CodeStats()
+
+async def flush_code_stats(context: CallbackContext = None):
+    """Kod statistikasini fon rejimida yozish (JobQueue va to'xtash paytida)"""
+    try:
+        await asyncio.to_thread(code_stats.flush)
+    except Exception as e:
+        catalog_log.error(f"Kod statistikasini yozishda xato: {e}")
+
+# ==================== FOYDALANUVCHI HOLATI (PERSISTENCE) ====================
+
+USER_STATE_FLUSH_BATCH = 500     # Bitta bulk_write dagi foydalanuvchilar soni
+USER_STATE_IDLE_TTL = 30 * 60    # Shuncha soniya faol bo'lmagan foydalanuvchi xotiradan chiqariladi
+USER_STATE_EVICT_INTERVAL = 5 * 60
+
+class MongoUserDataPersistence(BasePersistence):
+    """context.user_data ni (action, pending_code, current_menu) MongoDB da saqlash
+
+    - Ma'lumot foydalanuvchining birinchi yangilanishida yuklanadi (lazy), boshida hammasi emas
+    - O'zgargan yozuvlar to'planib, bo'laklab bulk_write bilan yoziladi
+    - Uzoq vaqt faol bo'lmagan foydalanuvchilar xotiradan chiqariladi (MongoDB da qoladi)
+    """
+
+    def __init__(self, collection_name='user_states', update_interval=30, always_refresh=False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.collection_name = collection_name
+        # Ko'p nusxali rejimda foydalanuvchi yangilanishlari turli nusxalarga tushishi mumkin
+        self.always_refresh = always_refresh
+        self._loaded = set()
+        self._synced_at = {}  # user_id -> bizdagi holatning MongoDB dagi updated_at vaqti
+        self._last_seen = {}
+        self._dirty = {}
+        self._evicting = {}  # user_id -> Application (xotiradan chiqarilayotganlar)
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()  # Bir vaqtda faqat bitta bulk_write
+
+    @property
+    def collection(self):
+        return db[self.collection_name]  # MongoDB ulanishi ishga tushishda o'rnatiladi
+
+    async def get_user_data(self):
+        return {}  # Lazy yuklash - refresh_user_data da
+
+    async def refresh_user_data(self, user_id, user_data):
+        self._last_seen[user_id] = time.monotonic()
+        if user_id in self._loaded and not self.always_refresh:
+            return
+        first_load = user_id not in self._loaded
+        self._loaded.add(user_id)
+        doc = await asyncio.to_thread(self.collection.find_one, {"user_id": user_id})
+        if not doc:
+            return
+        if first_load:
+            for key, value in (doc.get('data') or {}).items():
+                user_data.setdefault(key, value)
+        elif (user_id not in self._dirty and doc.get('instance') != INSTANCE_ID
+              and doc.get('updated_at', datetime.min) > self._synced_at.get(user_id, datetime.min)):
+            # Boshqa nusxa yangiroq holat yozgan
+            user_data.clear()
+            user_data.update(doc.get('data') or {})
+        self._synced_at[user_id] = max(doc.get('updated_at', datetime.min), self._synced_at.get(user_id, datetime.min))
+
+    async def update_user_data(self, user_id, data):
+        self._dirty[user_id] = dict(data)
+        if len(self._dirty) >= USER_STATE_FLUSH_BATCH or not self._flush_task or self._flush_task.done():
+            # PTB barcha o'zgarishlarni bir siklda chaqiradi - ular to'plangach bitta yozuv
+            self._flush_task = asyncio.create_task(self._flush_dirty())
+
+    async def drop_user_data(self, user_id):
+        if user_id in self._evicting:
+            application = self._evicting.pop(user_id)
+            if user_id in self._last_seen:
+                # Chiqarish paytida qaytib keldi - holati yangidan yuklangan. PTB bu siklda
+                # o'chirilgan foydalanuvchini yozmaydi, shuning uchun keyingi siklga belgilanadi
+                application.mark_data_for_update_persistence(user_ids=user_id)
+                return
+            self._loaded.discard(user_id)
+            self._synced_at.pop(user_id, None)
+            return  # Faqat xotiradan chiqarildi, MongoDB dagi holat saqlanadi
+        self._dirty.pop(user_id, None)
+        self._loaded.discard(user_id)
+        self._synced_at.pop(user_id, None)
+        self._last_seen.pop(user_id, None)
+        await asyncio.to_thread(self.collection.delete_one, {"user_id": user_id})
+
+    async def _flush_dirty(self):
+        async with self._flush_lock:
+            await self._flush_batches()
+
+    async def _flush_batches(self):
+        while self._dirty:
+            user_ids = list(self._dirty)[:USER_STATE_FLUSH_BATCH]
+            batch = {user_id: self._dirty.pop(user_id) for user_id in user_ids}
+            now = datetime.now()
+            operations = [
+                UpdateOne(
+                    {"user_id": user_id},
+                    {"$set": {"data": data, "updated_at": now, "instance": INSTANCE_ID}},
+                    upsert=True
+                )
+                for user_id, data in batch.items()
+            ]
+            try:
+                await asyncio.to_thread(self.collection.bulk_write, operations, ordered=False)
+            except Exception as e:
+                log.error(f"Foydalanuvchi holatini saqlashda xato: {e}")
+                for user_id, data in batch.items():
+                    self._dirty.setdefault(user_id, data)
+                return
+            for user_id in batch:
+                self._synced_at[user_id] = now
+
+    async def flush(self):
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        await self._flush_dirty()
+
+    def evict_idle(self, application, ttl=USER_STATE_IDLE_TTL):
+        """TTL dan uzoq faol bo'lmagan foydalanuvchilarni xotiradan chiqarish"""
+        deadline = time.monotonic() - ttl
+        evicted = 0
+        for user_id, last_seen in list(self._last_seen.items()):
+            if last_seen > deadline or user_id in self._dirty:
+                continue  # Hali yozilmagan holat - keyingi safar
+            self._evicting[user_id] = application
+            self._loaded.discard(user_id)
+            del self._last_seen[user_id]  # Qaytib kelsa refresh_user_data qayta qo'yadi
+            application.drop_user_data(user_id)
+            evicted += 1
+        return evicted
+
+    # Bot/chat/callback ma'lumotlari va suhbatlar saqlanmaydi
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+async def evict_idle_user_data(context: CallbackContext):
+    """Faol bo'lmagan foydalanuvchilar holatini xotiradan chiqarish (JobQueue)"""
+    evicted = context.application.persistence.evict_idle(context.application)
+    if evicted:
+        log.info(f"🧹 {evicted} ta faol bo'lmagan foydalanuvchi holati xotiradan chiqarildi")
+
+# ==================== KO'P NUSXALI REJIM ====================
+
+LEASE_TTL = 30           # soniya - lider shu vaqt ichida yangilamasa, boshqasi egallaydi
+CACHE_SYNC_INTERVAL = 30  # soniya - boshqa nusxalardagi o'zgarishlarni tekshirish
+
+class LeaderLease:
+    """MongoDB dagi lease hujjati orqali lider tanlash
+
+    Faqat lider yagona bo'lishi kerak bo'lgan fon ishlarini (ping va h.k.)
+    bajaradi. Bitta nusxali rejimda nusxa doim lider.
+    """
+
+    def __init__(self, name='leader', ttl=LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.is_leader = not MULTI_INSTANCE
+
+    def renew(self):
+        """Lease ni egallash yoki uzaytirish, lider bo'lsa True"""
+        if not MULTI_INSTANCE:
+            return True
+        now = datetime.utcnow()
+        try:
+            lease = db['leases'].find_one_and_update(
+                {"_id": self.name, "$or": [{"holder": INSTANCE_ID}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"holder": INSTANCE_ID, "expires_at": now + timedelta(seconds=self.ttl), "renewed_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            became_leader = lease is not None and lease['holder'] == INSTANCE_ID
+        except DuplicateKeyError:
+            became_leader = False  # Lease boshqa nusxada va hali amalda
+        if became_leader and not self.is_leader:
+            cluster_log.info(f"👑 {INSTANCE_ID} lider bo'ldi")
+        elif self.is_leader and not became_leader:
+            cluster_log.warning(f"👑 {INSTANCE_ID} liderlikni yo'qotdi")
+        self.is_leader = became_leader
+        return became_leader
+
+    def release(self):
+        if MULTI_INSTANCE and self.is_leader:
+            db['leases'].delete_one({"_id": self.name, "holder": INSTANCE_ID})
+            self.is_leader = False
+
+leader_lease = LeaderLease()
+
+def leader_only(callback):
+    """JobQueue ishini faqat lider nusxada bajarish"""
+    async def job(context: CallbackContext):
+        if leader_lease.is_leader:
+            await callback(context)
+    job.__name__ = callback.__name__
+    return job
+
+async def renew_leader_lease(context: CallbackContext):
+    try:
+        await asyncio.to_thread(leader_lease.renew)
+    except Exception as e:
+        leader_lease.is_leader = False
+        cluster_log.error(f"Lider lease ni yangilashda xato: {e}")
+
+# Kodlar katalogi versiyasi - bir nusxadagi o'zgarish boshqalarida ham keshni yangilaydi
+catalog_version = 0  # load_code_cache ishga tushishda meta.code_catalog dan oladi
+
+async def publish_catalog_change():
+    """Kodlar o'zgarganini boshqa nusxalarga bildirish (MongoDB so'rovi fon oqimida)"""
+    global catalog_version
+    if not MULTI_INSTANCE:
+        return
+    try:
+        meta = await asyncio.to_thread(
+            db['meta'].find_one_and_update,
+            {"_id": "code_catalog"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except Exception as e:
+        # Kod saqlangan - boshqa nusxalar keyingi muvaffaqiyatli o'zgarishda yangilanadi
+        cluster_log.error(f"Katalog o'zgarishini e'lon qilishda xato: {e}")
+        return
+    # Faqat bizning o'zgarish bevosita keyingi versiya bo'lsa. Oraliqda boshqa nusxa
+    # ham e'lon qilgan bo'lsa, versiya o'zgarmaydi - keyingi sinxron katalogni qayta yuklaydi
+    if meta['version'] == catalog_version + 1:
+        catalog_version = meta['version']
+
+def read_catalog_version():
+    """MongoDB dagi kodlar katalogi versiyasi (bitta nusxali rejimda ishlatilmaydi)"""
+    if not MULTI_INSTANCE:
+        return 0
+    return (db['meta'].find_one({"_id": "code_catalog"}) or {}).get('version', 0)
+
+def sync_shared_caches():
+    """Boshqa nusxalardagi o'zgarishlarni keshlarga olish
+
+    Kodlar katalogi o'zgargan bo'lsa yangi versiya qaytariladi - katalogni
+    chaqiruvchi reload_code_cache orqali yangilaydi.
+    """
+    load_admin_cache()
+    load_channel_cache()
+    version = read_catalog_version()
+    return version if version != catalog_version else None
+
+async def sync_shared_caches_job(context: CallbackContext):
+    global catalog_version
+    try:
+        version = await asyncio.to_thread(sync_shared_caches)
+        if version is not None:
+            await reload_code_cache()
+            catalog_version = version
+            cluster_log.info("🔄 Kodlar katalogi boshqa nusxadagi o'zgarish sababli yangilandi")
+    except Exception as e:
+        cluster_log.error(f"Keshlarni sinxronlashda xato: {e}")
+
+# ==================== OBUNALAR XOTIRASI ====================
+
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+def is_member_status(member):
+    """ChatMember obyekti kanal a'zosini bildiradimi"""
+    if member.status == 'restricted':
+        return bool(getattr(member, 'is_member', False))
+    return member.status in MEMBER_STATUSES
+
+class MembershipStore:
+    """chat_member yangilanishlari bilan to'ldiriladigan obunalar xotirasi
+
+    Bot admin bo'lgan kanallarda Telegram a'zolik o'zgarishlarini o'zi yuboradi,
+    shuning uchun bir marta aniqlangan holat keyingi o'zgarishgacha to'g'ri qoladi
+    va get_chat_member chaqirilmaydi. Bot yangilanish ololmaydigan kanallar uchun
+    check_subscription har safar get_chat_member orqali tekshiradi.
+    Holat subscriptions_collection dagi `channels.<kanal_id>` maydonlarida saqlanadi.
+    """
+
+    MAX_USERS = 200000
+
+    def __init__(self):
+        self._members = {}  # user_id -> {kanal_id: a'zomi}
+        self._push_channels = {}  # (kanal_id, bot_id) -> bot chat_member yangilanishlarini oladimi
+
+    async def is_push_channel(self, chat_id, bot):
+        """Bot kanalda admin bo'lsa, a'zolik o'zgarishlari bizga keladi"""
+        key = (chat_id, bot.id)
+        if key not in self._push_channels:
+            try:
+                me = await bot.get_chat_member(chat_id=chat_id, user_id=bot.id)
+                self._push_channels[key] = me.status == 'administrator'
+            except Exception as e:
+                subscription_log.warning("Kanal %s da bot huquqini aniqlashda xato: %s", chat_id, e)
+                self._push_channels[key] = False  # my_chat_member kelguncha polling
+        return self._push_channels[key]
+
+    def set_push_channel(self, chat_id, bot, enabled):
+        self._push_channels[(chat_id, bot.id)] = enabled
+
+    def _load_user(self, user_id):
+        doc = subscriptions_collection.find_one({"user_id": user_id}, {"channels": 1}) or {}
+        return {int(chat_id): state['member'] for chat_id, state in (doc.get('channels') or {}).items()}
+
+    async def lookup(self, chat_id, user_id):
+        """Ma'lum holat (True/False) yoki None - holat noma'lum"""
+        # Ko'p nusxali rejimda yangilanish boshqa nusxaga tushgan bo'lishi mumkin
+        if MULTI_INSTANCE or user_id not in self._members:
+            if len(self._members) >= self.MAX_USERS:
+                self._members.clear()
+            self._members[user_id] = await asyncio.to_thread(self._load_user, user_id)
+        return self._members[user_id].get(chat_id)
+
+    def _save(self, chat_id, user_id, is_member):
+        subscriptions_collection.update_one(
+            {"user_id": user_id},
+            {"$set": {f"channels.{chat_id}": {"member": is_member, "at": datetime.now()}}},
+            upsert=True
+        )
+
+    async def remember(self, chat_id, user_id, is_member):
+        known = self._members.setdefault(user_id, {})
+        if known.get(chat_id) == is_member:
+            return
+        known[chat_id] = is_member
+        await asyncio.to_thread(self._save, chat_id, user_id, is_member)
+
+membership_store = MembershipStore()
+
+async def track_channel_member(update: Update, context: CallbackContext):
+    """Majburiy kanallardagi a'zolik o'zgarishlarini xotiraga yozish"""
+    try:
+        change = update.chat_member
+        chat_id = change.chat.id
+        if not any(channel['id'] == chat_id for channel in get_channels()):
+            return
+        membership_store.set_push_channel(chat_id, context.bot, True)
+        await membership_store.remember(
+            chat_id, change.new_chat_member.user.id, is_member_status(change.new_chat_member))
+    except Exception as e:
+        subscription_log.error("A'zolik yangilanishini yozishda xato: %s", e)
+
+async def track_bot_member(update: Update, context: CallbackContext):
+    """Bot kanalda admin bo'lsa push, aks holda polling rejimi"""
+    change = update.my_chat_member
+    if change.chat.type == 'private':
+        return  # Foydalanuvchi botni bloklagan/ochgan
+    membership_store.set_push_channel(change.chat.id, context.bot, change.new_chat_member.status == 'administrator')
+
+# ==================== OQIMNI CHEKLASH ====================
+
+FLOOD_BURST = int(os.getenv('FLOOD_BURST', 5))  # Ketma-ket ruxsat etilgan xabarlar soni
+FLOOD_RATE = float(os.getenv('FLOOD_RATE', 0.5))  # Sekundiga qayta to'ladigan xabarlar soni
+FLOOD_NOTICE_INTERVAL = 10  # Bitta foydalanuvchiga ogohlantirishlar oralig'i (s)
+BUSY_LOOP_LAG_MS = float(os.getenv('BUSY_LOOP_LAG_MS', 500))  # Event loop kechikishi chegarasi
+BUSY_QUEUE_DEPTH = int(os.getenv('BUSY_QUEUE_DEPTH', 200))  # Navbatdagi yangilanishlar chegarasi
+LOOP_LAG_INTERVAL = 0.5
+
+class FloodControl:
+    """Har bir foydalanuvchi uchun token bucket
+
+    Foydalanuvchi FLOOD_BURST ta xabarni birdaniga yubora oladi, keyin esa
+    sekundiga FLOOD_RATE ta. Ortiqcha xabarlar tashlab yuboriladi va
+    foydalanuvchiga FLOOD_NOTICE_INTERVAL ichida faqat bitta ogohlantirish boradi.
+    """
+
+    MAX_BUCKETS = 50000
+
+    def __init__(self, burst=FLOOD_BURST, rate=FLOOD_RATE):
+        self.burst = burst
+        self.rate = rate
+        self._buckets = {}  # user_id -> [tokenlar, oxirgi yangilanish, oxirgi ogohlantirish]
+        self.dropped = 0
+
+    def allow(self, user_id, now=None):
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                self.prune(now)
+            bucket = self._buckets[user_id] = [float(self.burst), now, 0.0]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        self.dropped += 1
+        return False
+
+    def should_notify(self, user_id, now=None):
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(user_id)
+        if bucket is None or now - bucket[2] < FLOOD_NOTICE_INTERVAL:
+            return False
+        bucket[2] = now
+        return True
+
+    def prune(self, now):
+        """To'lib bo'lgan (uzoq vaqt jim) bucketlarni o'chirish"""
+        refill_time = self.burst / self.rate
+        for user_id in [user_id for user_id, bucket in self._buckets.items() if now - bucket[1] >= refill_time]:
+            del self._buckets[user_id]
+
+class LoadMonitor:
+    """Event loop kechikishi va yangilanishlar navbatini kuzatish"""
+
+    def __init__(self):
+        self.loop_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.active_deliveries = 0
+        self.shed = 0
+        self.last_tick = None
+        self._task = None
+
+    async def _watch(self):
+        while True:
+            expected = time.monotonic() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.last_tick = time.monotonic()
+            self.loop_lag_ms = max(0.0, (self.last_tick - expected) * 1000)
+            self.max_lag_ms = max(self.max_lag_ms, self.loop_lag_ms)
+
+    def start(self):
+        self.last_tick = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def current_lag_ms(self):
+        """Boshqa oqimdan o'qish uchun: loop to'xtab qolsa ham o'sib boradi"""
+        if self.last_tick is None:
+            return None
+        stalled = (time.monotonic() - self.last_tick - LOOP_LAG_INTERVAL) * 1000
+        return max(self.loop_lag_ms, stalled)
+
+    def queue_depth(self, application=None):
+        """Hali qayta ishlanmagan yangilanishlar va davom etayotgan yuborishlar
+
+        application berilmasa - barcha botlar navbatlari yig'indisi"""
+        applications = [application] if application else bot_host.applications
+        pending = sum(application.update_queue.qsize() for application in applications)
+        return pending + self.active_deliveries
+
+    def is_busy(self, application):
+        return self.loop_lag_ms > BUSY_LOOP_LAG_MS or self.queue_depth(application) > BUSY_QUEUE_DEPTH
+
+load_monitor = LoadMonitor()
+
+async def reply_shed(update: Update, text):
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(text)
+        elif update.effective_message:
+            await update.effective_message.reply_text(text)
+    except Exception as e:
+        handler_log.warning("Cheklov xabarini yuborishda xato: %s", e)
+
+def flood_guarded(handler):
+    """Foydalanuvchi handlerini token bucket va yuklama tekshiruvi bilan o'rash (adminlar cheklanmaydi)"""
+    @functools.wraps(handler)
+    async def guarded(update: Update, context: CallbackContext):
+        user = update.effective_user
+        if user is None or is_admin(user.id):
+            return await handler(update, context)
+        flood_control = bot_host.flood_control(context.bot)
+        if not flood_control.allow(user.id):
+            if flood_control.should_notify(user.id):
+                await reply_shed(update, "⏳ Juda tez yozyapsiz. Iltimos, birozdan keyin qayta urinib ko'ring.")
+            return None
+        if load_monitor.is_busy(context.application):
+            load_monitor.shed += 1
+            if flood_control.should_notify(user.id):
+                await reply_shed(update, "⏳ Bot hozir juda band. Iltimos, bir necha soniyadan keyin qayta urinib ko'ring.")
+            return None
+        return await handler(update, context)
+    return guarded
+
+# ==================== BIR NECHTA BOT ====================
+
+def bot_id_from_token(token):
+    """Tokenning ':' gacha qismi - bot ID si (get_me siz ham ma'lum)"""
+    prefix = token.split(':', 1)[0]
+    return int(prefix) if prefix.isdigit() else 0
+
+def user_states_collection_name(token):
+    """Asosiy bot - 'user_states'; qo'shimcha botlar holati o'z kolleksiyasida"""
+    return 'user_states' if token == BOT_TOKENS[0] else f"user_states_{bot_id_from_token(token)}"
+
+def bot_label(bot):
+    try:
+        return f"@{bot.username}"
+    except RuntimeError:
+        return str(bot_id_from_token(bot.token))  # initialize dan oldin
+
+class BotHost:
+    """Bitta jarayondagi botlar (BOT_TOKENS)
+
+    Kodlar va kanallar keshlari, MongoDB ulanishi, HTTP serverlar, qayta urinishlar
+    navbati va metrikalar barcha botlar uchun umumiy. Har bir botda faqat o'z
+    Application i (yangilanishlar navbati, foydalanuvchi holati) va o'z flood
+    cheklovchisi bor - shuning uchun har bir qo'shimcha bot xotirani kam oshiradi.
+    """
+
+    def __init__(self):
+        self.applications = []
+        self._flood_controls = {}  # bot ID -> FloodControl
+
+    def add(self, application):
+        self.applications.append(application)
+
+    @property
+    def primary(self):
+        return self.applications[0]
+
+    def flood_control(self, bot):
+        bot_id = bot_id_from_token(bot.token)
+        flood_control = self._flood_controls.get(bot_id)
+        if flood_control is None:
+            flood_control = self._flood_controls[bot_id] = FloodControl()
+        return flood_control
+
+    def flood_dropped(self):
+        return sum(flood_control.dropped for flood_control in self._flood_controls.values())
+
+    def summary(self):
+        """Har bir bot bo'yicha navbat va tashlangan xabarlar (/ready va /tezlik uchun)"""
+        bots = []
+        for application in self.applications:
+            flood_control = self._flood_controls.get(bot_id_from_token(application.bot.token))
+            bots.append({
+                "bot": bot_label(application.bot),
+                "queue": application.update_queue.qsize(),
+                "flood_dropped": flood_control.dropped if flood_control else 0,
+            })
+        return bots
+
+bot_host = BotHost()
+
+# ==================== TAYYORLIK TEKSHIRUVI ====================
+
+READY_MAX_LOOP_LAG_MS = float(os.getenv('READY_MAX_LOOP_LAG_MS', 2000))
+READY_MAX_MONGO_MS = float(os.getenv('READY_MAX_MONGO_MS', 1000))
+READY_MAX_QUEUE_DEPTH = int(os.getenv('READY_MAX_QUEUE_DEPTH', 1000))
+READY_BOT_API_FAILING_SEC = 60  # Bot API shuncha vaqt xato bersa - tayyor emas
+MONGO_PROBE_TTL = 5  # MongoDB ping natijasi shuncha soniya qayta ishlatiladi
+
+class TrackedRequest(HTTPXRequest):
+    """Bot API so'rovlarining oxirgi muvaffaqiyatli va xatoli vaqtini yozib borish"""
+
+    last_success = None
+    last_error = None
+
+    async def do_request(self, *args, **kwargs):
+        try:
+            status, payload = await super().do_request(*args, **kwargs)
+        except Exception:
+            TrackedRequest.last_error = time.time()  # Tarmoq xatosi yoki timeout
+            raise
+        if status < 500:
+            # 4xx (masalan, o'chirilgan post) - API ishlayapti
+            TrackedRequest.last_success = time.time()
+        else:
+            TrackedRequest.last_error = time.time()
+        return status, payload
+
+class ReadinessProbe:
+    """/ready uchun bog'liqliklar holati (/health - faqat liveness)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mongo = None
+        self._mongo_at = 0.0
+
+    def mongo(self):
+        with self._lock:
+            if self._mongo is None or time.monotonic() - self._mongo_at >= MONGO_PROBE_TTL:
+                started = time.perf_counter()
+                try:
+                    if client is None:
+                        raise RuntimeError("ulanish hali o'rnatilmagan")
+                    with mongo_timeout(READY_MAX_MONGO_MS / 1000 * 2):
+                        client.admin.command('ping')
+                    latency = (time.perf_counter() - started) * 1000
+                    self._mongo = {"ok": latency <= READY_MAX_MONGO_MS, "latency_ms": round(latency, 1)}
+                except Exception as e:
+                    self._mongo = {"ok": False, "error": str(e)}
+                self._mongo_at = time.monotonic()
+            return dict(self._mongo)
+
+    @staticmethod
+    def bot_api():
+        now = time.time()
+        last_success, last_error = TrackedRequest.last_success, TrackedRequest.last_error
+        failing = last_error is not None and (last_success is None or last_error > last_success)
+        return {
+            "ok": last_success is not None and not (failing and now - last_success > READY_BOT_API_FAILING_SEC),
+            "last_success_ago_s": round(now - last_success, 1) if last_success else None,
+            "last_error_ago_s": round(now - last_error, 1) if last_error else None,
+        }
+
+    def report(self):
+        """(tayyormi, JSON uchun lug'at)"""
+        lag = load_monitor.current_lag_ms()
+        depth = load_monitor.queue_depth()
+        caches_ready = startup_orchestrator.critical_ready()
+        checks = {
+            "event_loop": {"ok": lag is not None and lag <= READY_MAX_LOOP_LAG_MS,
+                           "lag_ms": round(lag, 1) if lag is not None else None},
+            "mongodb": self.mongo(),
+            "bot_api": self.bot_api(),
+            "queue": {"ok": depth <= READY_MAX_QUEUE_DEPTH, "depth": depth},
+            "caches": {"ok": caches_ready, "codes": len(code_catalog) if caches_ready else None},
+        }
+        ready = all(check["ok"] for check in checks.values())
+        return ready, {
+            "status": "ready" if ready else "unavailable",
+            "instance": INSTANCE_ID,
+            "leader": leader_lease.is_leader,
+            "uptime_s": int((datetime.now() - BOT_START_TIME).total_seconds()),
+            "bots": bot_host.summary(),
+            "checks": checks,
+        }
+
+readiness_probe = ReadinessProbe()
 
-# Bot sozlamalari
-TOKEN = os.getenv('TOKEN', '')  # @BotFather dan oling
-ADMIN_ID = int(os.getenv('ADMIN_ID', 0))  # Sizning Telegram ID
-CHANNEL_ID = int(os.getenv('CHANNEL_ID', 0))  # Kanal ID (manfiy son)
-ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', '')  # Sizning username
-MAIN_CHANNEL = os.getenv('MAIN_CHANNEL', '')  # Asosiy kanal username
-MONGODB_URI = os.getenv('MONGODB_URI', '')  # MongoDB connection string
-MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'kino_bot')  # MongoDB database nomi
+# ==================== ADMIN VAZIFALARI ====================
 
-# Xatolikni tekshirish
-if not TOKEN:
-    raise ValueError("TOKEN .env faylda aniqlanmagan yoki noto'g'ri")
-if not ADMIN_ID:
-    raise ValueError("ADMIN_ID .env faylda aniqlanmagan yoki noto'g'ri")
-if not CHANNEL_ID:
-    raise ValueError("CHANNEL_ID .env faylda aniqlanmagan yoki noto'g'ri")
-if not MONGODB_URI:
-    raise ValueError("MONGODB_URI .env faylda aniqlanmagan")
-
-print("🚀 Bot ishga tushmoqda...")
-
-# 📂 MongoDB ulanish
-try:
-    client = MongoClient(MONGODB_URI, tlsCAFile=certifi.where())
-    db = client[MONGO_DB_NAME]
-    
-    # Kolleksiyalar
-    admins_collection = db['admins']
-    codes_collection = db['codes']
-    users_collection = db['users']
-    channels_collection = db['channels']
-    subscriptions_collection = db['subscriptions']
-    
-    # Asosiy adminni qo'shish
-    if not admins_collection.find_one({"id": ADMIN_ID}):
-        admins_collection.insert_one({
-            "id": ADMIN_ID,
-            "username": ADMIN_USERNAME,
-            "added_at": datetime.now(),
-            "is_main": True
-        })
-    
-    print("✅ MongoDB ga ulandi")
-except Exception as e:
-    print(f"❌ MongoDB ga ulanishda xato: {e}")
-    raise
+ADMIN_JOB_WORKERS = 2  # Bir vaqtda bajariladigan og'ir vazifalar
+ADMIN_JOB_PROGRESS_INTERVAL = 2  # Progress xabarini yangilash oralig'i (s)
 
-# Bot ishga tushgan vaqt
-BOT_START_TIME = datetime.now()
+class JobCancelled(Exception):
+    pass
 
-# ==================== aiohttp SERVER ====================
-routes = web.RouteTableDef()
+class AdminJob:
+    """Bitta og'ir admin vazifasi (eksport, statistika) holati"""
 
-@routes.get("/", allow_head=True)
-async def root_route_handler(request):
-    return web.json_response({"status": "alive", "bot": "kino_bot"})
+    def __init__(self, kind, title):
+        self.kind = kind
+        self.title = title
+        self.done = 0
+        self.total = None
+        self.stage = "boshlanmoqda"
+        self._cancel = threading.Event()
 
-@routes.get("/ping")
-async def ping_handler(request):
-    return web.json_response({"status": "pong", "message": "Bot is alive"})
+    def report(self, done=None, total=None, stage=None):
+        """Ishchi oqimdan chaqiriladi; bekor qilingan bo'lsa JobCancelled"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if stage is not None:
+            self.stage = stage
 
-@routes.get("/health")
-async def health_handler(request):
-    return web.json_response({"status": "healthy", "service": "telegram_bot"})
+    def cancel(self):
+        self._cancel.set()
 
-async def start_aiohttp_server():
-    """aiohttp serverni ishga tushirish"""
-    app = web.Application()
-    app.add_routes(routes)
-    
-    runner = web.AppRunner(app)
-    await runner.setup()
-    
-    site = web.TCPSite(runner, '0.0.0.0', 8080)
-    await site.start()
-    print("🌐 aiohttp server 8080 portda ishga tushdi")
-    
-    # 🔄 Bot o'zini har 10 daqiqada ping qiladi
-    async def self_ping():
-        await asyncio.sleep(20)  # bot to'liq yuklanishini kutadi
-        render_url = os.environ.get('RENDER_EXTERNAL_HOSTNAME')
-        if not render_url:
-            print("❌ RENDER_EXTERNAL_HOSTNAME topilmadi, ping o'chirilgan")
+    def progress_text(self):
+        text = f"⏳ {self.title}: {self.stage}"
+        if self.total:
+            text += f"\n{self.done}/{self.total} ({self.done * 100 // self.total}%)"
+        return text
+
+class AdminJobRunner:
+    """Og'ir admin vazifalarini thread pool da bajarish
+
+    Handler darhol qaytadi, vazifa fonda ishlaydi va bitta xabarni tahrirlab
+    progressni ko'rsatadi. Har bir chatda bir turdagi vazifa bir vaqtda faqat
+    bitta bo'ladi - tugma ikki marta bosilsa ikkinchi eksport boshlanmaydi, boshqa
+    admin esa o'z natijasini oladi. Natija fayl sifatida
+    xotiradan yuboriladi (diskka yozilmaydi).
+    """
+
+    def __init__(self, max_workers=ADMIN_JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='admin-job')
+        self.active = {}  # (tur, chat_id) -> AdminJob
+
+    @staticmethod
+    def cancel_markup(kind):
+        return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Bekor qilish", callback_data=f"job_cancel:{kind}")]])
+
+    async def submit(self, update: Update, context: CallbackContext, kind, title, worker):
+        """worker(job) ishchi oqimda bajariladi va {"text": ...} yoki
+        {"document": bytes, "filename": ..., "caption": ...} qaytaradi"""
+        chat_id = update.effective_chat.id
+        running = self.active.get((kind, chat_id))
+        if running:
+            await context.bot.send_message(chat_id, f"⏳ Bu vazifa allaqachon bajarilmoqda.\n\n{running.progress_text()}")
             return
-            
-        url = f"https://{render_url}"
-        while True:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(f"{url}/ping") as resp:
-                        print(f"[PING] {url} → {resp.status}")
-            except Exception as e:
-                print(f"[PING ERROR] {e}")
-            await asyncio.sleep(600)  # har 10 daqiqada ping (600 sekund)
+        job = AdminJob(kind, title)
+        self.active[(kind, chat_id)] = job
+        try:
+            message = await context.bot.send_message(
+                chat_id, job.progress_text(), reply_markup=self.cancel_markup(kind))
+        except Exception:
+            self.active.pop((kind, chat_id), None)
+            raise
+        context.application.create_task(self._run(context, job, worker, message))
 
-    asyncio.create_task(self_ping())  # 🔄 fon jarayon sifatida ishlaydi
-    return app
+    async def _run(self, context: CallbackContext, job, worker, message):
+        future = asyncio.get_running_loop().run_in_executor(self._executor, worker, job)
+        shown = job.progress_text()
+        try:
+            while True:
+                try:
+                    result = await asyncio.wait_for(asyncio.shield(future), ADMIN_JOB_PROGRESS_INTERVAL)
+                    break
+                except asyncio.TimeoutError:
+                    text = job.progress_text()
+                    if text != shown:
+                        shown = text
+                        await self._edit(message, text, self.cancel_markup(job.kind))
+            if 'document' in result:
+                await self._edit(message, f"✅ {job.title}: tayyor")
+                await context.bot.send_document(
+                    chat_id=message.chat_id,
+                    document=result['document'],
+                    filename=result['filename'],
+                    caption=result.get('caption'))
+            else:
+                await self._edit(message, result['text'], parse_mode='HTML')
+        except JobCancelled:
+            await self._edit(message, f"🚫 {job.title}: bekor qilindi")
+        except Exception as e:
+            error_msg = f"Admin vazifasida xato ({job.title}): {e}"
+            admin_log.error(error_msg)
+            await self._edit(message, f"❌ {job.title}: xato yuz berdi!")
+            await send_error_to_admin(context, error_msg, handler=f"admin_job:{job.kind}")
+        finally:
+            self.active.pop((job.kind, message.chat_id), None)
 
-def run_aiohttp_server():
-    """aiohttp serverni threadda ishga tushirish"""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
+    @staticmethod
+    async def _edit(message, text, reply_markup=None, parse_mode=None):
+        try:
+            await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                admin_log.warning(f"Vazifa xabarini yangilashda xato: {e}")
+
+    def cancel(self, kind, chat_id):
+        job = self.active.get((kind, chat_id))
+        if job:
+            job.cancel()
+        return job is not None
+
+    def cancel_all(self):
+        for job in list(self.active.values()):
+            job.cancel()
+
+admin_jobs = AdminJobRunner()
+
+# ==================== QAYTA URINISHLAR ====================
+
+RETRY_MAX_ATTEMPTS = 5  # Bitta post uchun
+RETRY_BACKOFF_BASE = 1.0  # Tarmoq xatolarida: 1, 2, 4, ... soniya (± jitter)
+RETRY_BACKOFF_MAX = 30.0
+RETRY_INLINE_MAX_DELAY = 3.0  # Bundan uzoq kutish navbat orqali (handler band qilinmaydi)
+RETRY_QUEUE_LIMIT = 1000
+RETRY_QUEUE_CONCURRENCY = 8  # Navbatdan bir vaqtda davom ettiriladigan yuborishlar
+
+def retry_delay(error, attempt, timed_out=False):
+    """Qayta urinishgacha kutish (s) yoki None - xato doimiy
+
+    TimedOut da Telegram so'rovni qabul qilib bo'lgan bo'lishi mumkin, shuning uchun
+    post uchun faqat bitta qayta urinish (timed_out - oldin ham vaqt tugaganmi).
+    Idempotentlik tekshiruvi yo'q: yuborish "kamida bir marta" - shu bitta urinishda
+    foydalanuvchi postni ikki marta olishi mumkin.
+    """
+    if isinstance(error, RetryAfter):
+        return float(error.retry_after)  # Telegram aytgan vaqtni aynan kutamiz
+    if isinstance(error, (BadRequest, Forbidden, ChatMigrated, InvalidToken)):
+        return None  # BadRequest ham NetworkError dan meros - avval tekshiriladi
+    if isinstance(error, TimedOut):  # NetworkError dan meros - undan oldin
+        return None if timed_out else RETRY_BACKOFF_BASE * random.uniform(0.5, 1.5)
+    if isinstance(error, NetworkError):
+        return min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+    return None
+
+class SendMetrics:
+    """Yuborish xatolari natijalari xato turi bo'yicha"""
+
+    def __init__(self):
+        self.outcomes = Counter()  # (xato turi, natija) -> soni
+
+    def record(self, error, outcome):
+        error_class = error if isinstance(error, str) else type(error).__name__
+        self.outcomes[(error_class, outcome)] += 1
+
+    def report(self):
+        if not self.outcomes:
+            return "• xato yo'q"
+        return "\n".join(
+            f"• {error_class} → {outcome}: {count}"
+            for (error_class, outcome), count in sorted(self.outcomes.items()))
+
+class RetryQueue:
+    """Uzoq kutishni talab qiladigan yuborishlar navbati
+
+    Handler qaytgandan keyin ham saqlanadi: fon vazifasi muddati kelgan
+    yozuvlarni deliver_posts orqali davom ettiradi. Har bir yozuv alohida
+    vazifada yuboriladi (bir vaqtda concurrency tadan ko'p emas) - bitta
+    foydalanuvchidagi flood-wait boshqalarini kutdirmaydi. Navbat chegaralangan,
+    to'xtashda qolgan yozuvlar pending_deliveries ga saqlanadi.
+    """
+
+    def __init__(self, limit=RETRY_QUEUE_LIMIT, concurrency=RETRY_QUEUE_CONCURRENCY):
+        self.limit = limit
+        self.concurrency = concurrency
+        self._heap = []  # (vaqt, tartib, yozuv)
+        self._sequence = 0
+        self._wakeup = None
+        self._slots = None
+        self._running = set()
+        self._stopping = False
+        self._task = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, delay, **entry):
+        if len(self._heap) >= self.limit:
+            return False
+        self._sequence += 1
+        heapq.heappush(self._heap, (time.monotonic() + delay, self._sequence, entry))
+        if self._wakeup:
+            self._wakeup.set()
+        return True
+
+    async def _worker(self):
+        while not self._stopping and not shutdown_coordinator.requested:
+            wait = self._heap[0][0] - time.monotonic() if self._heap else None
+            if wait is None or wait > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            await self._slots.acquire()
+            if self._stopping:
+                self._slots.release()
+                break  # Yozuv navbatda qoladi - stop() saqlaydi
+            _, _, entry = heapq.heappop(self._heap)
+            task = asyncio.create_task(self._deliver(entry))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _deliver(self, entry):
+        try:
+            await deliver_posts(**entry)  # entry['bot'] - so'rov kelgan bot
+        except Exception as e:
+            delivery_log.error("Navbatdagi yuborishda xato: %s", e)
+        finally:
+            self._slots.release()
+
+    def start(self):
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def stop(self):
+        """Joriy yuborishlar tugashini kutish va qolganlarini saqlash"""
+        self._stopping = True
+        if self._task:
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+        # Davom etayotganlar muddat o'tsa qolgan postlarini o'zlari saqlaydi
+        await asyncio.gather(*self._running, return_exceptions=True)
+        for _, _, entry in self._heap:
+            await asyncio.to_thread(
+                shutdown_coordinator.checkpoint,
+                entry['bot'].id, entry['user_id'], entry['code_key'], entry['post_ids'], entry['counted'])
+        self._heap.clear()
+
+send_metrics = SendMetrics()
+retry_queue = RetryQueue()
+
+# ==================== FOYDALANUVCHILAR ARXIVI ====================
+
+USER_ARCHIVE_AFTER_DAYS = int(os.getenv('USER_ARCHIVE_AFTER_DAYS', 90))  # Shuncha kun faol bo'lmagan - arxivga
+USER_ARCHIVE_BATCH = 1000  # Bitta bo'lakda ko'chiriladigan foydalanuvchilar
+USER_ARCHIVE_PAUSE = 0.2  # Bo'laklar orasida (s) - MongoDB ni band qilib qo'ymaslik uchun
+USER_ARCHIVE_INTERVAL = 6 * 60 * 60
+
+def archive_inactive_users(cutoff=None):
+    """Faol bo'lmagan foydalanuvchilarni users dan users_archive ga bo'laklab ko'chirish
+
+    Avval arxivga yoziladi, keyin users dan o'chiriladi - jarayon to'xtab qolsa ham
+    foydalanuvchi yo'qolmaydi. Ko'chirish paytida qaytib kelganlar users da qoladi.
+    """
+    cutoff = cutoff or datetime.now() - timedelta(days=USER_ARCHIVE_AFTER_DAYS)
+    moved = 0
+    while not shutdown_coordinator.requested:
+        batch = list(users_collection.find({"last_activity": {"$lt": cutoff}}).limit(USER_ARCHIVE_BATCH))
+        if not batch:
+            break
+        archived_at = datetime.now()
+        users_archive_collection.bulk_write(
+            [ReplaceOne({"_id": user['_id']}, {**user, "archived_at": archived_at}, upsert=True) for user in batch],
+            ordered=False)
+        ids = [user['_id'] for user in batch]
+        users_collection.delete_many({"_id": {"$in": ids}, "last_activity": {"$lt": cutoff}})
+        # Shu orada faol bo'lganlar users da qoldi - arxivdagi nusxasi kerak emas
+        returned = [user['_id'] for user in users_collection.find({"_id": {"$in": ids}}, {"_id": 1})]
+        if returned:
+            users_archive_collection.delete_many({"_id": {"$in": returned}})
+        moved += len(ids) - len(returned)
+        if len(batch) < USER_ARCHIVE_BATCH:
+            break
+        time.sleep(USER_ARCHIVE_PAUSE)
+    return moved
+
+async def archive_users_job(context: CallbackContext):
+    """Davriy arxivlash (JobQueue, ko'p nusxali rejimda faqat lider)"""
     try:
-        runner = loop.run_until_complete(start_aiohttp_server())
-        print("✅ aiohttp server ishga tushdi va ping jarayoni boshlandi")
-        loop.run_forever()
+        moved = await asyncio.to_thread(archive_inactive_users)
+        if moved:
+            log.info(f"🗄️ {moved} ta faol bo'lmagan foydalanuvchi arxivga ko'chirildi")
     except Exception as e:
-        print(f"❌ aiohttp serverda xato: {e}")
-    finally:
-        loop.close()
+        log.error(f"Foydalanuvchilarni arxivlashda xato: {e}")
 
-# ==================== FLASK SERVER ====================
-app = Flask(__name__)
+# ==================== XATOLAR HISOBOTI ====================
 
-@app.route('/')
-def home():
-    return {
-        "status": "online",
-        "bot": "Kino Bot",
-        "start_time": BOT_START_TIME.strftime('%Y-%m-%d %H:%M:%S'),
-        "uptime": str(datetime.now() - BOT_START_TIME)
-    }
+ERROR_DIGEST_INTERVAL = int(os.getenv('ERROR_DIGEST_INTERVAL', 300))  # Adminga eng ko'pi bilan shu oraliqda bitta hisobot (s)
+ERROR_DIGEST_MAX_GROUPS = 50  # Bundan ortiq turdagi xatolar faqat sanaladi
+ERROR_ID_PATTERN = re.compile(r'\b[0-9a-f]{24}\b|\b[0-9a-f]{8}-[0-9a-f-]{27}\b')  # ObjectId, UUID
+ERROR_NUMBER_PATTERN = re.compile(r'-?\d+(?:\.\d+)?')
 
-@app.route('/health')
-def health():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+def error_template(message):
+    """Xabardagi o'zgaruvchan qismlarni (ID, son) almashtirish - bir xil xatolar bitta guruhga tushadi"""
+    return ERROR_NUMBER_PATTERN.sub('N', ERROR_ID_PATTERN.sub('<id>', message))[:200]
 
-@app.route('/ping')
-def ping():
-    return {"status": "pong", "time": datetime.now().isoformat()}
+class ErrorAggregator:
+    """Xatolarni (turi, handler, xabar shabloni) bo'yicha guruhlab, adminga davriy hisobot yuborish
 
-def run_flask():
-    """Flask serverni ishga tushirish"""
-    try:
-        from waitress import serve
-        serve(app, host='0.0.0.0', port=10000)
-    except ImportError:
-        app.run(host='0.0.0.0', port=10000, debug=False)
+    Tinch vaqtdagi birinchi xato darhol yuboriladi, keyingilari oraliq tugaguncha
+    yig'iladi - MongoDB yoki Bot API ishlamay qolganda admin xabarlarga ko'milmaydi.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.groups = {}  # fingerprint -> guruh
+        self.overflow = 0
+        self.last_sent = float('-inf')
+        self.digests_sent = 0
+        self._flush_task = None
+
+    def record(self, message, handler, exc_info=None):
+        error_type = exc_info[0].__name__ if exc_info and exc_info[0] else "Xato"
+        template = error_template(message)
+        fingerprint = hashlib.sha1(f"{error_type}|{handler}|{template}".encode('utf-8')).hexdigest()[:12]
+        group = self.groups.get(fingerprint)
+        if group is None:
+            if len(self.groups) >= ERROR_DIGEST_MAX_GROUPS:
+                self.overflow += 1
+                return None
+            group = self.groups[fingerprint] = {
+                "type": error_type, "handler": handler, "sample": message,
+                "count": 0, "first": datetime.now(), "traceback": None,
+            }
+        group["count"] += 1
+        group["last"] = datetime.now()
+        if group["traceback"] is None and exc_info and exc_info[2] is not None:
+            group["traceback"] = ''.join(traceback.format_exception(*exc_info))
+        return fingerprint
+
+    def report(self, bot, message, handler, exc_info=None):
+        """Xatoni yozib, hisobot yuborilishini rejalashtirish (oraliqda bittadan ko'p emas)"""
+        self.record(message, handler, exc_info)
+        if self._flush_task is None or self._flush_task.done():
+            delay = max(0.0, self.last_sent + self.interval - time.monotonic())
+            self._flush_task = asyncio.create_task(self._flush_later(bot, delay))
+
+    async def _flush_later(self, bot, delay):
+        await asyncio.sleep(delay)
+        await self.flush(bot)
+        if self.groups or self.overflow:
+            # Yuborish paytida kelgan yoki yuborilmay qolgan xatolar - keyingi oraliqda
+            self._flush_task = asyncio.create_task(self._flush_later(bot, self.interval))
+
+    def digest(self, groups, overflow):
+        ordered = sorted(groups.values(), key=lambda group: -group["count"])
+        total = sum(group["count"] for group in ordered) + overflow
+        lines = [f"⚠️ <b>Botda xato yuz berdi</b> ({total} marta, "
+                 f"{min(group['first'] for group in ordered):%H:%M:%S} - {max(group['last'] for group in ordered):%H:%M:%S})\n"]
+        for group in ordered:
+            lines.append(f"• <b>{group['count']}×</b> {html.escape(group['type'])} — <code>{html.escape(group['handler'])}</code>\n"
+                         f"   {html.escape(group['sample'][:300])}")
+            shown = len(lines) - 1
+            if sum(len(line) for line in lines) > 2500 and shown < len(ordered):
+                lines.append(f"• ... yana {len(ordered) - shown} turdagi xato")
+                break
+        if overflow:
+            lines.append(f"• yana {overflow} ta boshqa turdagi xato")
+        sample = next((group for group in ordered if group["traceback"]), None)
+        text = "\n".join(lines)
+        if sample:
+            text += f"\n\n<b>Namuna traceback</b> ({html.escape(sample['type'])}):\n"
+            text += f"<pre>{html.escape(sample['traceback'][-(3900 - len(text)):])}</pre>"
+        return text
+
+    async def flush(self, bot):
+        """Yig'ilgan xatolarni bitta xabarda yuborish (yuborilmasa - keyingi hisobotga qoladi)"""
+        if not self.groups and not self.overflow:
+            return
+        groups, overflow = self.groups, self.overflow
+        self.groups, self.overflow = {}, 0
+        self.last_sent = time.monotonic()
+        try:
+            await bot.send_message(chat_id=ADMIN_ID, text=self.digest(groups, overflow), parse_mode='HTML')
+            self.digests_sent += 1
+        except Exception as e:
+            log.error(f"Xatolar hisobotini adminga yuborishda xato: {e}")
+            for fingerprint, group in groups.items():
+                current = self.groups.get(fingerprint)
+                if current is None:
+                    self.groups[fingerprint] = group
+                else:
+                    current["count"] += group["count"]
+                    current["first"] = group["first"]
+            self.overflow += overflow
+
+    async def close(self, bot):
+        """To'xtashda - rejalashtirilgan hisobotni kutmasdan qolgan xatolarni yuborish"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush(bot)
+
+error_aggregator = ErrorAggregator(ERROR_DIGEST_INTERVAL)
 
 # ==================== BOT FUNKSIYALARI ====================
 
 # 🛠️ Yordamchi funksiyalar
+# 👥 Adminlar va majburiy kanallar keshi (ishga tushishda isitiladi)
+ADMIN_CACHE = set()
+CHANNEL_CACHE = []
+
+def load_admin_cache():
+    """Admin ID larini keshga yuklash"""
+    admin_ids = {admin['id'] for admin in admins_collection.find({}, {"id": 1})}
+    admin_ids.add(ADMIN_ID)
+    ADMIN_CACHE.clear()
+    ADMIN_CACHE.update(admin_ids)
+    return len(admin_ids)
+
+def load_channel_cache():
+    """Majburiy kanallarni keshga yuklash"""
+    CHANNEL_CACHE[:] = list(channels_collection.find())
+    return len(CHANNEL_CACHE)
+
+def get_channels():
+    return list(CHANNEL_CACHE)
+
 def is_admin(user_id):
-    return admins_collection.find_one({"id": user_id}) is not None
+    return user_id in ADMIN_CACHE
 
 def channel_link(post_id):
     return f"https://t.me/c/{str(CHANNEL_ID)[4:]}/{post_id}"
 
 def track_user(user):
-    user_data = {
-        "id": user.id,
-        "name": user.full_name,
-        "username": user.username,
-        "phone": None,
-        "start_time": datetime.now(),
-        "last_activity": datetime.now()
-    }
+    now = datetime.now()
+    # Faol foydalanuvchi - bitta so'rov
+    if users_collection.update_one({"id": user.id}, {"$set": {"last_activity": now}}).matched_count:
+        return
     
-    existing_user = users_collection.find_one({"id": user.id})
-    if existing_user:
+    # Arxivdagi foydalanuvchi qaytdi - avval issiq kolleksiyaga yoziladi, keyin arxivdan
+    # o'chiriladi (oraliqda jarayon to'xtasa ham foydalanuvchi yo'qolmaydi)
+    archived = users_archive_collection.find_one({"id": user.id})
+    if archived:
+        for field in ('id', 'archived_at', 'last_activity'):
+            archived.pop(field, None)
         users_collection.update_one(
             {"id": user.id},
-            {"$set": {"last_activity": datetime.now()}}
+            {"$set": {"last_activity": now}, "$setOnInsert": archived},
+            upsert=True
         )
-    else:
-        users_collection.insert_one(user_data)
+        users_archive_collection.delete_one({"_id": archived['_id']})
+        return
+    
+    # Yangi foydalanuvchi - upsert: bir vaqtdagi ikki so'rov ikkita yozuv yaratmaydi
+    users_collection.update_one(
+        {"id": user.id},
+        {
+            "$set": {"last_activity": now},
+            "$setOnInsert": {
+                "name": user.full_name,
+                "username": user.username,
+                "phone": None,
+                "start_time": now
+            }
+        },
+        upsert=True
+    )
 
-async def send_error_to_admin(context: CallbackContext, error_msg):
+async def send_error_to_admin(context: CallbackContext, error_msg, handler=None):
+    """Xatoni adminga yuborish - bir xil xatolar guruhlanib, davriy hisobotda boradi
+
+    handler berilmasa @logged log kontekstiga yozgan handler nomi olinadi.
+    """
     try:
-        await context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text=f"⚠️ Botda xato yuz berdi:\n\n{error_msg}"
-        )
+        if handler is None:
+            handler = (log_context.get() or {}).get("handler") or "noma'lum"
+        # except blokidagi joriy istisno - turi va traceback
+        error_aggregator.report(context.bot, error_msg, handler, sys.exc_info())
     except Exception as e:
-        print(f"Xatoni adminga yuborishda xato: {e}")
+        log.error(f"Xatoni adminga yuborishda xato: {e}")
+
+# 🎛️ Menyu tugmalari (xabarlar routeri ham shu nomlar bo'yicha ishlaydi)
+ADMIN_PANEL_BUTTON = "🎛️ Admin panelga qaytish"
+USER_MODE_BUTTON = "👤 Foydalanuvchi menyusi"
+BACK_BUTTON = "Orqaga"
+ADMIN_MENU_BUTTONS = [
+    ["🎬 Kino qo'shish", "📋 Kodlar ro'yxati"],
+    ["🗑️ Kod o'chirish", "📢 Majburiy kanallar"],
+    ["🤖 Bot funksiyalari", "✏️ Kodlarni tahrirlash"],
+    ["👥 Admin tahrirlash", "👤 Foydalanuvchilar"],
+    ["📊 Statistika", USER_MODE_BUTTON]
+]
+USER_MENU_BUTTONS = [
+    ["📞 Admin bilan bog'lanish", "📢 Bizning kanallar"],
+    ["ℹ️ Yordam"]
+]
 
 def admin_menu():
-    buttons = [
-        ["🎬 Kino qo'shish", "📋 Kodlar ro'yxati"],
-        ["🗑️ Kod o'chirish", "📢 Majburiy kanallar"],
-        ["🤖 Bot funksiyalari", "✏️ Kodlarni tahrirlash"],
-        ["👥 Admin tahrirlash", "👤 Foydalanuvchilar"],
-        ["📊 Statistika", "👤 Foydalanuvchi menyusi"]
-    ]
-    return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
+    return ReplyKeyboardMarkup(ADMIN_MENU_BUTTONS, resize_keyboard=True)
 
 def user_menu(user_id=None):
-    buttons = [
-        ["📞 Admin bilan bog'lanish", "📢 Bizning kanallar"],
-        ["ℹ️ Yordam"]
-    ]
+    buttons = list(USER_MENU_BUTTONS)
     # ✅ Faqat adminlar uchun "Admin panelga qaytish" tugmasi
     if user_id and is_admin(user_id):
-        buttons.append(["🎛️ Admin panelga qaytish"])
+        buttons.append([ADMIN_PANEL_BUTTON])
     return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
 
 async def check_subscription(user_id, context: CallbackContext):
     """Obunani tekshirish - YANGILANGAN VERSIYA"""
     try:
-        channels = list(channels_collection.find())
+        channels = get_channels()
         if not channels:
             return True
         
@@ -234,20 +2612,24 @@ async def check_subscription(user_id, context: CallbackContext):
         for channel in channels:
             try:
                 chat_id = channel['id']
-                try:
-                    member = await context.bot.get_chat_member(chat_id=chat_id, user_id=user_id)
-                    
-                    if member.status in ['member', 'administrator', 'creator']:
-                        continue
-                    else:
-                        not_subscribed.append(channel)
-                        
-                except Exception as channel_error:
-                    print(f"Kanal {channel['id']} tekshirishda xato: {channel_error}")
+                push = await membership_store.is_push_channel(chat_id, context.bot)
+                # Push kanallarda ma'lum holat API siz olinadi
+                is_member = await membership_store.lookup(chat_id, user_id) if push else None
+                if is_member is None:
+                    try:
+                        member = await context.bot.get_chat_member(chat_id=chat_id, user_id=user_id)
+                        is_member = is_member_status(member)
+                        if push:
+                            await membership_store.remember(chat_id, user_id, is_member)
+                    except Exception as channel_error:
+                        log_event(subscription_log, logging.WARNING, "subscription_check", "Kanal %s tekshirishda xato: %s", channel['id'], channel_error)
+                        is_member = False
+                
+                if not is_member:
                     not_subscribed.append(channel)
                     
             except Exception as e:
-                print(f"Kanal {channel['id']} obunasini tekshirishda umumiy xato: {e}")
+                log_event(subscription_log, logging.WARNING, "subscription_check", "Kanal %s obunasini tekshirishda umumiy xato: %s", channel['id'], e)
                 not_subscribed.append(channel)
         
         if not not_subscribed:
@@ -260,63 +2642,171 @@ async def check_subscription(user_id, context: CallbackContext):
         
         return not_subscribed
     except Exception as e:
-        print(f"Obunani tekshirishda umumiy xato: {e}")
+        subscription_log.error("Obunani tekshirishda umumiy xato: %s", e)
         return True
 
-async def process_user_code(user_id, code_text, context: CallbackContext):
+DELIVERY_DEDUP_WINDOW = 60  # Yuborilgan kod shu vaqt ichida qayta so'ralsa - qayta yuborilmaydi (s)
+
+class DeliveryDedup:
+    """(foydalanuvchi, kod) bo'yicha takroriy so'rovlarni birlashtirish"""
+
+    MAX_ENTRIES = 10000
+
+    def __init__(self, window=DELIVERY_DEDUP_WINDOW):
+        self.window = window
+        self._entries = {}  # (bot_id, user_id, kod) -> (holat, vaqt)
+        self.suppressed = 0
+
+    def begin(self, bot_id, user_id, code_key):
+        """None - yuborishni boshlash mumkin, aks holda 'in_progress' yoki 'recent'"""
+        now = time.monotonic()
+        entry = self._entries.get((bot_id, user_id, code_key))
+        if entry and (entry[0] == 'in_progress' or now - entry[1] < self.window):
+            self.suppressed += 1
+            return entry[0]
+        if len(self._entries) >= self.MAX_ENTRIES:
+            self._prune(now)
+        self._entries[(bot_id, user_id, code_key)] = ('in_progress', now)
+        return None
+
+    def finish(self, bot_id, user_id, code_key, delivered):
+        if delivered:
+            self._entries[(bot_id, user_id, code_key)] = ('recent', time.monotonic())
+        else:
+            self._entries.pop((bot_id, user_id, code_key), None)
+
+    def _prune(self, now):
+        for key in [key for key, (state, at) in self._entries.items()
+                    if state == 'recent' and now - at >= self.window]:
+            del self._entries[key]
+
+delivery_dedup = DeliveryDedup()
+
+DELIVERY_DEFERRED = 'deferred'  # deliver_posts: qolgan postlar navbatga yoki keyingi ishga tushishga qoldirildi
+
+async def deliver_posts(bot, user_id, code_key, post_ids, counted=False, attempt=0, retry_of=None):
+    """Postlarni ketma-ket yuborish
+
+    Vaqtinchalik xatolarda (RetryAfter, tarmoq) qayta uriniladi: qisqa kutish shu
+    yerning o'zida, uzoq kutish esa qolgan postlar bilan birga retry_queue orqali.
+    To'xtash muddati tugasa qolgan postlar keyingi ishga tushish uchun saqlanadi.
+    Hammasi yuborilgan bo'lsa True, qolgani keyinga qoldirilgan bo'lsa
+    DELIVERY_DEFERRED (u ham rost qiymat), hech narsa yuborilmagan bo'lsa False.
+    """
+    sent_count = 0
+    for index, post_id in enumerate(post_ids):
+        if post_catalog.is_deleted(post_id):
+            continue  # Kanaldan o'chirilgan post
+        if shutdown_coordinator.expired():
+            # Bot to'xtayapti - qolgan postlar keyingi ishga tushishda yuboriladi
+            await asyncio.to_thread(
+                shutdown_coordinator.checkpoint, bot.id, user_id, code_key, post_ids[index:], counted or sent_count > 0)
+            try:
+                await bot.send_message(
+                    chat_id=user_id,
+                    text="♻️ Bot qayta ishga tushmoqda. Qolgan qismlar birozdan keyin yuboriladi.")
+            except Exception as e:
+                delivery_log.warning("Qayta ishga tushish xabarini yuborishda xato: %s", e)
+            return DELIVERY_DEFERRED
+        if sent_count > 0:
+            await asyncio.sleep(1)  # Spamdan saqlash uchun
+        last_error, retry_of = retry_of, None  # Navbatdan kelgan bo'lsa - oldingi xato turi
+        timed_out = False
+        while True:
+            try:
+                # 🔒 COPY MESSAGE - FORWARD QILMAYDI VA KONTENTNI HIMOYA QILADI
+                await bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=CHANNEL_ID,
+                    message_id=post_id,
+                    disable_notification=True,
+                    protect_content=True  # 🔒 Kontentni himoya qilish
+                )
+                sent_count += 1
+                if last_error:
+                    send_metrics.record(last_error, 'succeeded')
+                attempt = 0
+                break
+            except Exception as e:
+                delay = retry_delay(e, attempt, timed_out)
+                if delay is None and isinstance(e, TimedOut):
+                    # Ikkinchi marta ham javob yo'q - post yetib borgan bo'lishi mumkin, takrorlamaymiz
+                    send_metrics.record(e, 'gave_up')
+                    delivery_log.warning("Post %s: javob kutish vaqti yana tugadi, qayta yuborilmaydi", post_id)
+                    attempt = 0
+                    break
+                if delay is None:
+                    send_metrics.record(e, 'permanent')
+                    if is_missing_post_error(e):
+                        post_catalog.mark_deleted(post_id)
+                    log_event(delivery_log, logging.WARNING, "send_retry", "Post %s yuborishda xato: %s", post_id, e)
+                    break
+                attempt += 1
+                last_error = e
+                timed_out = timed_out or isinstance(e, TimedOut)
+                if attempt > RETRY_MAX_ATTEMPTS:
+                    send_metrics.record(e, 'gave_up')
+                    delivery_log.error("Post %s %s urinishdan keyin ham yuborilmadi: %s", post_id, RETRY_MAX_ATTEMPTS, e)
+                    attempt = 0
+                    break
+                if delay <= RETRY_INLINE_MAX_DELAY:
+                    send_metrics.record(e, 'retried')
+                    await asyncio.sleep(delay)
+                    continue
+                # Uzoq kutish - qolgan postlar navbat orqali, tartib saqlanadi
+                queued = retry_queue.push(
+                    delay, bot=bot, user_id=user_id, code_key=code_key, post_ids=post_ids[index:],
+                    counted=counted or sent_count > 0, attempt=attempt, retry_of=type(e).__name__)
+                send_metrics.record(e, 'queued' if queued else 'dropped')
+                if not queued:
+                    delivery_log.error("Qayta urinish navbati to'la - post %s tashlab yuborildi: %s", post_id, e)
+                if sent_count > 0 and not counted:
+                    code_stats.record_delivery(code_key)
+                if queued:
+                    return DELIVERY_DEFERRED
+                return sent_count > 0
+    if sent_count > 0 and not counted:
+        code_stats.record_delivery(code_key)
+    return sent_count > 0
+
+async def process_user_code(user_id, code_text, context: CallbackContext, notify_duplicate=True):
     """Foydalanuvchi kodi bilan ishlash - FORWARD QILISH O'CHIRILGAN"""
     try:
-        codes = list(codes_collection.find())
-        for code in codes:
-            if code['code'].lower() == code_text.lower():
-                try:
-                    # Agar post_ids list bo'lsa, barcha postlarni yuborish
-                    if isinstance(code.get('post_ids'), list):
-                        sent_count = 0
-                        for post_id in code['post_ids']:
-                            try:
-                                # 🔒 COPY MESSAGE - FORWARD QILMAYDI VA KONTENTNI HIMOYA QILADI
-                                await context.bot.copy_message(
-                                    chat_id=user_id,
-                                    from_chat_id=CHANNEL_ID,
-                                    message_id=post_id,
-                                    disable_notification=True,
-                                    protect_content=True  # 🔒 Kontentni himoya qilish
-                                )
-                                sent_count += 1
-                                await asyncio.sleep(1)  # Spamdan saqlash uchun
-                            except Exception as e:
-                                print(f"Post {post_id} yuborishda xato: {e}")
-                        
-                        if sent_count > 0:
-                            return True
-                        else:
-                            return False
-                    # Agar oddiy post_id bo'lsa
-                    elif code.get('post_id'):
-                        # 🔒 COPY MESSAGE - FORWARD QILMAYDI VA KONTENTNI HIMOYA QILADI
-                        await context.bot.copy_message(
-                            chat_id=user_id,
-                            from_chat_id=CHANNEL_ID,
-                            message_id=code['post_id'],
-                            disable_notification=True,
-                            protect_content=True  # 🔒 Kontentni himoya qilish
-                        )
-                        return True
-                except Exception as e:
-                    print(f"Kino yuborishda xato: {e}")
-                    return False
-        
-        return False
+        code = find_code(code_text)
+        if not code:
+            return False
+        duplicate = delivery_dedup.begin(context.bot.id, user_id, code.code)
+        if duplicate:
+            # Xuddi shu kod yuborilmoqda yoki yaqinda yuborilgan - qayta nusxalamaymiz
+            if notify_duplicate:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text="⏳ Bu kod hozir yuborilmoqda, biroz kuting." if duplicate == 'in_progress'
+                    else "✅ Bu kod sizga yaqinda yuborildi - yuqoridagi xabarlarni ko'ring.")
+            return True
+        code_stats.record_request(code.code)
+        load_monitor.active_deliveries += 1
+        delivered = False
+        try:
+            # Kodga tegishli barcha postlarni yuborish
+            delivered = await deliver_posts(context.bot, user_id, code.code, list(code_catalog.post_ids(code)))
+            return delivered
+        except Exception as e:
+            delivery_log.error("Kino yuborishda xato: %s", e)
+            return False
+        finally:
+            load_monitor.active_deliveries -= 1
+            # 'recent' faqat seriya to'liq yuborilganda - navbatdagi qismi bo'lsa yozuv tozalanadi
+            delivery_dedup.finish(context.bot.id, user_id, code.code, delivered is True)
     except Exception as e:
-        print(f"Kodni qayta ishlashda xato: {e}")
+        delivery_log.error("Kodni qayta ishlashda xato: %s", e)
         return False
 
 async def show_our_channels(update: Update, context: CallbackContext):
     """Bizning kanallarni ko'rsatish"""
     try:
         user_id = update.effective_user.id
-        channels = list(channels_collection.find())
+        channels = get_channels()
         if not channels:
             if update.callback_query:
                 await update.callback_query.edit_message_text(
@@ -363,7 +2853,7 @@ async def show_our_channels(update: Update, context: CallbackContext):
             )
     except Exception as e:
         error_msg = f"Kanallarni ko'rsatishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         user_id = update.effective_user.id
         if update.callback_query:
             await update.callback_query.edit_message_text(
@@ -376,128 +2866,139 @@ async def show_our_channels(update: Update, context: CallbackContext):
                 reply_markup=user_menu(user_id)
             )
 
-async def export_users(update: Update, context: CallbackContext):
-    try:
-        if not is_admin(update.effective_user.id):
-            await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
-            return
+EXPORT_BATCH_SIZE = 1000
 
-        users = list(users_collection.find())
-        if not users:
-            await update.message.reply_text("❌ Foydalanuvchilar mavjud emas!")
-            return
+def build_excel(rows, job):
+    """Qatorlardan xotirada Excel fayl yasash"""
+    job.report(stage="Excel fayl tayyorlanmoqda")
+    import pandas as pd  # Og'ir kutubxona - faqat eksport paytida yuklanadi
+    buffer = io.BytesIO()
+    pd.DataFrame(rows).to_excel(buffer, index=False)
+    return buffer.getvalue()
 
-        for user in users:
-            user.pop('_id', None)
-            if 'start_time' in user and isinstance(user['start_time'], datetime):
-                user['start_time'] = user['start_time'].strftime('%Y-%m-%d %H:%M:%S')
-            if 'last_activity' in user and isinstance(user['last_activity'], datetime):
-                user['last_activity'] = user['last_activity'].strftime('%Y-%m-%d %H:%M:%S')
-        
-        df = pd.DataFrame(users)
-        excel_file = "users.xlsx"
-        df.to_excel(excel_file, index=False)
+def export_users_job(job, include_archive=False):
+    """Faol foydalanuvchilar; include_archive - arxivdagilar ham ("archived" ustuni bilan)"""
+    collections = [users_collection] + ([users_archive_collection] if include_archive else [])
+    total = sum(collection.estimated_document_count() for collection in collections)
+    job.report(0, total, "foydalanuvchilar o'qilmoqda")
+    users = []
+    for collection in collections:
+        for user in collection.find({}, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE):
+            for field in ('start_time', 'last_activity', 'archived_at'):
+                if isinstance(user.get(field), datetime):
+                    user[field] = user[field].strftime('%Y-%m-%d %H:%M:%S')
+            if include_archive:
+                user['archived'] = collection is users_archive_collection
+            users.append(user)
+            if len(users) % EXPORT_BATCH_SIZE == 0:
+                job.report(len(users))
+    if not users:
+        return {"text": "❌ Foydalanuvchilar mavjud emas!"}
+    job.report(len(users))
+    caption = ("📊 Foydalanuvchilar ro'yxati (arxiv bilan)" if include_archive else
+               f"📊 Faol foydalanuvchilar ro'yxati\n🗄️ {USER_ARCHIVE_AFTER_DAYS} kundan ortiq faol bo'lmaganlar bilan: /users hammasi")
+    return {"document": build_excel(users, job), "filename": "users.xlsx", "caption": caption}
 
-        await context.bot.send_document(
-            chat_id=update.effective_chat.id,
-            document=open(excel_file, 'rb'),
-            caption="📊 Foydalanuvchilar ro'yxati"
-        )
-        
-        os.remove(excel_file)
-    except Exception as e:
-        error_msg = f"Foydalanuvchilarni eksport qilishda xato: {e}"
-        print(error_msg)
-        await update.message.reply_text("❌ Foydalanuvchilar ro'yxatini yuborishda xato yuz berdi!")
-        await send_error_to_admin(context, error_msg)
+def export_codes_job(job):
+    total = codes_collection.estimated_document_count()
+    job.report(0, total, "kodlar o'qilmoqda")
+    codes_data = []
+    for code in codes_collection.find({}, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE):
+        codes_data.append({
+            "Kod": code['code'],
+            "Post ID": code.get('post_id', ''),
+            "Post IDs": ', '.join(map(str, code.get('post_ids', []))) if code.get('post_ids') else '',
+            "Nomi": code.get('title', ''),
+            "Yil": code.get('year', ''),
+            "Janr": code.get('genre', ''),
+            "Qo'shilgan vaqti": code['added_at'].strftime('%Y-%m-%d %H:%M:%S') if isinstance(code.get('added_at'), datetime) else code.get('added_at', ''),
+            "Admin ID": code.get('added_by', '')
+        })
+        if len(codes_data) % EXPORT_BATCH_SIZE == 0:
+            job.report(len(codes_data))
+    if not codes_data:
+        return {"text": "❌ Kodlar mavjud emas!"}
+    job.report(len(codes_data))
+    return {"document": build_excel(codes_data, job), "filename": "codes.xlsx", "caption": "📋 Kodlar ro'yxati (Excel format)"}
 
-async def export_codes(update: Update, context: CallbackContext):
-    """Kodlarni Excel faylga eksport qilish"""
+def statistics_job(job):
+    job.report(0, 6, "foydalanuvchilar sanalmoqda")
+    hot_users = users_collection.count_documents({})
+    archived_users = users_archive_collection.estimated_document_count()  # Arxiv - taxminiy, skanersiz
+    total_users = hot_users + archived_users
+    seven_days_ago = datetime.now() - timedelta(days=7)
+    job.report(1)
+    active_users = users_collection.count_documents({
+        "last_activity": {"$gte": seven_days_ago}
+    })
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    job.report(2)
+    new_users_today = users_collection.count_documents({
+        "start_time": {"$gte": today}
+    })
+    job.report(3, stage="kodlar va kanallar sanalmoqda")
+    total_codes = codes_collection.count_documents({})
+    total_channels = channels_collection.count_documents({})
+    uptime = datetime.now() - BOT_START_TIME
+    uptime_days = uptime.days
+    uptime_hours = uptime.seconds // 3600
+    uptime_minutes = (uptime.seconds % 3600) // 60
+    tashkent_time = datetime.utcnow() + timedelta(hours=5)
+    
+    stats_message = (
+        "📊 <b>Bot Statistikasi</b>\n\n"
+        f"👥 <b>Jami foydalanuvchilar:</b> {total_users}\n"
+        f"   faol bazada {hot_users}, arxivda {archived_users} ({USER_ARCHIVE_AFTER_DAYS}+ kun faol emas)\n"
+        f"🟢 <b>Faol foydalanuvchilar (7 kun):</b> {active_users}\n"
+        f"🆕 <b>Bugungi yangi foydalanuvchilar:</b> {new_users_today}\n"
+        f"🔑 <b>Jami kodlar:</b> {total_codes}\n"
+        f"📢 <b>Majburiy kanallar:</b> {total_channels}\n\n"
+        f"⏰ <b>Bot ishlash vaqti:</b>\n"
+        f"   {uptime_days} kun, {uptime_hours} soat, {uptime_minutes} daqiqa\n"
+        f"🕒 <b>Toshkent vaqti:</b>\n"
+        f"   {tashkent_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        f"📈 <b>Faollik darajasi:</b> {round((active_users / total_users * 100) if total_users > 0 else 0, 1)}%\n"
+        f"🚀 <b>Bot ishga tushgan vaqti:</b>\n"
+        f"   {BOT_START_TIME.strftime('%Y-%m-%d %H:%M:%S')}"
+    )
+    
+    # 🔥 Eng ommabop kodlar (avval xotiradagi hisoblagichlarni yozib olamiz)
+    job.report(4, stage="top kodlar hisoblanmoqda")
+    code_stats.flush()
+    for title, days in (("Bugun", 1), ("Hafta", 7), ("Umumiy", None)):
+        top_codes = code_stats.top(days=days, limit=5)
+        stats_message += f"\n\n🔥 <b>Top kodlar ({title}):</b>"
+        if not top_codes:
+            stats_message += "\n   Ma'lumot yo'q"
+        for place, (code, deliveries, requests_count) in enumerate(top_codes, start=1):
+            stats_message += f"\n   {place}. {html.escape(code)} — {deliveries} marta ({requests_count} so'rov)"
+    job.report(6)
+    return {"text": stats_message}
+
+async def start_admin_job(update: Update, context: CallbackContext, kind, title, worker):
     try:
         if not is_admin(update.effective_user.id):
-            await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
-            return
-
-        codes = list(codes_collection.find())
-        if not codes:
-            await update.message.reply_text("❌ Kodlar mavjud emas!")
+            await context.bot.send_message(update.effective_chat.id, "❌ Sizda bunday huquq yo'q!")
             return
-
-        # Ma'lumotlarni tayyorlash
-        codes_data = []
-        for code in codes:
-            code_data = {
-                "Kod": code['code'],
-                "Post ID": code.get('post_id', ''),
-                "Post IDs": ', '.join(map(str, code.get('post_ids', []))) if code.get('post_ids') else '',
-                "Qo'shilgan vaqti": code['added_at'].strftime('%Y-%m-%d %H:%M:%S') if isinstance(code['added_at'], datetime) else code['added_at'],
-                "Admin ID": code.get('added_by', '')
-            }
-            codes_data.append(code_data)
-        
-        df = pd.DataFrame(codes_data)
-        excel_file = "codes.xlsx"
-        df.to_excel(excel_file, index=False)
-
-        await context.bot.send_document(
-            chat_id=update.effective_chat.id,
-            document=open(excel_file, 'rb'),
-            caption="📋 Kodlar ro'yxati (Excel format)"
-        )
-        
-        os.remove(excel_file)
+        await admin_jobs.submit(update, context, kind, title, worker)
     except Exception as e:
-        error_msg = f"Kodlarni eksport qilishda xato: {e}"
-        print(error_msg)
-        await update.message.reply_text("❌ Kodlar ro'yxatini yuborishda xato yuz berdi!")
+        error_msg = f"{title} vazifasini boshlashda xato: {e}"
+        admin_log.error(error_msg)
+        await context.bot.send_message(update.effective_chat.id, f"❌ {title}: xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
-async def show_statistics(update: Update, context: CallbackContext):
-    try:
-        if not is_admin(update.effective_user.id):
-            await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
-            return
+async def export_users(update: Update, context: CallbackContext):
+    # /users hammasi - arxivdagi foydalanuvchilar ham
+    include_archive = bool(context.args) and context.args[0].lower() in ('hammasi', 'arxiv')
+    await start_admin_job(update, context, "export_users", "Foydalanuvchilar eksporti",
+                          functools.partial(export_users_job, include_archive=include_archive))
 
-        total_users = users_collection.count_documents({})
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        active_users = users_collection.count_documents({
-            "last_activity": {"$gte": seven_days_ago}
-        })
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        new_users_today = users_collection.count_documents({
-            "start_time": {"$gte": today}
-        })
-        total_codes = codes_collection.count_documents({})
-        total_channels = channels_collection.count_documents({})
-        uptime = datetime.now() - BOT_START_TIME
-        uptime_days = uptime.days
-        uptime_hours = uptime.seconds // 3600
-        uptime_minutes = (uptime.seconds % 3600) // 60
-        tashkent_time = datetime.utcnow() + timedelta(hours=5)
-        
-        stats_message = (
-            "📊 <b>Bot Statistikasi</b>\n\n"
-            f"👥 <b>Jami foydalanuvchilar:</b> {total_users}\n"
-            f"🟢 <b>Faol foydalanuvchilar (7 kun):</b> {active_users}\n"
-            f"🆕 <b>Bugungi yangi foydalanuvchilar:</b> {new_users_today}\n"
-            f"🔑 <b>Jami kodlar:</b> {total_codes}\n"
-            f"📢 <b>Majburiy kanallar:</b> {total_channels}\n\n"
-            f"⏰ <b>Bot ishlash vaqti:</b>\n"
-            f"   {uptime_days} kun, {uptime_hours} soat, {uptime_minutes} daqiqa\n"
-            f"🕒 <b>Toshkent vaqti:</b>\n"
-            f"   {tashkent_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-            f"📈 <b>Faollik darajasi:</b> {round((active_users / total_users * 100) if total_users > 0 else 0, 1)}%\n"
-            f"🚀 <b>Bot ishga tushgan vaqti:</b>\n"
-            f"   {BOT_START_TIME.strftime('%Y-%m-%d %H:%M:%S')}"
-        )
-        
-        await update.message.reply_text(stats_message, parse_mode='HTML')
-        
-    except Exception as e:
-        error_msg = f"Statistika ko'rsatishda xato: {e}"
-        print(error_msg)
-        await update.message.reply_text("❌ Statistika ko'rsatishda xato yuz berdi!")
-        await send_error_to_admin(context, error_msg)
+async def export_codes(update: Update, context: CallbackContext):
+    """Kodlarni Excel faylga eksport qilish"""
+    await start_admin_job(update, context, "export_codes", "Kodlar eksporti", export_codes_job)
+
+async def show_statistics(update: Update, context: CallbackContext):
+    await start_admin_job(update, context, "statistics", "Statistika", statistics_job)
 
 async def add_admin(update: Update, context: CallbackContext):
     try:
@@ -528,6 +3029,7 @@ async def add_admin(update: Update, context: CallbackContext):
                 'added_by': update.effective_user.id
             }
             admins_collection.insert_one(new_admin)
+            ADMIN_CACHE.add(admin_id)
             await update.message.reply_text(f"✅ Admin qo'shildi: {admin_id} (@{user.username if user.username else 'nomalum'})")
         except Exception as e:
             new_admin = {
@@ -537,10 +3039,11 @@ async def add_admin(update: Update, context: CallbackContext):
                 'added_by': update.effective_user.id
             }
             admins_collection.insert_one(new_admin)
+            ADMIN_CACHE.add(admin_id)
             await update.message.reply_text(f"✅ Admin qo'shildi: {admin_id} (username noma'lum)")
     except Exception as e:
         error_msg = f"Admin qo'shishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Admin qo'shishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
@@ -566,15 +3069,74 @@ async def remove_admin(update: Update, context: CallbackContext):
             
         result = admins_collection.delete_one({"id": admin_id})
         if result.deleted_count > 0:
+            ADMIN_CACHE.discard(admin_id)
             await update.message.reply_text(f"✅ Admin o'chirildi: {admin_id}")
         else:
             await update.message.reply_text("❌ Bunday admin topilmadi!")
     except Exception as e:
         error_msg = f"Admin o'chirishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Admin o'chirishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
+def parse_code_meta(values):
+    """Ixtiyoriy "NOMI | YIL | JANR" qismidan {title, year, genre} (berilganlari)"""
+    if isinstance(values, (list, tuple)):
+        values = ' '.join(values)
+    parts = [part.strip() for part in (values or '').split('|')]
+    meta = {}
+    if parts and parts[0]:
+        meta['title'] = parts[0]
+    if len(parts) > 1 and parts[1]:
+        meta['year'] = parse_year(parts[1])
+    if len(parts) > 2 and parts[2]:
+        meta['genre'] = parts[2]
+    return meta
+
+def parse_year(value):
+    try:
+        year = int(float(value))
+    except (TypeError, ValueError):
+        raise ValueError("yil raqam bo'lishi kerak")
+    if not 1888 <= year <= 2100:
+        raise ValueError("yil noto'g'ri")
+    return year
+
+async def save_new_code(update: Update, code, post_ids, meta=None):
+    """Yangi kodni tekshirib saqlash (/kod va /albom uchun umumiy)"""
+    dead_post_ids = post_catalog.dead_post_ids(post_ids)
+    if dead_post_ids:
+        await update.message.reply_text(
+            f"❌ Bu postlar kanaldan o'chirilgan: {', '.join(map(str, dead_post_ids))}")
+        return
+    
+    if codes_collection.find_one({"code": {"$regex": f"^{code}$", "$options": "i"}}):
+        await update.message.reply_text("❌ Bu kod allaqachon mavjud!")
+        return
+    
+    new_code = {
+        "code": code,
+        "post_ids": post_ids,
+        "post_id": post_ids[0] if len(post_ids) == 1 else None,  # Orqaga moslik uchun
+        "added_at": datetime.now(),
+        "added_by": update.effective_user.id,
+        **(meta or {})
+    }
+    codes_collection.insert_one(new_code)
+    cache_code(new_code)
+    await publish_catalog_change()
+    
+    if len(post_ids) > 1:
+        await update.message.reply_text(f"✅ Kod qo'shildi: {code} ➡️ {len(post_ids)} ta post")
+    else:
+        await update.message.reply_text(f"✅ Kod qo'shildi: {code} ➡️ {post_ids[0]}")
+    
+    # Katalogda yo'q postlar (bot kanalga qo'shilishidan oldingi postlar bo'lishi mumkin)
+    unknown_post_ids = post_catalog.unknown_post_ids(post_ids) if len(post_catalog) else []
+    if unknown_post_ids:
+        await update.message.reply_text(
+            f"⚠️ Bu postlar kanal katalogida topilmadi, tekshirib ko'ring: {', '.join(map(str, unknown_post_ids))}")
+
 async def add_code(update: Update, context: CallbackContext):
     """Kod qo'shish - BIR NECHA POST ID LARI BILAN"""
     try:
@@ -585,14 +3147,19 @@ async def add_code(update: Update, context: CallbackContext):
         if len(context.args) < 2:
             await update.message.reply_text(
                 "❌ Noto'g'ri format!\n"
-                "Foydalanish: /kod [KOD] [POST_ID1,POST_ID2,...]\n"
-                "Masalan: /kod premium 123,124,125\n"
+                "Foydalanish: /kod [KOD] [POST_ID1,POST_ID2,...] [NOMI | YIL | JANR]\n"
+                "Masalan: /kod premium 123,124,125 Avatar | 2009 | fantastika\n"
                 "Yoki bitta post: /kod premium 123"
             )
             return
             
         code = context.args[0]
         post_ids_input = context.args[1]
+        try:
+            meta = parse_code_meta(context.args[2:])
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Noto'g'ri format! {e}")
+            return
         
         # Post ID larni ajratib olish
         if ',' in post_ids_input:
@@ -610,26 +3177,51 @@ async def add_code(update: Update, context: CallbackContext):
                 await update.message.reply_text("❌ Noto'g'ri format! POST_ID raqam bo'lishi kerak.")
                 return
         
-        if codes_collection.find_one({"code": {"$regex": f"^{code}$", "$options": "i"}}):
-            await update.message.reply_text("❌ Bu kod allaqachon mavjud!")
+        await save_new_code(update, code, post_ids, meta)
+    except Exception as e:
+        error_msg = f"Kod qo'shishda xato: {e}"
+        handler_log.error(error_msg)
+        await update.message.reply_text("❌ Kod qo'shishda xato yuz berdi!")
+        await send_error_to_admin(context, error_msg)
+
+async def add_album_code(update: Update, context: CallbackContext):
+    """Kod qo'shish - albomdagi barcha postlar bilan"""
+    try:
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
+            return
+
+        if len(context.args) < 2:
+            await update.message.reply_text(
+                "❌ Noto'g'ri format!\n"
+                "Foydalanish: /albom [KOD] [ALBOMDAGI_ISTALGAN_POST_ID] [NOMI | YIL | JANR]\n"
+                "Masalan: /albom premium 123"
+            )
+            return
+            
+        code = context.args[0]
+        try:
+            post_id = int(context.args[1])
+        except ValueError:
+            await update.message.reply_text("❌ Noto'g'ri format! POST_ID raqam bo'lishi kerak.")
+            return
+        try:
+            meta = parse_code_meta(context.args[2:])
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Noto'g'ri format! {e}")
             return
         
-        new_code = {
-            "code": code,
-            "post_ids": post_ids,
-            "post_id": post_ids[0] if len(post_ids) == 1 else None,  # Orqaga moslik uchun
-            "added_at": datetime.now(),
-            "added_by": update.effective_user.id
-        }
-        codes_collection.insert_one(new_code)
+        post_ids = post_catalog.album(post_id)
+        if not post_ids:
+            await update.message.reply_text(
+                "❌ Bu post katalogdagi albomga tegishli emas!\n"
+                "Bitta post uchun /kod buyrug'idan foydalaning.")
+            return
         
-        if len(post_ids) > 1:
-            await update.message.reply_text(f"✅ Kod qo'shildi: {code} ➡️ {len(post_ids)} ta post")
-        else:
-            await update.message.reply_text(f"✅ Kod qo'shildi: {code} ➡️ {post_ids[0]}")
+        await save_new_code(update, code, post_ids, meta)
     except Exception as e:
-        error_msg = f"Kod qo'shishda xato: {e}"
-        print(error_msg)
+        error_msg = f"Albom kodini qo'shishda xato: {e}"
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Kod qo'shishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
@@ -643,16 +3235,27 @@ async def edit_code(update: Update, context: CallbackContext):
         if len(context.args) < 2:
             await update.message.reply_text(
                 "❌ Noto'g'ri format!\n"
-                "Foydalanish: /tahrirlash [KOD] [YANGI_POST_ID1,YANGI_POST_ID2,...]\n"
-                "Masalan: /tahrirlash premium 123,124,125"
+                "Foydalanish: /tahrirlash [KOD] [YANGI_POST_ID1,YANGI_POST_ID2,...] [NOMI | YIL | JANR]\n"
+                "Masalan: /tahrirlash premium 123,124,125\n"
+                "Faqat nomini o'zgartirish: /tahrirlash premium - Avatar | 2009 | fantastika"
             )
             return
             
         code = context.args[0]
         post_ids_input = context.args[1]
+        try:
+            meta = parse_code_meta(context.args[2:])
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Noto'g'ri format! {e}")
+            return
         
-        # Post ID larni ajratib olish
-        if ',' in post_ids_input:
+        # Post ID larni ajratib olish ("-" - postlar o'zgarmaydi)
+        post_ids = None
+        if post_ids_input == '-':
+            if not meta:
+                await update.message.reply_text("❌ O'zgartirish uchun hech narsa berilmadi!")
+                return
+        elif ',' in post_ids_input:
             # Bir nechta post ID lar
             try:
                 post_ids = [int(pid.strip()) for pid in post_ids_input.split(',')]
@@ -667,17 +3270,28 @@ async def edit_code(update: Update, context: CallbackContext):
                 await update.message.reply_text("❌ Noto'g'ri format! POST_ID raqam bo'lishi kerak.")
                 return
         
-        result = codes_collection.update_one(
+        changes = {"updated_at": datetime.now(), **meta}
+        if post_ids is not None:
+            dead_post_ids = post_catalog.dead_post_ids(post_ids)
+            if dead_post_ids:
+                await update.message.reply_text(
+                    f"❌ Bu postlar kanaldan o'chirilgan: {', '.join(map(str, dead_post_ids))}")
+                return
+            changes["post_ids"] = post_ids
+            changes["post_id"] = post_ids[0] if len(post_ids) == 1 else None
+        
+        updated_code = codes_collection.find_one_and_update(
             {"code": {"$regex": f"^{code}$", "$options": "i"}},
-            {"$set": {
-                "post_ids": post_ids,
-                "post_id": post_ids[0] if len(post_ids) == 1 else None,
-                "updated_at": datetime.now()
-            }}
+            {"$set": changes},
+            return_document=ReturnDocument.AFTER
         )
         
-        if result.modified_count > 0:
-            if len(post_ids) > 1:
+        if updated_code:
+            cache_code(updated_code)
+            await publish_catalog_change()
+            if post_ids is None:
+                await update.message.reply_text(f"✅ Kod ma'lumotlari tahrirlandi: {code}")
+            elif len(post_ids) > 1:
                 await update.message.reply_text(f"✅ Kod tahrirlandi: {code} ➡️ {len(post_ids)} ta post")
             else:
                 await update.message.reply_text(f"✅ Kod tahrirlandi: {code} ➡️ {post_ids[0]}")
@@ -685,10 +3299,184 @@ async def edit_code(update: Update, context: CallbackContext):
             await update.message.reply_text("❌ Bunday kod topilmadi!")
     except Exception as e:
         error_msg = f"Kodni tahrirlashda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Kodni tahrirlashda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
+IMPORT_CHUNK_SIZE = 1000  # Bitta bulk_write dagi amallar soni
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # Bot API getFile cheklovi
+
+def iter_import_rows(file_name, data):
+    """CSV/XLSX faylni qatorma-qator o'qish (export_codes ustunlari bilan)"""
+    if file_name.lower().endswith('.csv'):
+        text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(text, dialect)
+    else:
+        from openpyxl import load_workbook
+        workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+
+    header = next(rows, None)
+    if not header:
+        return
+    columns = [str(name).strip() if name is not None else '' for name in header]
+    for line_no, values in enumerate(rows, start=2):
+        if not values or all(value in (None, '') for value in values):
+            continue
+        yield line_no, dict(zip(columns, values))
+
+def parse_import_post_ids(value):
+    """'123, 124' yoki 123 (Excel da 123.0) qiymatidan post ID lar ro'yxati"""
+    if value is None or value == '':
+        return []
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(value)
+        value = int(value)
+    if isinstance(value, int):
+        return [value]
+    return [int(float(part.strip())) for part in str(value).split(',') if part.strip()]
+
+def validate_import_row(row):
+    """Qatorni tekshirish: (kod, post_ids, meta) yoki xato sababi bilan ValueError"""
+    code = str(row.get('Kod') or '').strip()
+    if code.endswith('.0') and code[:-2].isdigit():
+        code = code[:-2]  # Excel raqamli kodni float qilib saqlaydi
+    if not code:
+        raise ValueError("kod bo'sh")
+    if any(char.isspace() for char in code):
+        raise ValueError("kodda bo'sh joy bor")
+    try:
+        post_ids = parse_import_post_ids(row.get('Post IDs')) or parse_import_post_ids(row.get('Post ID'))
+    except ValueError:
+        raise ValueError("post ID raqam emas")
+    if not post_ids:
+        raise ValueError("post ID yo'q")
+    if any(post_id <= 0 for post_id in post_ids):
+        raise ValueError("post ID musbat bo'lishi kerak")
+    # Ixtiyoriy ustunlar - faqat to'ldirilganlari yoziladi
+    meta = {}
+    for column, field in (('Nomi', 'title'), ('Janr', 'genre')):
+        value = str(row.get(column) or '').strip()
+        if value:
+            meta[field] = value
+    if row.get('Yil') not in (None, ''):
+        meta['year'] = parse_year(row.get('Yil'))
+    return code, post_ids, meta
+
+def bulk_import_codes(file_name, data, admin_id):
+    """Kodlarni bo'laklab (unordered bulk_write) upsert qilish, natija hisobotini qaytaradi"""
+    summary = {"inserted": 0, "updated": 0, "rejected": 0, "errors": []}
+    seen = set()
+    batch = []
+    batch_lines = []
+
+    def reject(line_no, reason):
+        summary["rejected"] += 1
+        if len(summary["errors"]) < 10:
+            summary["errors"].append(f"{line_no}-qator: {reason}")
+
+    def flush():
+        if not batch:
+            return
+        try:
+            result = codes_collection.bulk_write(batch, ordered=False)
+            summary["inserted"] += result.upserted_count
+            summary["updated"] += result.matched_count
+        except BulkWriteError as e:
+            details = e.details
+            summary["inserted"] += details.get('nUpserted', 0)
+            summary["updated"] += details.get('nMatched', 0)
+            for error in details.get('writeErrors', []):
+                reject(batch_lines[error['index']], error.get('errmsg', 'yozishda xato'))
+        batch.clear()
+        batch_lines.clear()
+
+    now = datetime.now()
+    for line_no, row in iter_import_rows(file_name, data):
+        try:
+            code, post_ids, meta = validate_import_row(row)
+        except ValueError as e:
+            reject(line_no, e)
+            continue
+
+        dead_post_ids = post_catalog.dead_post_ids(post_ids)
+        if dead_post_ids:
+            reject(line_no, f"o'chirilgan postlar: {', '.join(map(str, dead_post_ids))}")
+            continue
+
+        key = normalize_code(code)
+        if key in seen:
+            reject(line_no, f"{code} kodi faylda takrorlangan")
+            continue
+        seen.add(key)
+
+        # Mavjud kod boshqa registrda saqlangan bo'lishi mumkin
+        existing = code_catalog.get(key)
+        batch.append(UpdateOne(
+            {"code": existing.code if existing else code},
+            {
+                "$set": {
+                    "post_ids": post_ids,
+                    "post_id": post_ids[0] if len(post_ids) == 1 else None,
+                    "updated_at": now,
+                    **meta
+                },
+                "$setOnInsert": {"added_at": now, "added_by": admin_id}
+            },
+            upsert=True
+        ))
+        batch_lines.append(line_no)
+        if len(batch) >= IMPORT_CHUNK_SIZE:
+            flush()
+    flush()
+    return summary
+
+async def import_codes(update: Update, context: CallbackContext):
+    """Excel/CSV fayldan kodlarni ommaviy import qilish"""
+    try:
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
+            return
+
+        document = update.message.document
+        if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+            await update.message.reply_text("❌ Fayl juda katta! Maksimal hajm: 20 MB")
+            return
+
+        await update.message.reply_text("📥 Fayl qabul qilindi, kodlar import qilinmoqda...")
+        telegram_file = await context.bot.get_file(document.file_id)
+        data = bytes(await telegram_file.download_as_bytearray())
+
+        summary = await asyncio.to_thread(
+            bulk_import_codes, document.file_name, data, update.effective_user.id)
+        total_codes = await reload_code_cache()
+        await publish_catalog_change()
+
+        message = (
+            "📥 <b>Import yakunlandi</b>\n\n"
+            f"🆕 Qo'shildi: {summary['inserted']}\n"
+            f"✏️ Yangilandi: {summary['updated']}\n"
+            f"❌ Rad etildi: {summary['rejected']}\n"
+            f"🔑 Jami kodlar: {total_codes}"
+        )
+        if summary['errors']:
+            message += "\n\n⚠️ <b>Xatolar:</b>\n" + "\n".join(html.escape(str(error)) for error in summary['errors'])
+            if summary['rejected'] > len(summary['errors']):
+                message += f"\n... va yana {summary['rejected'] - len(summary['errors'])} ta"
+        await update.message.reply_text(message, parse_mode='HTML')
+    except Exception as e:
+        error_msg = f"Kodlarni import qilishda xato: {e}"
+        handler_log.error(error_msg)
+        await update.message.reply_text("❌ Kodlarni import qilishda xato yuz berdi! Fayl formatini tekshiring.")
+        await send_error_to_admin(context, error_msg)
+
 async def delete_code(update: Update, context: CallbackContext):
     try:
         if not is_admin(update.effective_user.id):
@@ -700,49 +3488,74 @@ async def delete_code(update: Update, context: CallbackContext):
             return
             
         code = context.args[0]
-        result = codes_collection.delete_one({"code": {"$regex": f"^{code}$", "$options": "i"}})
+        deleted_code = codes_collection.find_one_and_delete({"code": {"$regex": f"^{code}$", "$options": "i"}})
         
-        if result.deleted_count > 0:
+        if deleted_code:
+            uncache_code(deleted_code['code'])
+            await publish_catalog_change()
             await update.message.reply_text(f"✅ Kod o'chirildi: {code}")
         else:
             await update.message.reply_text("❌ Bunday kod topilmadi!")
     except Exception as e:
         error_msg = f"Kodni o'chirishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Kodni o'chirishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
+LIST_CODES_PAGE_LIMIT = 3500  # Telegram xabari 4096 belgigacha; HTML manbasi bo'yicha o'lchanadi (havolalar ko'rinmaydi) - zaxira bilan
+LIST_CODES_MAX_PAGES = 3  # Ko'prog'i bitta chatga flood limitga uriladi - qolgani Excel eksportida
+
 async def list_codes(update: Update, context: CallbackContext):
     try:
         if not is_admin(update.effective_user.id):
             await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
             return
 
-        codes = list(codes_collection.find())
-        if not codes:
+        catalog = code_catalog  # Xotiradagi katalog - MongoDB so'rovisiz
+        if not len(catalog):
             await update.message.reply_text("❌ Kodlar mavjud emas!")
             return
 
-        message = "📋 Kodlar ro'yxati:\n\n"
-        for code in codes:
-            if code.get('post_ids') and len(code['post_ids']) > 1:
-                message += f"🔑 {code['code']} ➡️ {len(code['post_ids'])} ta post\n"
+        header = "📋 Kodlar ro'yxati:\n🔗 Kod ustiga bosilsa - foydalanuvchilar uchun deep-link\n\n"
+        pages = [header]
+        shown = 0
+        for key in catalog.keys():
+            record = catalog.get(key)
+            post_ids = catalog.post_ids(record)
+            # Havolani kanal postiga qo'yilsa, foydalanuvchi kinoni bitta bosishda oladi
+            link = code_deep_link(context.bot.username, record.code)
+            name = html.escape(record.code)
+            title = f'<a href="{html.escape(link)}">{name}</a>' if link else name
+            if len(post_ids) > 1:
+                row = f"🔑 {title} ➡️ {len(post_ids)} ta post\n"
             else:
-                post_id = code.get('post_id') or (code['post_ids'][0] if code.get('post_ids') else 'Noma\'lum')
-                message += f"🔑 {code['code']} ➡️ {channel_link(post_id)}\n"
+                target = channel_link(post_ids[0]) if post_ids else 'Noma\'lum'
+                row = f"🔑 {title} ➡️ {html.escape(target)}\n"
+            # Havolali qatorlar uzun - ro'yxat Telegram chegarasiga sig'ishi uchun bo'laklanadi
+            if len(pages[-1]) + len(row) > LIST_CODES_PAGE_LIMIT:
+                if len(pages) == LIST_CODES_MAX_PAGES:
+                    break
+                pages.append("")
+            pages[-1] += row
+            shown += 1
+        if shown < len(catalog):
+            pages[-1] += f"\n… {len(catalog) - shown} ta kod ko'rsatilmadi — Excel eksportidan foydalaning"
         
         # Excel fayl yuborish tugmasi
         keyboard = [
             [InlineKeyboardButton("📊 Excel fayl yuklab olish", callback_data="export_codes_excel")]
         ]
         
-        await update.message.reply_text(
-            message, 
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        for number, page in enumerate(pages, 1):
+            await update.message.reply_text(
+                page,
+                reply_markup=InlineKeyboardMarkup(keyboard) if number == len(pages) else None,
+                parse_mode='HTML',
+                disable_web_page_preview=True
+            )
     except Exception as e:
         error_msg = f"Kodlar ro'yxatini ko'rsatishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Kodlar ro'yxatini ko'rsatishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
@@ -782,10 +3595,11 @@ async def add_channel(update: Update, context: CallbackContext):
             'added_by': update.effective_user.id
         }
         channels_collection.insert_one(new_channel)
+        load_channel_cache()
         await update.message.reply_text(f"✅ Kanal qo'shildi:\nID: {channel_id}\nNomi: {channel_name}\nUsername: @{username}")
     except Exception as e:
         error_msg = f"Kanal qo'shishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Kanal qo'shishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
@@ -807,12 +3621,13 @@ async def delete_channel(update: Update, context: CallbackContext):
             
         result = channels_collection.delete_one({"id": channel_id})
         if result.deleted_count > 0:
+            load_channel_cache()
             await update.message.reply_text(f"✅ Kanal o'chirildi: ID {channel_id}")
         else:
             await update.message.reply_text("❌ Bunday kanal topilmadi!")
     except Exception as e:
         error_msg = f"Kanal o'chirishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Kanal o'chirishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
@@ -822,7 +3637,7 @@ async def list_channels(update: Update, context: CallbackContext):
             await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
             return
 
-        channels = list(channels_collection.find())
+        channels = get_channels()
         if not channels:
             await update.message.reply_text("❌ Majburiy kanallar mavjud emas!")
             return
@@ -834,7 +3649,7 @@ async def list_channels(update: Update, context: CallbackContext):
         await update.message.reply_text(message)
     except Exception as e:
         error_msg = f"Kanallar ro'yxatini ko'rsatishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Kanallar ro'yxatini ko'rsatishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
@@ -844,7 +3659,7 @@ async def manage_channels(update: Update, context: CallbackContext):
             await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
             return
 
-        channels = list(channels_collection.find())
+        channels = get_channels()
         if not channels:
             message = "📢 <b>Majburiy kanallar</b>\n\nHozircha kanallar mavjud emas."
         else:
@@ -864,7 +3679,7 @@ async def manage_channels(update: Update, context: CallbackContext):
             reply_markup=InlineKeyboardMarkup(buttons))
     except Exception as e:
         error_msg = f"Kanallarni boshqarishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Kanallarni boshqarishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
@@ -891,7 +3706,7 @@ async def manage_admins(update: Update, context: CallbackContext):
             reply_markup=InlineKeyboardMarkup(buttons))
     except Exception as e:
         error_msg = f"Adminlarni boshqarishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Adminlarni boshqarishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
@@ -917,6 +3732,7 @@ async def handle_admin_actions(update: Update, context: CallbackContext):
                                 'added_by': update.effective_user.id
                             }
                             admins_collection.insert_one(new_admin)
+                            ADMIN_CACHE.add(admin_id)
                             await update.message.reply_text(f"✅ Admin qo'shildi: {admin_id} (@{user.username if user.username else 'nomalum'})")
                         except Exception as e:
                             new_admin = {
@@ -926,6 +3742,7 @@ async def handle_admin_actions(update: Update, context: CallbackContext):
                                 'added_by': update.effective_user.id
                             }
                             admins_collection.insert_one(new_admin)
+                            ADMIN_CACHE.add(admin_id)
                             await update.message.reply_text(f"✅ Admin qo'shildi: {admin_id} (username noma'lum)")
                     
                     del user_data['action']
@@ -942,6 +3759,7 @@ async def handle_admin_actions(update: Update, context: CallbackContext):
                     else:
                         result = admins_collection.delete_one({"id": admin_id})
                         if result.deleted_count > 0:
+                            ADMIN_CACHE.discard(admin_id)
                             await update.message.reply_text(f"✅ Admin o'chirildi: {admin_id}")
                         else:
                             await update.message.reply_text("❌ Bunday admin topilmadi!")
@@ -984,13 +3802,14 @@ async def handle_admin_actions(update: Update, context: CallbackContext):
                         'added_by': update.effective_user.id
                     }
                     channels_collection.insert_one(new_channel)
+                    load_channel_cache()
                     await update.message.reply_text(f"✅ Kanal qo'shildi:\nID: {channel_id}\nNomi: {channel_name}\nUsername: @{username}")
                     
                     del user_data['action']
                     await update.message.reply_text("Asosiy menyu:", reply_markup=admin_menu())
                 except Exception as e:
                     error_msg = f"Kanal qo'shishda xato: {e}"
-                    print(error_msg)
+                    handler_log.error(error_msg)
                     await update.message.reply_text("❌ Kanal qo'shishda xato yuz berdi!")
                     await send_error_to_admin(context, error_msg)
             
@@ -1000,6 +3819,7 @@ async def handle_admin_actions(update: Update, context: CallbackContext):
                     result = channels_collection.delete_one({"id": channel_id})
                     
                     if result.deleted_count > 0:
+                        load_channel_cache()
                         await update.message.reply_text(f"✅ Kanal o'chirildi: ID {channel_id}")
                     else:
                         await update.message.reply_text("❌ Bunday kanal topilmadi!")
@@ -1010,10 +3830,12 @@ async def handle_admin_actions(update: Update, context: CallbackContext):
                     await update.message.reply_text("❌ Noto'g'ri format! Iltimos, kanal ID raqamini yuboring.")
     except Exception as e:
         error_msg = f"Admin harakatlarini boshqarishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await update.message.reply_text("❌ Amalni bajarishda xato yuz berdi!")
         await send_error_to_admin(context, error_msg)
 
+@logged
+@flood_guarded
 async def button_click(update: Update, context: CallbackContext):
     try:
         query = update.callback_query
@@ -1089,16 +3911,28 @@ async def button_click(update: Update, context: CallbackContext):
             await export_codes_callback(update, context)
             return
         
-        elif data == "check_subscription":
+        elif data.startswith("job_cancel:"):
+            if is_admin(user_id) and not admin_jobs.cancel(data[len("job_cancel:"):], query.message.chat_id):
+                await query.edit_message_text("ℹ️ Vazifa allaqachon tugagan")
+            return
+        
+        elif data == "check_subscription" or data.startswith("kod:"):
+            # "Balki ...?" taklif tugmasi - kodni darhol yuborish
+            if data.startswith("kod:"):
+                context.user_data['pending_code'] = data[len("kod:"):]
             user_code = context.user_data.get('pending_code')
             
-            subscription_status = await check_subscription(user_id, context)
+            if is_admin(user_id):
+                subscription_status = True
+            else:
+                subscription_status = await check_subscription(user_id, context)
             
             if subscription_status is True:
                 # Obuna bo'lgan
                 try:
                     if user_code:
-                        success = await process_user_code(user_id, user_code, context)
+                        # Tugma qayta-qayta bosilsa ham seriya bir marta yuboriladi
+                        success = await process_user_code(user_id, user_code, context, notify_duplicate=False)
                         if success:
                             await query.edit_message_text(
                                 text=f"✅ Kino muvaffaqiyatli yuborildi!\n\n"
@@ -1121,7 +3955,7 @@ async def button_click(update: Update, context: CallbackContext):
                             reply_markup=user_menu(user_id)
                         )
                 except Exception as e:
-                    print(f"Xabar tahrirlashda xato: {e}")
+                    handler_log.warning("Xabar tahrirlashda xato: %s", e)
                     await context.bot.send_message(
                         chat_id=user_id,
                         text="✅ Barcha kanallarga obuna bo'lgansiz!\n\n"
@@ -1131,25 +3965,11 @@ async def button_click(update: Update, context: CallbackContext):
             else:
                 # Hali obuna bo'lmagan
                 channels = subscription_status
-                buttons = []
-                for channel in channels:
-                    if channel['username'] and channel['username'] != "noma'lum":
-                        username = channel['username'].replace('@', '')
-                        buttons.append([InlineKeyboardButton(
-                            f"📢 {channel['name']} kanaliga obuna bo'lish", 
-                            url=f"https://t.me/{username}")])
-                    else:
-                        buttons.append([InlineKeyboardButton(
-                            f"📢 {channel['name']} kanali",
-                            callback_data="no_username")])
-                
-                buttons.append([InlineKeyboardButton("✅ Obuna bo'ldim", callback_data="check_subscription")])
-                
                 channel_list = "\n".join([f"• {channel['name']} (@{channel['username']})" for channel in channels])
                 
                 await query.edit_message_text(
                     text=f"⚠️ Hali barcha kanallarga obuna bo'lmagansiz:\n\n{channel_list}\n\nObuna bo'lgachingiz, \"Obuna bo'ldim\" tugmasini bosing.",
-                    reply_markup=InlineKeyboardMarkup(buttons)
+                    reply_markup=subscription_keyboard(channels)
                 )
         
         elif data == "no_username":
@@ -1170,7 +3990,7 @@ async def button_click(update: Update, context: CallbackContext):
                 
     except Exception as e:
         error_msg = f"Tugma bosishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         try:
             await query.edit_message_text("❌ Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.")
         except:
@@ -1201,7 +4021,7 @@ async def manage_admins_callback(update: Update, context: CallbackContext):
             reply_markup=InlineKeyboardMarkup(buttons))
     except Exception as e:
         error_msg = f"Adminlarni boshqarishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await send_error_to_admin(context, error_msg)
 
 async def manage_channels_callback(update: Update, context: CallbackContext):
@@ -1209,7 +4029,7 @@ async def manage_channels_callback(update: Update, context: CallbackContext):
         query = update.callback_query
         await query.answer()
         
-        channels = list(channels_collection.find())
+        channels = get_channels()
         if not channels:
             message = "📢 <b>Majburiy kanallar</b>\n\nHozircha kanallar mavjud emas."
         else:
@@ -1229,7 +4049,7 @@ async def manage_channels_callback(update: Update, context: CallbackContext):
             reply_markup=InlineKeyboardMarkup(buttons))
     except Exception as e:
         error_msg = f"Kanallarni boshqarishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await send_error_to_admin(context, error_msg)
 
 async def export_codes_callback(update: Update, context: CallbackContext):
@@ -1243,203 +4063,350 @@ async def export_codes_callback(update: Update, context: CallbackContext):
         
     except Exception as e:
         error_msg = f"Kodlarni eksport qilishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await query.edit_message_text("❌ Kodlar ro'yxatini yuklashda xato yuz berdi!")
 
+# ==================== XABARLAR ROUTERI ====================
+
+def subscription_keyboard(channels):
+    """Obuna bo'linmagan kanallar tugmalari va "Obuna bo'ldim" tugmasi"""
+    buttons = []
+    for channel in channels:
+        if channel['username'] and channel['username'] != "noma'lum":
+            username = channel['username'].replace('@', '')
+            buttons.append([InlineKeyboardButton(
+                f"📢 {channel['name']} kanaliga obuna bo'lish", 
+                url=f"https://t.me/{username}")])
+        else:
+            buttons.append([InlineKeyboardButton(
+                f"📢 {channel['name']} kanali",
+                callback_data="no_username")])
+    
+    buttons.append([InlineKeyboardButton("✅ Obuna bo'ldim", callback_data="check_subscription")])
+    return InlineKeyboardMarkup(buttons)
+
+async def send_subscription_prompt(message, channels):
+    """Majburiy kanallarga obuna bo'lish taklifi"""
+    channel_list = "\n".join([f"• {channel['name']} (@{channel['username']})" for channel in channels])
+    await message.reply_text(
+        f"🎬 Kino Botga xush kelibsiz!\n\n"
+        f"⚠️ Botdan foydalanish uchun quyidagi kanal(lar)ga obuna bo'ling:\n\n{channel_list}\n\n"
+        f"Obuna bo'lgachingiz, \"Obuna bo'ldim\" tugmasini bosing.",
+        reply_markup=subscription_keyboard(channels))
+
+class MessageContext:
+    """Bitta xabarning router bosqichlari orasidagi holati"""
+
+    __slots__ = ('update', 'context', 'user', 'message', 'text', 'is_admin', 'user_mode')
+
+    def __init__(self, update: Update, context: CallbackContext):
+        self.update = update
+        self.context = context
+        self.user = update.effective_user
+        self.message = update.message
+        self.text = update.message.text or ''
+        self.is_admin = False
+        self.user_mode = False  # Admin foydalanuvchi menyusida
+
+class MessageRouter:
+    """handle_user_message uchun middleware quvuri
+
+    Har bir bosqich True qaytarsa xabar qayta ishlangan hisoblanadi va keyingi
+    bosqichlar chaqirilmaydi. Menyu tugmalari aniq nom bo'yicha lug'atdan topiladi,
+    shuning uchun tugmalar soni oshsa ham tanlash narxi o'zgarmaydi.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.timings = {}  # bosqich -> [soni, jami ms, eng ko'p ms]
+
+    def stage(self, name):
+        def register(func):
+            self.stages.append((name, func))
+            self.timings[name] = [0, 0.0, 0.0]
+            return func
+        return register
+
+    @staticmethod
+    def menu_table(actions):
+        """Tugma nomi -> handler lug'ati (emoji siz va kichik harfli variantlari bilan)"""
+        table = {}
+        for label, action in actions.items():
+            table[label] = action
+            table[label.lower()] = action
+            plain = label.split(' ', 1)[-1].lower()  # "ℹ️ Yordam" -> "yordam"
+            table.setdefault(plain, action)
+        return table
+
+    @staticmethod
+    def lookup(table, text):
+        return table.get(text) or table.get(text.strip().lower())
+
+    async def dispatch(self, update: Update, context: CallbackContext):
+        ctx = MessageContext(update, context)
+        for name, stage in self.stages:
+            started = time.perf_counter()
+            try:
+                handled = await stage(ctx)
+            finally:
+                elapsed = (time.perf_counter() - started) * 1000
+                timing = self.timings[name]
+                timing[0] += 1
+                timing[1] += elapsed
+                timing[2] = max(timing[2], elapsed)
+            if handled:
+                return name
+        return None
+
+    def timing_report(self):
+        lines = []
+        for name, (count, total, worst) in self.timings.items():
+            average = total / count if count else 0
+            lines.append(f"• {name}: {count} ta, o'rtacha {average:.1f} ms, eng ko'p {worst:.1f} ms")
+        return "\n".join(lines)
+
+message_router = MessageRouter()
+
+async def contact_admin(update: Update, context: CallbackContext):
+    await update.message.reply_text(
+        f"📞 Admin bilan bog'lanish: @{ADMIN_USERNAME}\n\n"
+        "Yoki shu yerga xabaringizni yozib qoldiring:",
+        reply_markup=ReplyKeyboardMarkup([[BACK_BUTTON]], resize_keyboard=True))
+
+async def back_to_user_menu(update: Update, context: CallbackContext):
+    await update.message.reply_text("Bosh menyu:", reply_markup=user_menu(update.effective_user.id))
+
+async def switch_to_admin_menu(update: Update, context: CallbackContext):
+    context.user_data['current_menu'] = 'admin'
+    await update.message.reply_text(
+        "🎛️ Admin menyusiga qaytdingiz",
+        reply_markup=admin_menu())
+
+async def switch_to_user_menu(update: Update, context: CallbackContext):
+    context.user_data['current_menu'] = 'user'
+    await update.message.reply_text(
+        "👤 Foydalanuvchi menyusiga o'tdingiz\n\n"
+        "🎛️ Admin menyusiga qaytish uchun 'Admin panelga qaytish' tugmasini bosing.",
+        reply_markup=user_menu(update.effective_user.id))
+
+async def add_code_help(update: Update, context: CallbackContext):
+    await update.message.reply_text(
+        "Yangi kod qo'shish:\n"
+        "/kod [KOD] [POST_ID1,POST_ID2,...] [NOMI | YIL | JANR]\n"
+        "Masalan: /kod premium 123,124,125 Avatar | 2009 | fantastika\n"
+        "Yoki bitta post: /kod premium 123\n"
+        "Albomdagi barcha postlar: /albom premium 123\n\n"
+        "🔎 Nomi, yili va janri berilsa, foydalanuvchilar kinoni nomi bo'yicha ham topa oladi.\n\n"
+        "📥 Ko'p kodlarni birdaniga qo'shish uchun Excel (.xlsx) yoki CSV fayl yuboring.\n"
+        "Ustunlar kodlar eksporti bilan bir xil: Kod, Post ID, Post IDs (ixtiyoriy: Nomi, Yil, Janr)"
+    )
+
+async def delete_code_help(update: Update, context: CallbackContext):
+    await update.message.reply_text("Kodni o'chirish:\n/ochirish [KOD]\nMasalan: /ochirish premium")
+
+async def edit_code_help(update: Update, context: CallbackContext):
+    await update.message.reply_text(
+        "Kodni tahrirlash:\n"
+        "/tahrirlash [KOD] [YANGI_POST_ID1,YANGI_POST_ID2,...] [NOMI | YIL | JANR]\n"
+        "Masalan: /tahrirlash premium 123,124,125\n"
+        "Faqat nomini o'zgartirish: /tahrirlash premium - Avatar | 2009 | fantastika"
+    )
+
+# Admin menyusini almashtirish tugmalari (faqat adminlar uchun)
+MENU_SWITCH_ACTIONS = MessageRouter.menu_table({
+    ADMIN_PANEL_BUTTON: switch_to_admin_menu,
+    USER_MODE_BUTTON: switch_to_user_menu,
+})
+
+ADMIN_MENU_ACTIONS = MessageRouter.menu_table({
+    "🎬 Kino qo'shish": add_code_help,
+    "📋 Kodlar ro'yxati": list_codes,
+    "🗑️ Kod o'chirish": delete_code_help,
+    "📢 Majburiy kanallar": manage_channels,
+    "🤖 Bot funksiyalari": lambda update, context: bot_help(update),
+    "✏️ Kodlarni tahrirlash": edit_code_help,
+    "👥 Admin tahrirlash": manage_admins,
+    "👤 Foydalanuvchilar": export_users,
+    "📊 Statistika": show_statistics,
+})
+
+USER_MENU_ACTIONS = MessageRouter.menu_table({
+    "📞 Admin bilan bog'lanish": contact_admin,
+    "📢 Bizning kanallar": show_our_channels,
+    "ℹ️ Yordam": lambda update, context: user_help(update),
+    BACK_BUTTON: back_to_user_menu,
+})
+
+@message_router.stage("kuzatuv")
+async def tracking_stage(ctx: MessageContext):
+    track_user(ctx.user)
+    if ctx.message.contact:
+        users_collection.update_one(
+            {"id": ctx.user.id},
+            {"$set": {"phone": ctx.message.contact.phone_number}}
+        )
+        return True
+    return not ctx.text
+
+@message_router.stage("huquq")
+async def auth_stage(ctx: MessageContext):
+    ctx.is_admin = is_admin(ctx.user.id)
+    if not ctx.is_admin:
+        return False
+    ctx.user_mode = ctx.context.user_data.get('current_menu') == 'user'
+    action = MessageRouter.lookup(MENU_SWITCH_ACTIONS, ctx.text)
+    if action:
+        await action(ctx.update, ctx.context)
+        return True
+    return False
+
+@message_router.stage("admin amali")
+async def pending_admin_action_stage(ctx: MessageContext):
+    if ctx.is_admin and not ctx.user_mode and 'action' in ctx.context.user_data:
+        await handle_admin_actions(ctx.update, ctx.context)
+        return True
+    return False
+
+@message_router.stage("admin menyusi")
+async def admin_menu_stage(ctx: MessageContext):
+    if not ctx.is_admin or ctx.user_mode:
+        return False
+    action = MessageRouter.lookup(ADMIN_MENU_ACTIONS, ctx.text)
+    if action:
+        await action(ctx.update, ctx.context)
+    return True  # Admin menyusida boshqa matnlar e'tiborsiz qoldiriladi
+
+@message_router.stage("obuna")
+async def subscription_stage(ctx: MessageContext):
+    if ctx.is_admin:
+        return False
+    # Oddiy foydalanuvchilar uchun majburiy kanal tekshiruvi
+    subscription_status = await check_subscription(ctx.user.id, ctx.context)
+    if subscription_status is True:
+        return False
+    # Foydalanuvchi kod yuborgan bo'lsa, uni saqlash
+    if MessageRouter.lookup(USER_MENU_ACTIONS, ctx.text) is None:
+        ctx.context.user_data['pending_code'] = ctx.text
+    await send_subscription_prompt(ctx.message, subscription_status)
+    return True
+
+@message_router.stage("foydalanuvchi menyusi")
+async def user_menu_stage(ctx: MessageContext):
+    action = MessageRouter.lookup(USER_MENU_ACTIONS, ctx.text)
+    if action:
+        await action(ctx.update, ctx.context)
+        return True
+    return False
+
+@message_router.stage("kod")
+async def code_lookup_stage(ctx: MessageContext):
+    code_found = await process_user_code(ctx.user.id, ctx.text, ctx.context)
+    if code_found:
+        return True
+    title_matches = title_matches_markup(ctx.text)
+    if title_matches:
+        await ctx.message.reply_text(
+            "🔎 Nomi bo'yicha topilgan kinolar:",
+            reply_markup=title_matches)
+        return True
+    suggestions = code_suggestions_markup(ctx.text)
+    if suggestions:
+        await ctx.message.reply_text(
+            "❌ Bunday kod topilmadi!\n"
+            "🤔 Balki siz quyidagi kodlardan birini nazarda tutgandirsiz:",
+            reply_markup=suggestions)
+    elif ctx.is_admin:
+        await ctx.message.reply_text(
+            "❌ Bunday kod topilmadi!\n"
+            "🔍 Kodni bilmasangiz, pastdagi menyudan kerakli bo'limni tanlang.\n\n"
+            "🎛️ Admin menyusiga qaytish uchun 'Admin panelga qaytish' tugmasini bosing.",
+            reply_markup=user_menu(ctx.user.id))
+    else:
+        await ctx.message.reply_text(
+            "❌ Bunday kod topilmadi!\n"
+            "🔍 Kodni bilmasangiz, pastdagi menyudan kerakli bo'limni tanlang.",
+            reply_markup=user_menu(ctx.user.id))
+    return True
+
+@logged
+@flood_guarded
 async def handle_user_message(update: Update, context: CallbackContext):
     try:
-        user = update.effective_user
-        message = update.message
-        
-        track_user(user)
-        
-        if message.contact:
-            users_collection.update_one(
-                {"id": user.id},
-                {"$set": {"phone": message.contact.phone_number}}
-            )
-        
-        text = message.text.lower()
-        
-        # ✅ Admin panelga qaytish tugmasi (faqat adminlar uchun)
-        if "admin panelga qaytish" in text and is_admin(user.id):
-            context.user_data['current_menu'] = 'admin'
-            await update.message.reply_text(
-                "🎛️ Admin menyusiga qaytdingiz",
-                reply_markup=admin_menu())
-            return
-        
-        if "foydalanuvchi menyusi" in text and is_admin(user.id):
-            context.user_data['current_menu'] = 'user'
-            await update.message.reply_text(
-                "👤 Foydalanuvchi menyusiga o'tdingiz\n\n"
-                "🎛️ Admin menyusiga qaytish uchun 'Admin panelga qaytish' tugmasini bosing.",
-                reply_markup=user_menu(user.id))
-            return
-        elif text == "/admin" and is_admin(user.id):
-            context.user_data['current_menu'] = 'admin'
-            await update.message.reply_text(
-                "🎛️ Admin menyusiga qaytdingiz",
-                reply_markup=admin_menu())
-            return
-        
-        if is_admin(user.id) and context.user_data.get('current_menu') == 'user':
-            if "admin bilan bog'lanish" in text:
-                await update.message.reply_text(
-                    f"📞 Admin bilan bog'lanish: @{ADMIN_USERNAME}\n\n"
-                    "Yoki shu yerga xabaringizni yozib qoldiring:",
-                    reply_markup=ReplyKeyboardMarkup([["Orqaga"]], resize_keyboard=True))
-            elif "bizning kanallar" in text:
-                await show_our_channels(update, context)
-            elif "yordam" in text:
-                await user_help(update)
-            elif "orqaga" in text:
-                await update.message.reply_text("Bosh menyu:", reply_markup=user_menu(user.id))
-            else:
-                codes = list(codes_collection.find())
-                code_found = False
-                for code in codes:
-                    if code['code'].lower() == message.text.lower():
-                        try:
-                            # Bir nechta post ID lar bilan ishlash
-                            if code.get('post_ids') and len(code['post_ids']) > 1:
-                                for post_id in code['post_ids']:
-                                    try:
-                                        # 🔒 FORWARD QILISH O'CHIRILGAN
-                                        await context.bot.copy_message(
-                                            chat_id=user.id,
-                                            from_chat_id=CHANNEL_ID,
-                                            message_id=post_id,
-                                            disable_notification=True,
-                                            protect_content=True
-                                        )
-                                        await asyncio.sleep(1)  # Spamdan saqlash uchun
-                                    except Exception as e:
-                                        print(f"Post {post_id} yuborishda xato: {e}")
-                            else:
-                                # Oddiy bitta post
-                                post_id = code.get('post_id') or (code['post_ids'][0] if code.get('post_ids') else None)
-                                if post_id:
-                                    # 🔒 FORWARD QILISH O'CHIRILGAN
-                                    await context.bot.copy_message(
-                                        chat_id=user.id,
-                                        from_chat_id=CHANNEL_ID,
-                                        message_id=post_id,
-                                        disable_notification=True,
-                                        protect_content=True
-                                    )
-                            code_found = True
-                            break
-                        except Exception as e:
-                            await message.reply_text("❌ Xatolik yuz berdi. Iltimos, keyinroq urinib ko'ring.")
-                            return
-                
-                if not code_found:
-                    await message.reply_text(
-                        "❌ Bunday kod topilmadi!\n"
-                        "🔍 Kodni bilmasangiz, pastdagi menyudan kerakli bo'limni tanlang.\n\n"
-                        "🎛️ Admin menyusiga qaytish uchun 'Admin panelga qaytish' tugmasini bosing.",
-                        reply_markup=user_menu(user.id))
+        await message_router.dispatch(update, context)
+    except Exception as e:
+        error_msg = f"Foydalanuvchi xabarini qayta ishlashda xato: {e}"
+        handler_log.error(error_msg)
+        await send_error_to_admin(context, error_msg)
+
+async def show_router_timings(update: Update, context: CallbackContext):
+    """Router bosqichlari vaqtini ko'rsatish"""
+    try:
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
             return
-        
-        if is_admin(user.id):
-            if 'action' in context.user_data:
-                await handle_admin_actions(update, context)
-                return
-            
-            if "kino qo'shish" in text:
-                await update.message.reply_text(
-                    "Yangi kod qo'shish:\n"
-                    "/kod [KOD] [POST_ID1,POST_ID2,...]\n"
-                    "Masalan: /kod premium 123,124,125\n"
-                    "Yoki bitta post: /kod premium 123"
-                )
-            elif "kodlar ro'yxati" in text:
-                await list_codes(update, context)
-            elif "kod o'chirish" in text:
-                await update.message.reply_text("Kodni o'chirish:\n/ochirish [KOD]\nMasalan: /ochirish premium")
-            elif "majburiy kanallar" in text:
-                await manage_channels(update, context)
-            elif "bot funksiyalari" in text:
-                await bot_help(update)
-            elif "kodlarni tahrirlash" in text:
-                await update.message.reply_text(
-                    "Kodni tahrirlash:\n"
-                    "/tahrirlash [KOD] [YANGI_POST_ID1,YANGI_POST_ID2,...]\n"
-                    "Masalan: /tahrirlash premium 123,124,125"
-                )
-            elif "admin tahrirlash" in text:
-                await manage_admins(update, context)
-            elif "foydalanuvchilar" in text:
-                await export_users(update, context)
-            elif "statistika" in text:
-                await show_statistics(update, context)
-            return
-        
-        # Oddiy foydalanuvchilar uchun majburiy kanal tekshiruvi
-        subscription_status = await check_subscription(user.id, context)
-        if subscription_status is not True:
-            # Foydalanuvchi kod yuborgan bo'lsa, uni saqlash
-            if message.text and not any(cmd in text for cmd in ['/start', '/admin', '/help', '/yordam']):
-                context.user_data['pending_code'] = message.text
-            
-            channels = subscription_status
-            buttons = []
-            for channel in channels:
-                if channel['username'] and channel['username'] != "noma'lum":
-                    username = channel['username'].replace('@', '')
-                    buttons.append([InlineKeyboardButton(
-                        f"📢 {channel['name']} kanaliga obuna bo'lish", 
-                        url=f"https://t.me/{username}")])
-                else:
-                    buttons.append([InlineKeyboardButton(
-                        f"📢 {channel['name']} kanali",
-                        callback_data="no_username")])
-            
-            buttons.append([InlineKeyboardButton("✅ Obuna bo'ldim", callback_data="check_subscription")])
-            
-            channel_list = "\n".join([f"• {channel['name']} (@{channel['username']})" for channel in channels])
-            
-            await message.reply_text(
-                f"🎬 Kino Botga xush kelibsiz!\n\n"
-                f"⚠️ Botdan foydalanish uchun quyidagi kanal(lar)ga obuna bo'ling:\n\n{channel_list}\n\n"
-                f"Obuna bo'lgachingiz, \"Obuna bo'ldim\" tugmasini bosing.",
-                reply_markup=InlineKeyboardMarkup(buttons))
+
+        await update.message.reply_text(
+            "⏱️ Xabarlar routeri bosqichlari:\n\n" + message_router.timing_report() + "\n\n"
+            f"🚦 Yuklama:\n"
+            f"• Event loop kechikishi: {load_monitor.loop_lag_ms:.1f} ms (eng ko'p {load_monitor.max_lag_ms:.1f} ms)\n"
+            f"• Navbat: {load_monitor.queue_depth()}\n"
+            f"• Tez yozgani uchun tashlangan: {bot_host.flood_dropped()}\n"
+            f"• Bandlik sababli tashlangan: {load_monitor.shed}\n"
+            f"• Takroriy so'rovlar birlashtirildi: {delivery_dedup.suppressed}\n\n"
+            + (f"🤖 Botlar ({len(bot_host.applications)}):\n" + "\n".join(
+                f"• {bot['bot']}: navbat {bot['queue']}, tez yozgani uchun tashlangan {bot['flood_dropped']}"
+                for bot in bot_host.summary()) + "\n\n" if MULTI_BOT else "")
+            + f"🔁 Yuborish xatolari (navbatda {len(retry_queue)}):\n" + send_metrics.report() + "\n\n"
+            f"📝 Loglar: navbatda {log_handler.queue.qsize()}, navbat to'lgani uchun tashlangan {log_handler.dropped}\n"
+            f"• Sampling bilan o'tkazib yuborilgan: "
+            + (', '.join(f"{event}={count}" for event, count in log_sampler.sampled_out.most_common()) or "yo'q"))
+    except Exception as e:
+        error_msg = f"Router vaqtlarini ko'rsatishda xato: {e}"
+        handler_log.error(error_msg)
+        await send_error_to_admin(context, error_msg)
+
+async def show_mongo_report(update: Update, context: CallbackContext):
+    """MongoDB buyruqlari vaqti, sekin va indekssiz so'rovlar"""
+    try:
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Sizda bunday huquq yo'q!")
             return
-        
-        # Agar barcha kanallarga obuna bo'lgan bo'lsa
-        if "admin bilan bog'lanish" in text:
-            await update.message.reply_text(
-                f"📞 Admin bilan bog'lanish: @{ADMIN_USERNAME}\n\n"
-                "Yoki shu yerga xabaringizni yozib qoldiring:",
-                reply_markup=ReplyKeyboardMarkup([["Orqaga"]], resize_keyboard=True))
-        elif "bizning kanallar" in text:
-            await show_our_channels(update, context)
-        elif "yordam" in text:
-            await user_help(update)
-        elif "orqaga" in text:
-            await update.message.reply_text("Bosh menyu:", reply_markup=user_menu(user.id))
-        else:
-            # Kodni qayta ishlash
-            code_found = await process_user_code(user.id, message.text, context)
-            if not code_found:
-                await message.reply_text(
-                    "❌ Bunday kod topilmadi!\n"
-                    "🔍 Kodni bilmasangiz, pastdagi menyudan kerakli bo'limni tanlang.",
-                    reply_markup=user_menu(user.id))
+
+        await update.message.reply_text(mongo_monitor.report()[:4000])
     except Exception as e:
-        error_msg = f"Foydalanuvchi xabarini qayta ishlashda xato: {e}"
-        print(error_msg)
+        error_msg = f"MongoDB hisobotini ko'rsatishda xato: {e}"
+        handler_log.error(error_msg)
         await send_error_to_admin(context, error_msg)
 
+async def deliver_start_code(update: Update, context: CallbackContext, code_text):
+    """Deep-link orqali kelgan kodni xush kelibsiz xabarisiz darhol yuborish"""
+    user_id = update.effective_user.id
+    if code_text and await process_user_code(user_id, code_text, context):
+        await update.message.reply_text(
+            f"✅ Kino muvaffaqiyatli yuborildi!\n\n"
+            f"🔑 Kod: {code_text}\n\n"
+            f"🎬 Yangi kino olish uchun boshqa kod yuboring.",
+            reply_markup=admin_menu() if context.user_data['current_menu'] == 'admin' else user_menu(user_id))
+        return
+    await update.message.reply_text(
+        "❌ Havoladagi kod topilmadi!\n"
+        "🔍 Kodni bilmasangiz, pastdagi menyudan kerakli bo'limni tanlang.",
+        reply_markup=(code_text and code_suggestions_markup(code_text)) or user_menu(user_id))
+
+@logged
+@flood_guarded
 async def start(update: Update, context: CallbackContext):
     try:
         user = update.effective_user
         track_user(user)
         
         context.user_data['current_menu'] = 'admin' if is_admin(user.id) else 'user'
+        # t.me/<bot>?start=<kod> - kod bitta yangilanishda yuboriladi
+        start_code = code_from_start_payload(context.args[0]) if context.args else None
         
-        if is_admin(user.id):
+        if is_admin(user.id) and context.args:
+            await deliver_start_code(update, context, start_code)
+        elif is_admin(user.id):
             await update.message.reply_text(
                 "🎛️ Admin paneliga xush kelibsiz!\n\n"
                 "👤 Foydalanuvchi menyusiga o'tish uchun 'Foydalanuvchi menyusi' tugmasini bosing.",
@@ -1447,28 +4414,14 @@ async def start(update: Update, context: CallbackContext):
         else:
             subscription_status = await check_subscription(user.id, context)
             if subscription_status is not True:
-                channels = subscription_status
-                buttons = []
-                for channel in channels:
-                    if channel['username'] and channel['username'] != "noma'lum":
-                        username = channel['username'].replace('@', '')
-                        buttons.append([InlineKeyboardButton(
-                            f"📢 {channel['name']} kanaliga obuna bo'lish", 
-                            url=f"https://t.me/{username}")])
-                    else:
-                        buttons.append([InlineKeyboardButton(
-                            f"📢 {channel['name']} kanali",
-                            callback_data="no_username")])
-                
-                buttons.append([InlineKeyboardButton("✅ Obuna bo'ldim", callback_data="check_subscription")])
-                
-                channel_list = "\n".join([f"• {channel['name']} (@{channel['username']})" for channel in channels])
-                
-                await update.message.reply_text(
-                    f"🎬 Kino Botga xush kelibsiz!\n\n"
-                    f"⚠️ Botdan foydalanish uchun quyidagi kanal(lar)ga obuna bo'ling:\n\n{channel_list}\n\n"
-                    f"Obuna bo'lgachingiz, \"Obuna bo'ldim\" tugmasini bosing.",
-                    reply_markup=InlineKeyboardMarkup(buttons))
+                if start_code:
+                    # Obunadan keyin "Tekshirish" tugmasi kodni yuboradi
+                    context.user_data['pending_code'] = start_code
+                await send_subscription_prompt(update.message, subscription_status)
+                return
+            
+            if context.args:
+                await deliver_start_code(update, context, start_code)
                 return
             
             await update.message.reply_text(
@@ -1478,7 +4431,7 @@ async def start(update: Update, context: CallbackContext):
                 reply_markup=user_menu(user.id))
     except Exception as e:
         error_msg = f"Start komandasida xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await send_error_to_admin(context, error_msg)
 
 async def bot_help(update: Update):
@@ -1486,11 +4439,15 @@ async def bot_help(update: Update):
         help_text = (
             "🤖 <b>Bot funksiyalari:</b>\n\n"
             "🎬 <b>Kino qo'shish:</b>\n"
-            "<code>/kod [KOD] [POST_ID1,POST_ID2,...]</code>\n"
-            "Masalan: <code>/kod premium 123,124,125</code>\n\n"
+            "<code>/kod [KOD] [POST_ID1,POST_ID2,...] [NOMI | YIL | JANR]</code>\n"
+            "Masalan: <code>/kod premium 123,124,125 Avatar | 2009 | fantastika</code>\n\n"
+            "🖼️ <b>Albom bo'yicha kino qo'shish:</b>\n"
+            "<code>/albom [KOD] [ALBOMDAGI_POST_ID]</code>\n"
+            "Masalan: <code>/albom premium 123</code>\n\n"
             "✏️ <b>Kodni tahrirlash:</b>\n"
-            "<code>/tahrirlash [KOD] [YANGI_POST_ID1,YANGI_POST_ID2,...]</code>\n"
-            "Masalan: <code>/tahrirlash premium 123,124,125</code>\n\n"
+            "<code>/tahrirlash [KOD] [YANGI_POST_ID1,YANGI_POST_ID2,...] [NOMI | YIL | JANR]</code>\n"
+            "Masalan: <code>/tahrirlash premium 123,124,125</code>\n"
+            "Faqat nomi: <code>/tahrirlash premium - Avatar | 2009 | fantastika</code>\n\n"
             "🗑️ <b>Kodni o'chirish:</b>\n"
             "<code>/ochirish [KOD]</code>\n"
             "Masalan: <code>/ochirish premium</code>\n\n"
@@ -1498,6 +4455,8 @@ async def bot_help(update: Update):
             "<code>/royxat</code>\n\n"
             "📊 <b>Kodlarni Excel ga eksport:</b>\n"
             "Kodlar ro'yxatidan Excel fayl yuklab olish\n\n"
+            "📥 <b>Kodlarni Excel/CSV dan import:</b>\n"
+            "Eksport bilan bir xil ustunli (Kod, Post ID, Post IDs) .xlsx yoki .csv faylni yuboring\n\n"
             "👥 <b>Admin qo'shish:</b>\n"
             "<code>/addAdmin [USER_ID]</code>\n"
             "Masalan: <code>/addAdmin 123456789</code>\n\n"
@@ -1513,14 +4472,19 @@ async def bot_help(update: Update):
             "📋 <b>Kanallar ro'yxati:</b>\n"
             "<code>/kanallar</code>\n\n"
             "👤 <b>Foydalanuvchilar ro'yxati:</b>\n"
-            "<code>/users</code>\n\n"
+            "<code>/users</code> - faol foydalanuvchilar\n"
+            "<code>/users hammasi</code> - arxivdagilar bilan birga\n\n"
             "📊 <b>Statistika:</b>\n"
-            "Admin menyusidan 'Statistika' tugmasini bosing"
+            "Admin menyusidan 'Statistika' tugmasini bosing\n\n"
+            "⏱️ <b>Xabarlar routeri bosqichlari vaqti:</b>\n"
+            "<code>/tezlik</code>\n\n"
+            "🗄️ <b>MongoDB so'rovlari (sekin va indekssiz):</b>\n"
+            "<code>/mongo</code>"
         )
         await update.message.reply_text(help_text, parse_mode='HTML')
     except Exception as e:
         error_msg = f"Yordam ko'rsatishda xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await send_error_to_admin(update._context, error_msg)
 
 async def user_help(update: Update):
@@ -1534,87 +4498,410 @@ async def user_help(update: Update):
         await update.message.reply_text(help_text, parse_mode='HTML')
     except Exception as e:
         error_msg = f"Foydalanuvchi yordamida xato: {e}"
-        print(error_msg)
+        handler_log.error(error_msg)
         await send_error_to_admin(update._context, error_msg)
 
+# ==================== ISHGA TUSHISH TARTIBI ====================
+
+STARTUP_PHASE_TIMEOUT = int(os.getenv('STARTUP_PHASE_TIMEOUT', 20))  # soniya
+
+class StartupOrchestrator:
+    """Ishga tushish bosqichlarini parallel bajarish
+
+    MongoDB ulanishi va keshlarni isitish fon oqimlarida PTB ning initialize
+    (get_me) bilan bir vaqtda boshlanadi. Bot faqat muhim bosqichlarni kutadi,
+    qolganlari (indekslar, postlar katalogi) xizmat boshlangach fonda tugaydi.
+    """
+
+    def __init__(self, timer):
+        self.timer = timer
+        self._executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix='startup')
+        self._phases = []  # (nomi, future, muhimmi, tugash muddati)
+
+    def add(self, name, func, critical=True, after=None, timeout=STARTUP_PHASE_TIMEOUT):
+        """Bosqichni fonda boshlash; after - avval tugashi kerak bo'lgan bosqich"""
+        deadline = time.monotonic() + timeout
+        if after:
+            deadline += next(phase[3] for phase in self._phases if phase[1] is after) - time.monotonic()
+
+        def run_phase():
+            if after:
+                after.result()
+            started = time.perf_counter()
+            result = func()
+            self.timer.record(name, (time.perf_counter() - started) * 1000)
+            return result
+
+        future = self._executor.submit(run_phase)
+        self._phases.append((name, future, critical, deadline))
+        return future
+
+    def critical_ready(self):
+        """Muhim bosqichlar (MongoDB va keshlar) xatosiz tugadimi"""
+        critical = [future for _, future, is_critical, _ in self._phases if is_critical]
+        return bool(critical) and all(future.done() and not future.exception() for future in critical)
+
+    async def wait_critical(self):
+        """Muhim bosqichlarni kutish - har birining o'z muddati bor"""
+        for name, future, critical, deadline in self._phases:
+            if not critical:
+                future.add_done_callback(lambda done, name=name: self._report_background(name, done))
+                continue
+            try:
+                result = await asyncio.wait_for(
+                    asyncio.wrap_future(future), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"Ishga tushish bosqichi vaqtida tugamadi: {name}")
+            startup_log.info(f"   ✅ {name}: {result if result is not None else 'tayyor'}")
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _report_background(name, future):
+        if future.exception():
+            startup_log.warning(f"⚠️ Fon bosqichida xato ({name}): {future.exception()}")
+        else:
+            startup_log.info(f"   ✅ {name} (fonda): {future.result() if future.result() is not None else 'tayyor'}")
+
+startup_orchestrator = StartupOrchestrator(startup_timer)
+
+def begin_startup():
+    """MongoDB va keshlarni fonda tayyorlashni boshlash"""
+    connected = startup_orchestrator.add("mongodb", connect_db)
+    startup_orchestrator.add("adminlar", lambda: (ensure_main_admin(), load_admin_cache())[1], after=connected)
+    startup_orchestrator.add("kodlar", load_code_cache, after=connected)
+    startup_orchestrator.add("kanallar", load_channel_cache, after=connected)
+    startup_orchestrator.add("postlar katalogi", lambda: post_catalog.load(), critical=False, after=connected)
+    startup_orchestrator.add("indekslar", ensure_indexes, critical=False, after=connected)
+
+async def post_init(application: Application):
+    """PTB initialize (get_me) dan keyin - muhim keshlar tayyor bo'lishini kutish"""
+    startup_timer.mark("telegram (get_me)")
+    await startup_orchestrator.wait_critical()
+    startup_timer.mark("muhim keshlar")
+    load_monitor.start()
+    retry_queue.start()
+
+# ==================== TO'XTASH TARTIBI ====================
+
+SHUTDOWN_DRAIN_SEC = float(os.getenv('SHUTDOWN_DRAIN_SEC', 20))  # Render SIGKILL dan oldin ~30 s beradi
+
+class ShutdownCoordinator:
+    """SIGTERM/SIGINT da botni tartib bilan to'xtatish
+
+    1. PTB updater to'xtaydi - yangi yangilanishlar qabul qilinmaydi.
+    2. Davom etayotgan yuborishlar SHUTDOWN_DRAIN_SEC ichida tugatiladi; muddat
+       o'tsa qolgan postlar pending_deliveries kolleksiyasiga yoziladi.
+    3. post_stop: statistika buferi yoziladi (foydalanuvchi holatini PTB o'zi yozadi).
+    4. post_shutdown: HTTP serverlar, lider lease va MongoDB ulanishi yopiladi.
+    Keyingi ishga tushishda saqlangan yuborishlar davom ettiriladi.
+    """
+
+    def __init__(self, drain_seconds=SHUTDOWN_DRAIN_SEC):
+        self.drain_seconds = drain_seconds
+        self.deadline = None
+        self.checkpointed = 0
+
+    @property
+    def requested(self):
+        return self.deadline is not None
+
+    def install(self, loop):
+        """Signal ishlovchilarini o'rnatish - run_polling/run_webhook dan oldin chaqiriladi
+
+        PTB ning o'z stop_signals lari o'chirilgan (stop_signals=None), shuning uchun
+        initialize yoki keshlarni kutish paytidagi SIGTERM ham shu yerga tushadi va
+        jarayon to'xtash tartibisiz o'lmaydi. Signal loop ishga tushganda qayta ishlanadi.
+        """
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            try:
+                loop.add_signal_handler(sig, self.request)
+            except NotImplementedError:
+                pass  # Windows
+
+    def request(self):
+        if self.requested:
+            # Ikkinchi signal - kutmasdan qolganlarini saqlash
+            self.deadline = time.monotonic()
+            return
+        self.deadline = time.monotonic() + self.drain_seconds
+        admin_jobs.cancel_all()  # Eksportlar to'xtashni kechiktirmasin
+        log.warning(f"🛑 To'xtash so'raldi - yuborishlar {self.drain_seconds:.0f} soniya ichida yakunlanadi")
+        raise SystemExit  # PTB run_polling/run_webhook shu bilan to'xtash tartibini boshlaydi
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def checkpoint(self, bot_id, user_id, code_key, post_ids, counted):
+        deliveries_collection.insert_one({
+            "bot_id": bot_id,  # Davom ettirish aynan shu bot orqali
+            "user_id": user_id,
+            "code": code_key,
+            "post_ids": list(post_ids),
+            "counted": counted,
+            "instance": INSTANCE_ID,
+            "created_at": datetime.now()
+        })
+        self.checkpointed += 1
+
+shutdown_coordinator = ShutdownCoordinator()
+
+async def resume_pending_deliveries(context: CallbackContext):
+    """Oldingi to'xtashda tugamay qolgan yuborishlarni davom ettirish"""
+    resumed = 0
+    # bot_id siz eski yozuvlar asosiy botga tegishli
+    bot_ids = [context.bot.id, None] if context.application is bot_host.primary else [context.bot.id]
+    while not shutdown_coordinator.requested:
+        # find_one_and_delete - bir nechta nusxa bir yuborishni ikki marta olmaydi
+        pending = await asyncio.to_thread(deliveries_collection.find_one_and_delete, {"bot_id": {"$in": bot_ids}})
+        if not pending:
+            break
+        try:
+            await context.bot.send_message(
+                chat_id=pending['user_id'],
+                text=f"▶️ '{pending['code']}' kodi bo'yicha qolgan qismlar yuborilmoqda:")
+            await deliver_posts(
+                context.bot, pending['user_id'], pending['code'], pending['post_ids'], counted=pending.get('counted', False))
+            resumed += 1
+        except Exception as e:
+            delivery_log.error("Tugallanmagan yuborishni davom ettirishda xato: %s", e)
+    if resumed:
+        delivery_log.info("▶️ %s ta tugallanmagan yuborish davom ettirildi", resumed)
+
+async def post_stop(application: Application):
+    """Yangilanishlar to'xtagach - buferlarni yozish"""
+    await retry_queue.stop()
+    await flush_code_stats()
+    await error_aggregator.close(application.bot)
+    if shutdown_coordinator.checkpointed:
+        delivery_log.info("💾 %s ta tugallanmagan yuborish saqlandi", shutdown_coordinator.checkpointed)
+
+async def post_shutdown(application: Application):
+    """Serverlar, lider lease va MongoDB ulanishini yopish"""
+    load_monitor.stop()
+    try:
+        await asyncio.to_thread(close_http_servers)
+    except Exception as e:
+        log.error(f"HTTP serverlarni yopishda xato: {e}")
+    try:
+        await asyncio.to_thread(leader_lease.release)
+    except Exception as e:
+        cluster_log.error(f"Lider lease ni bo'shatishda xato: {e}")
+    if client is not None:
+        client.close()
+    log.info("👋 Bot to'xtadi")
+
 # Botni doimiy faol saqlash funksiyasi
 def keep_alive():
     """Botni doimiy faol saqlash uchun"""
     def ping_server():
+        import requests  # Fon oqimida yuklanadi - ishga tushishni sekinlashtirmaydi
         while True:
+            if not leader_lease.is_leader:
+                time.sleep(300)  # Ping faqat lider nusxadan yuboriladi
+                continue
             try:
                 # Flask serverga ping yuborish
-                response = requests.get("http://localhost:10000/ping", timeout=10)
-                print(f"🔄 Flask ping: {response.status_code}")
+                response = requests.get(f"http://localhost:{FLASK_PORT}/ping", timeout=10)
+                log_event(http_log, logging.INFO, "ping", "🔄 Flask ping: %s", response.status_code)
                 
                 # aiohttp serverga ping yuborish
-                response2 = requests.get("http://localhost:8080/ping", timeout=10)
-                print(f"🔄 aiohttp ping: {response2.status_code}")
+                response2 = requests.get(f"http://localhost:{AIOHTTP_PORT}/ping", timeout=10)
+                log_event(http_log, logging.INFO, "ping", "🔄 aiohttp ping: %s", response2.status_code)
                 
             except Exception as e:
-                print(f"❌ Ping xatosi: {e}")
+                log_event(http_log, logging.WARNING, "ping", "❌ Ping xatosi: %s", e)
             
             time.sleep(300)  # 5 daqiqa
     
     ping_thread = threading.Thread(target=ping_server, daemon=True)
     ping_thread.start()
-    print("✅ Bot faollik funksiyasi ishga tushdi")
+    http_log.info("✅ Bot faollik funksiyasi ishga tushdi")
+
+def add_handlers(application: Application):
+    """Handlerlar - har bir bot uchun bir xil
+
+    logged - handler nomi log kontekstiga yoziladi (xatolar hisobotida ham shu nom).
+    """
+    # Buyruqlar
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("kod", logged(add_code)))
+    application.add_handler(CommandHandler("albom", logged(add_album_code)))
+    application.add_handler(CommandHandler("tahrirlash", logged(edit_code)))
+    application.add_handler(CommandHandler("ochirish", logged(delete_code)))
+    application.add_handler(CommandHandler("royxat", logged(list_codes)))
+    application.add_handler(CommandHandler("kanalqoshish", logged(add_channel)))
+    application.add_handler(CommandHandler("kanalochirish", logged(delete_channel)))
+    application.add_handler(CommandHandler("kanallar", logged(list_channels)))
+    application.add_handler(CommandHandler("addAdmin", logged(add_admin)))
+    application.add_handler(CommandHandler("removeAdmin", logged(remove_admin)))
+    application.add_handler(CommandHandler("users", logged(export_users)))
+    application.add_handler(CommandHandler("yordam", user_help))
+    application.add_handler(CommandHandler("help", bot_help))
+    application.add_handler(CommandHandler("admin", start))
+    application.add_handler(CommandHandler("tezlik", logged(show_router_timings)))
+    application.add_handler(CommandHandler("mongo", logged(show_mongo_report)))
+    
+    # Majburiy kanallardagi a'zolik o'zgarishlari
+    application.add_handler(ChatMemberHandler(logged(track_channel_member), ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(ChatMemberHandler(logged(track_bot_member), ChatMemberHandler.MY_CHAT_MEMBER))
+    
+    # Inline rejimda kod qidirish (@BotFather da /setinline yoqilgan bo'lishi kerak).
+    # block=False - har bir harf uchun keladigan so'rovlar xabarlar navbatini ushlab turmaydi
+    application.add_handler(InlineQueryHandler(inline_code_search, block=False))
+    
+    # Kanal postlari katalogi
+    application.add_handler(MessageHandler(
+        filters.Chat(CHANNEL_ID) & filters.UpdateType.CHANNEL_POSTS, logged(index_channel_post)))
+    
+    # Xabarlar
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user_message))
+    application.add_handler(MessageHandler(filters.CONTACT, handle_user_message))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("xlsx") | filters.Document.FileExtension("csv"),
+        logged(import_codes)))
+    
+    # Tugmalar
+    application.add_handler(CallbackQueryHandler(button_click))
+
+def build_application(token):
+    """Bitta bot uchun Application - keshlar, MongoDB va HTTP serverlar botlar orasida umumiy"""
+    if MULTI_INSTANCE:
+        # Foydalanuvchi holati nusxalar orasida MongoDB orqali bo'lishiladi
+        persistence = MongoUserDataPersistence(update_interval=1, always_refresh=True)
+    else:
+        persistence = MongoUserDataPersistence(collection_name=user_states_collection_name(token))
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(TrackedRequest(connection_pool_size=256))
+        .get_updates_request(TrackedRequest())
+        .persistence(persistence)
+    )
+    if not MULTI_BOT:
+        # Bir nechta bot rejimida bu bosqichlarni run_bots_polling bir marta chaqiradi
+        builder = builder.post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    application = builder.build()
+    add_handlers(application)
+    
+    # Har bir botning o'z foydalanuvchi holati va to'xtashda saqlangan yuborishlari
+    application.job_queue.run_repeating(
+        evict_idle_user_data, interval=USER_STATE_EVICT_INTERVAL, first=USER_STATE_EVICT_INTERVAL)
+    application.job_queue.run_once(resume_pending_deliveries, when=5)
+    bot_host.add(application)
+    return application
+
+def run_bots_polling(applications):
+    """run_polling ning bir nechta bot uchun varianti: bitta event loop, post_* bosqichlari bir marta"""
+    loop = asyncio.get_event_loop()
+    primary = applications[0]
+    try:
+        loop.run_until_complete(asyncio.gather(*(application.initialize() for application in applications)))
+        loop.run_until_complete(post_init(primary))
+        for application in applications:
+            loop.run_until_complete(application.updater.start_polling(
+                allowed_updates=Update.ALL_TYPES))  # chat_member yangilanishlari uchun
+            loop.run_until_complete(application.start())
+        loop.run_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass  # ShutdownCoordinator signalda SystemExit ko'taradi
+    finally:
+        try:
+            for application in applications:
+                if application.updater.running:
+                    loop.run_until_complete(application.updater.stop())
+            # Davom etayotgan yuborishlar barcha botlarda bir vaqtda yakunlanadi
+            loop.run_until_complete(asyncio.gather(
+                *(application.stop() for application in applications if application.running)))
+            loop.run_until_complete(post_stop(primary))
+            loop.run_until_complete(asyncio.gather(*(application.shutdown() for application in applications)))
+            loop.run_until_complete(post_shutdown(primary))
+        finally:
+            loop.close()
 
 # Asosiy ishga tushirish funksiyasi
 def main():
     """Asosiy funksiya"""
+    setup_logging()
     try:
-        print("🚀 Bot va serverlar ishga tushmoqda...")
+        check_config()
+        startup_log.info("🚀 Bot va serverlar ishga tushmoqda...")
+
+        # SIGTERM/SIGINT - ishga tushish davomida ham tartib bilan to'xtash
+        # (PTB run_polling/run_webhook va run_bots_polling aynan shu loop ni oladi)
+        shutdown_coordinator.install(asyncio.get_event_loop())
+        
+        # MongoDB va keshlar fonda tayyorlanadi
+        begin_startup()
         
         # Flask serverni yangi threadda ishga tushirish
         flask_thread = threading.Thread(target=run_flask, daemon=True)
         flask_thread.start()
-        print("🌐 Flask server 10000 portda ishga tushdi")
+        http_log.info(f"🌐 Flask server {FLASK_PORT} portda ishga tushdi")
         
         # aiohttp serverni yangi threadda ishga tushirish
         aiohttp_thread = threading.Thread(target=run_aiohttp_server, daemon=True)
         aiohttp_thread.start()
-        print("🌐 aiohttp server 8080 portda ishga tushdi")
+        http_log.info(f"🌐 aiohttp server {AIOHTTP_PORT} portda ishga tushdi")
         
         # Botni faol saqlash
         keep_alive()
+        startup_timer.mark("serverlar")
         
-        # Telegram botni ishga tushirish
-        application = Application.builder().token(TOKEN).build()
-        
-        # Buyruqlar
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("kod", add_code))
-        application.add_handler(CommandHandler("tahrirlash", edit_code))
-        application.add_handler(CommandHandler("ochirish", delete_code))
-        application.add_handler(CommandHandler("royxat", list_codes))
-        application.add_handler(CommandHandler("kanalqoshish", add_channel))
-        application.add_handler(CommandHandler("kanalochirish", delete_channel))
-        application.add_handler(CommandHandler("kanallar", list_channels))
-        application.add_handler(CommandHandler("addAdmin", add_admin))
-        application.add_handler(CommandHandler("removeAdmin", remove_admin))
-        application.add_handler(CommandHandler("users", export_users))
-        application.add_handler(CommandHandler("yordam", user_help))
-        application.add_handler(CommandHandler("help", bot_help))
-        application.add_handler(CommandHandler("admin", start))
-        
-        # Xabarlar
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user_message))
-        application.add_handler(MessageHandler(filters.CONTACT, handle_user_message))
-        
-        # Tugmalar
-        application.add_handler(CallbackQueryHandler(button_click))
-
-        print("🤖 Bot ishga tushdi...")
-        print(f"👤 Asosiy admin: {ADMIN_ID}")
-        print(f"📊 MongoDB Database: {MONGO_DB_NAME}")
-        print("⏳ Bot polling ni boshladi...")
+        # Telegram botlarni yaratish (BOT_TOKENS da bir nechta bo'lsa - ko'zgu botlar)
+        applications = [build_application(token) for token in BOT_TOKENS]
+        application = applications[0]
+
+        # Jarayon uchun umumiy vazifalar - faqat asosiy botning JobQueue sida
+        # Kod statistikasini davriy yozish. leader_only emas: hisoblagichlar har bir
+        # nusxaning o'z xotirasida yig'iladi va $inc bilan qo'shiladi - har nusxa
+        # o'zinikini yozmasa, lider bo'lmagan nusxalardagi so'rovlar yo'qoladi
+        application.job_queue.run_repeating(
+            flush_code_stats, interval=CODE_STATS_FLUSH_INTERVAL, first=CODE_STATS_FLUSH_INTERVAL)
+        
+        if MULTI_INSTANCE:
+            application.job_queue.run_repeating(renew_leader_lease, interval=LEASE_TTL / 3, first=0)
+            application.job_queue.run_repeating(
+                sync_shared_caches_job, interval=CACHE_SYNC_INTERVAL, first=CACHE_SYNC_INTERVAL)
+        
+        # Faol bo'lmagan foydalanuvchilarni arxivga ko'chirish
+        application.job_queue.run_repeating(
+            leader_only(archive_users_job), interval=USER_ARCHIVE_INTERVAL, first=10 * 60)
+        
+        # ⏱️ JobQueue polling boshlangandan keyin ishga tushadi
+        application.job_queue.run_once(report_startup, when=0)
+        startup_timer.mark("application")
+
+        startup_log.info("🤖 Bot ishga tushdi...")
+        startup_log.info(f"👤 Asosiy admin: {ADMIN_ID}")
+        startup_log.info(f"📊 MongoDB Database: {MONGO_DB_NAME}")
         
         # Botni ishga tushirish
-        application.run_polling()
+        if MULTI_BOT:
+            startup_log.info(f"⏳ {len(applications)} ta bot bitta jarayonda polling ni boshladi...")
+            run_bots_polling(applications)
+        elif MULTI_INSTANCE:
+            # Bir nechta nusxa bitta webhook manzili ortida (load balancer) ishlaydi
+            startup_log.info(f"⏳ Bot webhook rejimida ishlamoqda ({INSTANCE_ID}, port {WEBHOOK_PORT})...")
+            application.run_webhook(
+                listen='0.0.0.0',
+                port=WEBHOOK_PORT,
+                url_path='telegram',
+                webhook_url=f"{WEBHOOK_URL}/telegram",
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,  # chat_member yangilanishlari uchun
+                stop_signals=None  # Signallarni ShutdownCoordinator boshqaradi
+            )
+        else:
+            startup_log.info("⏳ Bot polling ni boshladi...")
+            application.run_polling(
+                allowed_updates=Update.ALL_TYPES,  # chat_member yangilanishlari uchun
+                stop_signals=None  # Signallarni ShutdownCoordinator boshqaradi
+            )
         
     except Exception as e:
-        print(f"❌ Botda xato yuz berdi: {e}")
+        log.critical(f"❌ Botda xato yuz berdi: {e}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
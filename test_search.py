@@ -0,0 +1,112 @@
+"""Qidiruv va deep-link yordamchilari uchun testlar
+
+Sof funksiyalar - Telegram va MongoDB kerak emas (main.py faqat import qilinadi).
+
+Foydalanish: python -m pytest -q
+"""
+import pytest
+
+import main
+from main import TitleIndex, code_deep_link, code_from_start_payload, code_start_payload, parse_code_meta, tokenize
+
+def make_index(*items):
+    index = TitleIndex()
+    index.rebuild((key, meta) for key, meta in items)
+    return index
+
+# ==================== NORMALLASHTIRISH ====================
+
+def test_cyrillic_folds_to_latin():
+    assert tokenize("Ўткан кунлар") == tokenize("o'tkan kunlar") == ['otkan', 'kunlar']
+
+@pytest.mark.parametrize("text", ["o'tkan", "oʻtkan", "o`tkan", "o’tkan", "OʼTKAN", "Ўткан"])
+def test_apostrophe_variants(text):
+    assert tokenize(text) == ['otkan']
+
+def test_multi_letter_transliteration_and_diacritics():
+    assert tokenize("Щука, Юлдуз — Café 2023") == ['shuka', 'yulduz', 'cafe', '2023']
+
+# ==================== TitleIndex ====================
+
+def test_search_matches_across_scripts():
+    index = make_index(('k1', ("O'tkan kunlar", 1969, 'drama')), ('k2', ("Mehrobdan chayon", 1970, 'drama')))
+    assert index.search("Ўткан кунлар") == ['k1']
+
+def test_last_token_matches_as_prefix():
+    index = make_index(('k1', ("O'tkan kunlar", 1969, 'drama')), ('k2', ("Kelinlar qo'zg'oloni", 1984, 'komediya')))
+    assert index.search("o'tkan ku") == ['k1']
+    assert index.search("kel") == ['k2']
+
+def test_only_last_token_is_prefix():
+    index = make_index(('k1', ("O'tkan kunlar", 1969, 'drama')))
+    assert index.search("o'tk kunlar") == ['k1']  # "o'tk" to'liq so'z emas - faqat "kunlar" mos
+    assert index.search("o'tk") == ['k1']
+    assert index.search("kun o'tkan") == ['k1']
+    assert index.search("xyz") == []
+
+def test_more_matched_terms_rank_first():
+    index = make_index(
+        ('k1', ("Kino bir", 2020, 'drama')),
+        ('k2', ("Kino ikki", 2021, 'drama')),
+        ('k3', ("Kino bir ikki", 2022, 'drama')),
+    )
+    assert index.search("kino bir ikki")[0] == 'k3'
+
+def test_rare_term_survives_candidate_cap():
+    items = [(f'k{i}', (f"Kino {i}", 2020, 'drama')) for i in range(20)]
+    items.append(('zorro', ("Kino Zorro", 1998, 'sarguzasht')))
+    index = make_index(*items)
+    index.MAX_CANDIDATES = 5
+    assert index.search("kino zorro", limit=1) == ['zorro']
+
+def test_common_term_is_capped():
+    index = make_index(*[(f'k{i}', (f"Kino {i}", 2020, 'drama')) for i in range(20)])
+    index.MAX_CANDIDATES = 5
+    found = index.search("kino", limit=50)
+    assert len(found) == 5 and set(found) <= {f'k{i}' for i in range(20)}
+
+def test_add_replaces_and_remove_drops_terms():
+    index = make_index(('k1', ("Avatar", 2009, 'fantastika')))
+    index.add('k1', ("Titanik", 1997, 'drama'))
+    assert index.search("avatar") == []
+    assert index.search("titanik") == ['k1']
+    index.remove('k1')
+    assert index.search("titanik") == []
+    assert len(index) == 0
+
+# ==================== KOD MA'LUMOTLARI ====================
+
+def test_parse_code_meta_full_and_partial():
+    assert parse_code_meta("Avatar | 2009 | Fantastika") == {'title': 'Avatar', 'year': 2009, 'genre': 'Fantastika'}
+    assert parse_code_meta(['Avatar', '|', '2009.0']) == {'title': 'Avatar', 'year': 2009}
+    assert parse_code_meta(" | | Drama") == {'genre': 'Drama'}
+    assert parse_code_meta("") == {}
+
+@pytest.mark.parametrize("year", ["ikki ming", "1700", "3000"])
+def test_parse_code_meta_rejects_bad_year(year):
+    with pytest.raises(ValueError):
+        parse_code_meta(f"Avatar | {year}")
+
+# ==================== /start DEEP-LINK ====================
+
+def test_plain_code_is_its_own_payload():
+    assert code_start_payload("Kino_123-A") == "Kino_123-A"
+    assert code_from_start_payload("Kino_123-A") == "Kino_123-A"
+
+@pytest.mark.parametrize("code", ["Ўткан кунлар 2", "kino 7", "b64-abc", "o'tkan"])
+def test_payload_round_trip(code):
+    payload = code_start_payload(code)
+    assert payload.startswith(main.START_PAYLOAD_B64)
+    assert main.START_PAYLOAD_PATTERN.match(payload)
+    assert code_from_start_payload(payload) == code
+
+def test_too_long_code_has_no_link():
+    code = "Ў" * 40
+    assert code_start_payload(code) is None
+    assert code_deep_link("kino_bot", code) is None
+
+def test_deep_link_format():
+    assert code_deep_link("kino_bot", "123") == "https://t.me/kino_bot?start=123"
+
+def test_invalid_b64_payload():
+    assert code_from_start_payload("b64-_w") is None  # 0xff - UTF-8 emas